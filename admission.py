@@ -0,0 +1,101 @@
+# admission.py
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from ratelimit import TokenBucket
+
+# Flood control settings for search handlers
+USER_SEARCH_RATE = float(os.getenv('USER_SEARCH_RATE', 0.5))  # searches per second per user, sustained
+USER_SEARCH_BURST = int(os.getenv('USER_SEARCH_BURST', 5))  # searches a user may fire back to back
+MAX_INFLIGHT_SEARCHES = int(os.getenv('MAX_INFLIGHT_SEARCHES', 64))
+ADMISSION_WAIT = float(os.getenv('ADMISSION_WAIT', 2))  # seconds a search may wait for a free slot
+REPEAT_WINDOW = float(os.getenv('REPEAT_WINDOW', 10))  # seconds in which a repeated query is ignored
+LIMIT_NOTICE_INTERVAL = 30  # seconds between "slow down" replies to the same user
+TRACKED_USERS = 50000  # per-user state kept for the most recently active users
+
+# Admission outcomes
+ADMITTED = "admitted"
+RATE_LIMITED = "rate_limited"
+DUPLICATE = "duplicate"
+
+
+class Busy(Exception):
+    """No search slot became free within the admission wait."""
+
+
+class AdmissionControl:
+    """Decides whether a search may run before it costs anything.
+
+    Each user has a token bucket (``rate`` per second, bursts of ``burst``);
+    the same query from the same user again within ``repeat_window`` is
+    dropped, since the earlier answer is still on screen (callers ``forget``
+    a query that was turned away rather than answered). Admitted searches
+    then take one of ``max_inflight`` global slots, waiting at most
+    ``wait`` seconds for one. Per-user state is kept in an LRU of the most
+    recently active users.
+    """
+
+    def __init__(self, rate=USER_SEARCH_RATE, burst=USER_SEARCH_BURST, max_inflight=MAX_INFLIGHT_SEARCHES,
+                 wait=ADMISSION_WAIT, repeat_window=REPEAT_WINDOW, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_inflight = max_inflight
+        self.wait = wait
+        self.repeat_window = repeat_window
+        self.clock = clock
+        self._users = OrderedDict()  # user id -> [bucket, last query, last query time, last notice time]
+        self._slots = asyncio.Semaphore(max_inflight)
+        self.inflight = 0
+
+    def _state(self, user_id):
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = [TokenBucket(self.rate, self.burst, clock=self.clock), None, 0.0, None]
+            if len(self._users) > TRACKED_USERS:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    def check(self, user_id, query):
+        """Classify a search: ADMITTED, DUPLICATE or RATE_LIMITED."""
+        state = self._state(user_id)
+        now = self.clock()
+        if query == state[1] and now - state[2] < self.repeat_window:
+            return DUPLICATE
+        if not state[0].try_acquire():
+            return RATE_LIMITED
+        state[1], state[2] = query, now
+        return ADMITTED
+
+    def forget(self, user_id, query):
+        """Let ``query`` through again right away, e.g. after it was turned away instead of answered."""
+        state = self._users.get(user_id)
+        if state is not None and state[1] == query:
+            state[1], state[2] = None, 0.0
+
+    def should_notify(self, user_id):
+        """True at most once per LIMIT_NOTICE_INTERVAL per user, so a flood gets one reply."""
+        state = self._state(user_id)
+        now = self.clock()
+        if state[3] is not None and now - state[3] < LIMIT_NOTICE_INTERVAL:
+            return False
+        state[3] = now
+        return True
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of the global search slots; raises Busy if none frees up in time."""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.wait)
+        except asyncio.TimeoutError:
+            raise Busy()
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self._slots.release()
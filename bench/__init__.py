@@ -0,0 +1 @@
+# Benchmarks and load tests; run them from the repository root, e.g. `python -m bench.load_test`
@@ -0,0 +1,171 @@
+# bench/corpus.py
+import random
+
+# Word lists for made-up titles; combined they give millions of distinct names
+ADJECTIVES = [
+    "Dark", "Silent", "Lost", "Broken", "Hidden", "Last", "Crimson", "Frozen", "Golden", "Savage",
+    "Wild", "Eternal", "Hollow", "Burning", "Secret", "Midnight", "Iron", "Scarlet", "Shattered", "Fallen",
+    "Brave", "Quiet", "Electric", "Forgotten", "Rising", "Wicked", "Little", "Mighty", "Endless", "Final",
+]
+NOUNS = [
+    "Kingdom", "River", "Empire", "Shadow", "Storm", "Heart", "Road", "City", "Ocean", "Garden",
+    "Mountain", "Knight", "Dragon", "Mirror", "Island", "Forest", "Horizon", "Planet", "Voyage", "Legacy",
+    "Hunter", "Castle", "Machine", "Promise", "Signal", "Harbor", "Frontier", "Prophecy", "Throne", "Echo",
+]
+PLACES = [
+    "Paris", "Tokyo", "Mumbai", "Cairo", "Berlin", "Havana", "Sahara", "Avalon", "Atlantis", "Mars",
+    "Brooklyn", "Goa", "Kyoto", "Lagos", "Rome", "Texas", "Alaska", "Bombay", "Venice", "Seoul",
+]
+
+
+# Deterministic "<title> (<year>)" names; a few share a base title with a different year
+def synthetic_titles(size, seed=0):
+    rng = random.Random(seed)
+    titles = []
+    seen = set()
+    while len(titles) < size:
+        shape = rng.random()
+        if shape < 0.4:
+            base = f"The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+        elif shape < 0.7:
+            base = f"{rng.choice(NOUNS)} of {rng.choice(PLACES)}"
+        else:
+            base = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.randint(2, 5)}"
+        title = f"{base} ({rng.randint(1960, 2025)})"
+        if title not in seen:
+            seen.add(title)
+            titles.append(title)
+    return titles
+
+
+# Title -> url mapping in the upstream JSON shape
+def synthetic_catalog(size, seed=0):
+    return {title: f"https://example.com/m/{position}" for position, title in enumerate(synthetic_titles(size, seed))}
+
+
+# Misspell a query the way people type on phones: drop, swap or repeat a letter
+def add_typo(text, rng):
+    letters = [i for i, ch in enumerate(text) if ch.isalpha()]
+    if len(letters) < 2:
+        return text
+    i = rng.choice(letters[:-1])
+    kind = rng.random()
+    if kind < 0.4:
+        return text[:i] + text[i + 1:]
+    if kind < 0.7:
+        return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+    return text[:i] + text[i] + text[i:]
+
+
+# Search queries the way users send them: lower case, no year, sometimes misspelled
+def user_queries(titles, count, seed=0, typo_ratio=0.3):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        query = rng.choice(titles).rsplit(" (", 1)[0].lower()
+        if rng.random() < typo_ratio:
+            query = add_typo(query, rng)
+        queries.append(query)
+    return queries
+
+
+# Language tags the way uploaders write them, and how a user would type each one
+LANGUAGES = ["Hindi", "Tamil", "Telugu", "Malayalam", "Kannada", "English", "Korean", "Bengali"]
+LANGUAGE_TAGS = ["[{}]", "({} Dubbed)", "{} + English", "[{} Audio]"]
+
+
+# A made-up base title; the subtitle patterns give enough names for a 200k catalog
+def _base_title(rng):
+    shape = rng.random()
+    if shape < 0.2:
+        return f"The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+    if shape < 0.35:
+        return f"{rng.choice(NOUNS)} of {rng.choice(PLACES)}"
+    if shape < 0.5:
+        return f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.randint(2, 5)}"
+    if shape < 0.75:
+        return f"The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} of {rng.choice(PLACES)}"
+    return f"{rng.choice(NOUNS)}: The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+
+
+# Catalog entries as (title, base, season, year, language). About a quarter are
+# series seasons ("S02" or "Season 2"), about a third carry a language tag, and
+# popular names come back in several years, seasons and languages.
+def labeled_titles(size, seed=0):
+    rng = random.Random(seed)
+    entries = []
+    seen = set()
+    bases = []
+    while len(entries) < size:
+        if bases and rng.random() < 0.3:
+            base = rng.choice(bases)
+        else:
+            base = _base_title(rng)
+            bases.append(base)
+        season = rng.randint(1, 8) if rng.random() < 0.25 else None
+        year = rng.randint(1960, 2025)
+        language = rng.choice(LANGUAGES) if rng.random() < 0.35 else None
+
+        title = base
+        if season is not None:
+            title += f" S{season:02d}" if rng.random() < 0.5 else f" Season {season}"
+        title += f" ({year})"
+        if language is not None:
+            title += " " + rng.choice(LANGUAGE_TAGS).format(language)
+        if title not in seen:
+            seen.add(title)
+            entries.append((title, base, season, year, language))
+    return entries
+
+
+# Labeled search queries for labeled_titles() entries, as (query, kind, answers).
+# ``answers`` holds every catalog title the query cannot tell apart from the one
+# it was made from: a query without a year accepts all years of that name and
+# season, one with a year accepts all language versions of that release.
+#   exact    the full title, lower case
+#   name     name (and season) only, the way most users search
+#   year     name and year
+#   language name and language, e.g. "dark river hindi"
+#   typo     name with one or two typos
+#   partial  a few words of a longer name: a leading or trailing word dropped
+def labeled_queries(entries, count, seed=0):
+    rng = random.Random(seed)
+    by_name = {}
+    by_release = {}
+    for title, base, season, year, language in entries:
+        by_name.setdefault((base, season), []).append(title)
+        by_release.setdefault((base, season, year), []).append(title)
+
+    kinds = ["exact", "name", "year", "language", "typo", "partial"]
+    queries = []
+    while len(queries) < count:
+        title, base, season, year, language = rng.choice(entries)
+        kind = kinds[len(queries) % len(kinds)]
+        words = base.lower().replace(":", "").split()
+        suffix = ""
+        if season is not None:
+            suffix = f" season {season}" if rng.random() < 0.5 else f" s{season:02d}"
+        name = " ".join(words) + suffix
+        answers = by_name[(base, season)]
+
+        if kind == "exact":
+            query, answers = title.lower(), [title]
+        elif kind == "name":
+            query = name
+        elif kind == "year":
+            query, answers = f"{name} {year}", by_release[(base, season, year)]
+        elif kind == "language":
+            if language is None:
+                continue
+            query = f"{name} {language.lower()}"
+            answers = [t for t in answers if language in t]
+        elif kind == "typo":
+            query = add_typo(name, rng)
+            if rng.random() < 0.3:
+                query = add_typo(query, rng)
+        else:
+            if len(words) < 4:
+                continue
+            query = " ".join(words[1:] if rng.random() < 0.5 else words[:-1]) + suffix
+        queries.append((query, kind, tuple(answers)))
+    return queries
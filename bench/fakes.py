@@ -0,0 +1,240 @@
+# bench/fakes.py
+import asyncio
+import functools
+import hashlib
+import json
+import random
+import socket
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+BOT_USER = {"id": 100000001, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+# Methods that are never answered with an injected 429 (setup and long polling)
+NEVER_LIMITED = {"getMe", "getUpdates", "setWebhook", "deleteWebhook", "close", "logOut"}
+
+
+# Reserve a free localhost port
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_app(app, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+class FakeBotAPI:
+    """Local Bot API server that records every call.
+
+    Serves ``<base_url><token>/<method>`` like api.telegram.org, with just
+    enough of each result for python-telegram-bot to parse it. ``latency``
+    (plus up to ``jitter``) seconds are added to every call, and a
+    ``rate_limit_ratio`` share of calls is answered with a 429 carrying
+    ``retry_after``. ``getUpdates`` long-polls ``updates`` for polling mode.
+    Every recorded call is passed to ``on_call(method, params, at)``.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_ratio=0.0, retry_after=1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls = Counter()  # method -> calls answered
+        self.limited = Counter()  # method -> calls answered with 429
+        self.polls = 0  # getUpdates requests, kept out of ``calls``
+        self.updates = asyncio.Queue()
+        self.on_call = None
+        self._message_id = 1000
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    @staticmethod
+    async def _params(request):
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for name, value in (await request.post()).items():
+            # Nested objects (reply_markup, ...) arrive JSON encoded
+            params[name] = value if isinstance(value, str) else value.file.read()
+        return params
+
+    def _message(self, chat_id, message_id=None, text=None):
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        return {
+            "message_id": int(message_id),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": BOT_USER,
+            "text": text or "",
+        }
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "sendDocument"):
+            return self._message(params["chat_id"], text=params.get("text"))
+        if method == "editMessageText":
+            return self._message(params["chat_id"], params["message_id"], params.get("text"))
+        if method == "getChatMember":
+            return {"status": "member", "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "User"}}
+        return True
+
+    async def _get_updates(self, params):
+        timeout = float(params.get("timeout") or 0)
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self.updates.get(), timeout))
+        except asyncio.TimeoutError:
+            return []
+        while not self.updates.empty() and len(updates) < 100:
+            updates.append(self.updates.get_nowait())
+        return updates
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = await self._params(request)
+        if method == "getUpdates":
+            self.polls += 1
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+        if method not in NEVER_LIMITED and self.rng.random() < self.rate_limit_ratio:
+            self.limited[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+
+        self.calls[method] += 1
+        if self.on_call is not None:
+            self.on_call(method, params, time.perf_counter())
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+
+# Serve a catalog mapping at /catalog.json, with an ETag so conditional refreshes get 304s
+def catalog_app(movies):
+    body = json.dumps(movies).encode("utf-8")
+    etag = f'"{hashlib.md5(body).hexdigest()}"'
+
+    async def serve(request):
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(body=body, content_type="application/json", headers={"ETag": etag})
+
+    app = web.Application()
+    app.router.add_get("/catalog.json", serve)
+    return app
+
+
+# mongomock scans a whole collection even for _id lookups; doing that on the event loop
+# would stall the bot in ways a real database server never does. All mongomock work runs
+# on this one thread instead, which also keeps the (not thread-safe) mock consistent.
+_mongomock_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mongomock")
+
+
+async def in_mongomock_thread(func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(_mongomock_thread, functools.partial(func, *args, **kwargs))
+
+
+class AsyncCursor:
+    """Async iteration over a mongomock cursor; each batch of documents costs ``latency`` seconds."""
+
+    def __init__(self, cursor, latency=0.0):
+        self._cursor = cursor
+        self._latency = latency
+        self._batch_size = 101  # MongoDB's default first batch
+        self._left_in_batch = 0
+        self._documents = None
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, count):
+        self._cursor = self._cursor.limit(count)
+        return self
+
+    def batch_size(self, size):
+        self._batch_size = size
+        return self
+
+    def __aiter__(self):
+        return self
+
+    # mongomock's Cursor.__next__ copies the whole result list on every call, which makes
+    # iterating a large collection quadratic; take the computed list once instead
+    def _results(self):
+        compute = getattr(self._cursor, "_compute_results", None)
+        return iter(compute(with_limit_and_skip=True) if compute else list(self._cursor))
+
+    async def __anext__(self):
+        if self._documents is None:
+            self._documents = await in_mongomock_thread(self._results)
+        if self._left_in_batch == 0:
+            if self._latency:
+                await asyncio.sleep(self._latency)
+            self._left_in_batch = self._batch_size
+        try:
+            document = next(self._documents)
+        except StopIteration:
+            raise StopAsyncIteration
+        self._left_in_batch -= 1
+        return document
+
+
+class AsyncCollection:
+    """The subset of PyMongo's async collection API the bot uses, over mongomock.
+
+    Every call, and every cursor batch, waits ``latency`` seconds first, like
+    a round trip to a slow database would.
+    """
+
+    def __init__(self, collection, latency=0.0):
+        self._collection = collection
+        self.latency = latency
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self._collection.find(*args, **kwargs), self.latency)
+
+    def aggregate(self, *args, **kwargs):
+        return AsyncCursor(iter(self._collection.aggregate(*args, **kwargs)), self.latency)
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return await in_mongomock_thread(method, *args, **kwargs)
+        return call
+
+
+# Point database.py's collections at an in-memory mongomock database, with ``latency``
+# seconds per call. Must run before bot.py is imported, since it binds the users collection at import time.
+def install_mongomock(latency=0.0):
+    import mongomock
+    import database
+
+    mock_db = mongomock.MongoClient()["movie_bot"]
+    for name in dir(database):
+        if name.endswith("_collection"):
+            collection = getattr(database, name)
+            setattr(database, name, AsyncCollection(mock_db[collection.name], latency))
+    return mock_db
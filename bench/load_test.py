@@ -0,0 +1,341 @@
+# bench/load_test.py
+"""End-to-end load test of the bot against local stand-ins.
+
+Runs the real application from ``bot.run_bot`` with a fake Bot API
+(``TELEGRAM_API_BASE_URL``), a local catalog server (``JSON_URL``) and
+mongomock, replays synthetic search messages through the webhook endpoint
+or through polling, and reports end-to-end latency percentiles, throughput
+and Bot API calls per search.
+
+    python -m bench.load_test --mode webhook --updates 2000 --rate 200
+    python -m bench.load_test --mode polling --latency-ms 40 --rate-limit 0.01
+    python -m bench.load_test --db-latency-ms 50 --seed-users 50000 --exports 3
+
+Every answer is sorted by its text: search results, or a rejection or
+failure (busy, rate limited, catalog unavailable, no match, error,
+subscribe prompt). The run fails when updates go unanswered or more than
+``--max-non-results`` of them get anything but results. Latency runs from
+handing an update to the bot (POST to the webhook, or queueing it for
+getUpdates) to the Bot API call carrying its result. The
+driver, the fakes and the bot share one event loop, so compare runs made
+with the same options rather than reading the numbers as production
+latencies. Result deletions happen a minute later and are not counted.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+
+import aiohttp
+
+from bench.corpus import synthetic_catalog, user_queries
+from bench.fakes import FakeBotAPI, catalog_app, free_port, install_mongomock, start_app
+
+TOKEN = "100000001:BENCHMARK-TOKEN"
+ADMIN_CHAT = 1  # sends the /exportusers updates; its answers are not searches
+SECRET = "bench-secret"
+LOADING_PREFIX = "🔍"  # loading messages; their edit carries the answer
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def make_message(update_id, user_id, text):
+    return {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        "text": text,
+    }
+
+
+# Search updates, with ``exports`` admin /exportusers commands spread evenly among them
+def make_updates(queries, users, command_ratio, seed, exports=0):
+    rng = random.Random(seed)
+    updates = []
+    export_every = len(queries) // (exports + 1) if exports else 0
+    for update_id, query in enumerate(queries, start=1):
+        if export_every and update_id % export_every == 0 and update_id // export_every <= exports:
+            message = make_message(update_id, ADMIN_CHAT, "/exportusers")
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": 12}]
+            updates.append({"update_id": update_id, "message": message})
+            continue
+        user_id = 500000 + update_id % users
+        message = make_message(update_id, user_id, query)
+        if rng.random() < command_ratio:
+            message["text"] = f"/search {query}"
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": 7}]
+        updates.append({"update_id": update_id, "message": message})
+    return updates
+
+
+# (text prefix, kind) pairs telling the bot's answers apart; anything else is "other"
+def reply_kinds(bot):
+    return [
+        (bot.RESULTS_TEXT.split("{")[0], "result"),
+        (bot.BUSY_TEXT, "busy"),
+        (bot.RATE_LIMIT_TEXT, "rate_limited"),
+        (bot.UNAVAILABLE_TEXT, "unavailable"),
+        (bot.NO_MATCH_TEXT, "no_match"),
+        (bot.SEARCH_ERROR_TEXT, "error"),
+        (bot.SUBSCRIBE_TEXT, "subscribe_prompt"),
+    ]
+
+
+class Tracker:
+    """Matches answers recorded by the fake API to the updates that caused them, per chat."""
+
+    def __init__(self, kinds):
+        self.kinds = kinds
+        self.sent = defaultdict(deque)  # chat id -> send times of unanswered updates
+        self.latencies = []  # of answers carrying results
+        self.replies = Counter()  # answer kind -> count
+        self.outstanding = 0
+        self.done = asyncio.Event()
+        self.first_sent = None
+        self.last_answer = None
+
+    def sent_update(self, chat_id):
+        if chat_id == ADMIN_CHAT:
+            return
+        now = time.perf_counter()
+        self.first_sent = self.first_sent or now
+        self.sent[chat_id].append(now)
+        self.outstanding += 1
+
+    def on_call(self, method, params, at):
+        if method not in ("sendMessage", "editMessageText"):
+            return
+        text = str(params.get("text", ""))
+        if text.startswith(LOADING_PREFIX):
+            return
+        pending = self.sent.get(int(params["chat_id"]))
+        if not pending:
+            return
+        kind = next((kind for prefix, kind in self.kinds if text.startswith(prefix)), "other")
+        self.replies[kind] += 1
+        sent_at = pending.popleft()
+        if kind == "result":
+            self.latencies.append(at - sent_at)
+        self.last_answer = at
+        self.outstanding -= 1
+        if self.outstanding == 0:
+            self.done.set()
+
+
+async def drive_webhook(updates, tracker, bot_port, rate, concurrency):
+    url = f"http://127.0.0.1:{bot_port}/{TOKEN}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession() as session:
+        async def post(update):
+            async with semaphore:
+                tracker.sent_update(update["message"]["chat"]["id"])
+                async with session.post(url, json=update, headers=headers) as response:
+                    statuses[response.status] += 1
+                    if response.status != 200 and update["message"]["chat"]["id"] != ADMIN_CHAT:
+                        tracker.sent[update["message"]["chat"]["id"]].pop()
+                        tracker.outstanding -= 1
+
+        tasks = []
+        for update in updates:
+            tasks.append(asyncio.create_task(post(update)))
+            if rate:
+                await asyncio.sleep(1 / rate)
+        await asyncio.gather(*tasks)
+    return statuses
+
+
+async def drive_polling(updates, tracker, api, rate):
+    for update in updates:
+        tracker.sent_update(update["message"]["chat"]["id"])
+        api.updates.put_nowait(update)
+        if rate:
+            await asyncio.sleep(1 / rate)
+    return Counter({"queued": len(updates)})
+
+
+async def wait_until(predicate, timeout, what):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Timed out waiting for {what}")
+        await asyncio.sleep(0.05)
+
+
+async def run(args):
+    api_port, catalog_port, bot_port = free_port(), free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix="bot-load-test-")
+    # bot.py and its modules read their settings at import time
+    os.environ.update({
+        "BOT_TOKEN": TOKEN,
+        "ADMIN_USER_ID": "1",
+        "CHANNEL_USERNAME": "@bench_channel",
+        "WEBHOOK_SECRET": SECRET,
+        "PORT": str(bot_port),
+        "TELEGRAM_API_BASE_URL": f"http://127.0.0.1:{api_port}/bot",
+        "JSON_URL": f"http://127.0.0.1:{catalog_port}/catalog.json",
+        "CATALOG_SNAPSHOT_PATH": os.path.join(workdir, "catalog_snapshot.bin"),
+        "RENDER_EXTERNAL_URL": f"http://127.0.0.1:{bot_port}",
+    })
+    if args.mode == "webhook":
+        os.environ["WEBHOOK_URL"] = f"http://127.0.0.1:{bot_port}"
+    else:
+        os.environ.pop("WEBHOOK_URL", None)
+    if not args.flood_control:
+        os.environ.setdefault("USER_SEARCH_RATE", "1000")
+        os.environ.setdefault("USER_SEARCH_BURST", "1000")
+        os.environ.setdefault("REPEAT_WINDOW", "0")
+
+    movies = synthetic_catalog(args.catalog_size, seed=args.seed)
+    api = FakeBotAPI(args.latency_ms / 1000, args.jitter_ms / 1000, args.rate_limit, seed=args.seed)
+    runners = [await start_app(api.app(), api_port), await start_app(catalog_app(movies), catalog_port)]
+
+    mock_db = install_mongomock(args.db_latency_ms / 1000)
+    if args.seed_users:
+        mock_db["users"].insert_many(
+            {"_id": 900000 + i, "username": f"user{i}", "first_name": f"User{i}"} for i in range(args.seed_users)
+        )
+    import bot
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    bot_task = asyncio.create_task(bot.run_bot())
+    try:
+        await wait_until(
+            lambda: bot_task.done() or (bot.catalog_store.snapshot and (api.calls["setWebhook"] if args.mode == "webhook" else api.polls)),
+            args.startup_timeout, "the bot to start"
+        )
+        if bot_task.done():
+            bot_task.result()
+        await asyncio.sleep(0.5)  # let polling or the web server settle
+
+        queries = user_queries(list(movies), args.updates, seed=args.seed, typo_ratio=args.typo_ratio)
+        updates = make_updates(queries, args.users, args.command_ratio, args.seed, args.exports)
+        tracker = Tracker(reply_kinds(bot))
+        calls_before = Counter(api.calls)
+        api.on_call = tracker.on_call
+
+        if args.mode == "webhook":
+            statuses = await drive_webhook(updates, tracker, bot_port, args.rate, args.concurrency)
+        else:
+            statuses = await drive_polling(updates, tracker, api, args.rate)
+        if tracker.outstanding:
+            try:
+                await asyncio.wait_for(tracker.done.wait(), args.drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        exports = sum(1 for update in updates if update["message"]["chat"]["id"] == ADMIN_CHAT)
+        try:
+            await wait_until(lambda: api.calls["sendDocument"] - calls_before["sendDocument"] >= exports,
+                             args.drain_timeout, "user exports")
+        except RuntimeError:
+            pass
+        # Freeze the counts together; updates still queued are answered during shutdown
+        api.on_call = None
+        calls = Counter(api.calls)
+        calls.subtract(calls_before)
+    finally:
+        bot.is_shutting_down = True
+        await asyncio.gather(bot_task, return_exceptions=True)
+        for runner in runners:
+            await runner.cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    answered = sum(tracker.replies.values())
+    results = tracker.replies["result"]
+    elapsed = (tracker.last_answer or time.perf_counter()) - (tracker.first_sent or time.perf_counter())
+    api_calls = {method: count for method, count in sorted(calls.items()) if count}
+    searches = sum(1 for update in updates if update["message"]["chat"]["id"] != ADMIN_CHAT)
+    report = {
+        "mode": args.mode,
+        "updates": searches,
+        "answered": answered,
+        "unanswered": tracker.outstanding,
+        "results": results,
+        "non_results": answered - results,
+        "replies": dict(tracker.replies.most_common()),
+        "delivery_statuses": dict(statuses),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(answered / elapsed, 1) if elapsed > 0 else None,
+        "latency_ms": {
+            "p50": round(percentile(tracker.latencies, 0.50) * 1000, 1),
+            "p95": round(percentile(tracker.latencies, 0.95) * 1000, 1),
+            "p99": round(percentile(tracker.latencies, 0.99) * 1000, 1),
+            "mean": round(statistics.fmean(tracker.latencies) * 1000, 1) if tracker.latencies else None,
+        },
+        "api_calls": api_calls,
+        "api_calls_per_search": round(sum(api_calls.values()) / answered, 2) if answered else None,
+        "injected_429s": dict(api.limited),
+        "exports": {"requested": len(updates) - searches, "sent": calls["sendDocument"]},
+        "db_latency_ms": args.db_latency_ms,
+    }
+    return report
+
+
+def print_report(report):
+    latency = report["latency_ms"]
+    print(f"mode            {report['mode']}")
+    print(f"updates         {report['updates']} sent, {report['answered']} answered, {report['unanswered']} unanswered")
+    print(f"replies         {report['results']} results, {report['non_results']} other {report['replies']}")
+    print(f"deliveries      {report['delivery_statuses']}")
+    print(f"throughput      {report['updates_per_s']} updates/s over {report['elapsed_s']}s")
+    print(f"latency (ms)    p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  mean {latency['mean']}")
+    print(f"api calls       {report['api_calls_per_search']} per search {report['api_calls']}")
+    if report["exports"]["requested"]:
+        print(f"user exports    {report['exports']['sent']}/{report['exports']['requested']} sent (db latency {report['db_latency_ms']}ms)")
+    if report["injected_429s"]:
+        print(f"injected 429s   {report['injected_429s']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=("webhook", "polling"), default="webhook")
+    parser.add_argument("--updates", type=int, default=1000, help="search messages to send")
+    parser.add_argument("--users", type=int, default=300, help="distinct users sending them")
+    parser.add_argument("--rate", type=float, default=0, help="updates per second to offer (0: as fast as possible)")
+    parser.add_argument("--concurrency", type=int, default=64, help="webhook requests in flight")
+    parser.add_argument("--catalog-size", type=int, default=5000)
+    parser.add_argument("--typo-ratio", type=float, default=0.3)
+    parser.add_argument("--command-ratio", type=float, default=0.2, help="share of searches sent as /search")
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every Bot API call")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--rate-limit", type=float, default=0, help="share of Bot API calls answered with 429")
+    parser.add_argument("--db-latency-ms", type=float, default=0, help="added to every database call and cursor batch")
+    parser.add_argument("--seed-users", type=int, default=0, help="users in the database before the run")
+    parser.add_argument("--exports", type=int, default=0, help="admin /exportusers commands sent among the searches")
+    parser.add_argument("--flood-control", action="store_true", help="keep the bot's per-user flood control")
+    parser.add_argument("--max-non-results", type=float, default=0,
+                        help="share of updates that may be answered with something other than results")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's INFO logging")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    failed = report["unanswered"] > 0 or report["non_results"] > args.max_non_results * report["updates"]
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# bench/search_quality.py
+"""Search quality and speed benchmark for the fuzzy matcher.
+
+Builds a synthetic catalog (titles with years, seasons and language tags)
+and a labeled query set with typos and partial names from
+``bench.corpus``, then runs the queries through each engine and reports
+queries/s, latency, memory and recall@6. Engines:
+
+    baseline        ``process.extract`` over every title, as the bot searched
+                    before the search index existed
+    fuzzywuzzy@N    ``SearchIndex`` with the fuzzywuzzy scorer and a
+                    candidate limit of N
+    rapidfuzz       ``SearchIndex`` with the rapidfuzz scorer (needs
+                    rapidfuzz and numpy)
+
+    python -m bench.search_quality --sizes 10000,50000,200000
+    python -m bench.search_quality --engines fuzzywuzzy,rapidfuzz --candidate-limits 100,300,1000
+    python -m bench.search_quality --sizes 200000 --baseline-queries 0 --json results.json
+
+A query counts as recalled when one of the titles it was made from is in
+the top 6 (see ``labeled_queries`` for what each kind accepts). The
+baseline is slow, so it only runs the first ``--baseline-queries``
+queries; every engine is also scored on that subset, together with its
+overlap with the baseline's top 6 and the share of queries where its top
+6 scores equal the baseline's (ties on the last score are common, and
+breaking them differently is not a loss). Without python-Levenshtein the
+baseline runs on pure Python and takes seconds per query. The exit status is 1 when an engine's
+recall on that subset falls more than ``--max-recall-drop`` below the
+baseline, so the same command works as a regression check.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+from fuzzywuzzy import process
+
+from bench.corpus import labeled_queries, labeled_titles
+from bench.load_test import percentile
+from compact_catalog import CompactCatalog
+from search_index import SearchIndex, get_scorer
+
+RESULT_LIMIT = 6  # results the bot shows per search
+
+
+# Run ``build()`` and return its result, wall time, and the memory it left allocated
+def measure(build):
+    started = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - started
+    # Build again under tracemalloc; tracing slows it down too much to time the same run
+    tracemalloc.start()
+    try:
+        result = build()
+        allocated = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, allocated
+
+
+# Run queries through ``search`` in batches; latency is how long each query's batch took
+def run_engine(search, queries, batch_size):
+    results, latencies = [], []
+    started = time.perf_counter()
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        batch_started = time.perf_counter()
+        results.extend(search(batch))
+        latencies.extend([time.perf_counter() - batch_started] * len(batch))
+    return results, time.perf_counter() - started, latencies
+
+
+def found_titles(found):
+    return {title for title, _ in found}
+
+
+def recall(results, labeled):
+    hits = [bool(found_titles(found) & set(answers)) for found, (_, _, answers) in zip(results, labeled)]
+    return sum(hits) / len(hits) if hits else None
+
+
+def recall_by_kind(results, labeled):
+    hits = defaultdict(list)
+    for found, (_, kind, answers) in zip(results, labeled):
+        hits[kind].append(bool(found_titles(found) & set(answers)))
+    return {kind: round(sum(values) / len(values), 3) for kind, values in sorted(hits.items())}
+
+
+# Mean share of the baseline's top results that an engine also returned
+def overlap(results, baseline_results):
+    shares = [len(found_titles(found) & found_titles(expected)) / len(expected)
+              for found, expected in zip(results, baseline_results) if expected]
+    return sum(shares) / len(shares) if shares else None
+
+
+# Share of queries whose top scores equal the baseline's. Many titles often tie
+# on the last score; an engine that breaks those ties differently still returns
+# results as good as the baseline's, which ``overlap`` alone would not show.
+def score_match(results, baseline_results):
+    matches = [[score for _, score in found] == [score for _, score in expected]
+               for found, expected in zip(results, baseline_results)]
+    return sum(matches) / len(matches) if matches else None
+
+
+def engine_names(args):
+    names = []
+    for name in args.engines.split(","):
+        if name == "fuzzywuzzy":
+            names.extend(f"fuzzywuzzy@{limit}" for limit in args.candidate_limits.split(","))
+        elif name:
+            names.append(name)
+    # The baseline goes first so the other engines can be compared with it
+    return sorted(names, key=lambda name: name != "baseline")
+
+
+# Search function for one engine name, or None when its scorer is not installed
+def make_search(name, movies, index):
+    if name == "baseline":
+        titles = list(movies)
+        return lambda batch: [process.extract(query, titles, limit=RESULT_LIMIT) for query in batch]
+
+    scorer_name, _, candidate_limit = name.partition("@")
+    try:
+        scorer = get_scorer(scorer_name)
+    except RuntimeError as e:
+        print(f"skipping {name}: {e}", file=sys.stderr)
+        return None
+
+    def search(batch):
+        index.candidate_limit = int(candidate_limit) if candidate_limit else index.candidate_limit
+        return index.search_many(batch, limit=RESULT_LIMIT, scorer=scorer)
+    return search
+
+
+def bench_size(size, args):
+    entries = labeled_titles(size, seed=args.seed)
+    labeled = labeled_queries(entries, args.queries, seed=args.seed + 1)
+    queries = [query for query, _, _ in labeled]
+    movies = {title: f"https://example.com/m/{position}" for position, (title, *_) in enumerate(entries)}
+    body = json.dumps(movies)
+
+    # The baseline kept the parsed JSON dict; the bot now keeps a compact catalog plus an index
+    _, parse_s, dict_bytes = measure(lambda: json.loads(body))
+    _, catalog_s, catalog_bytes = measure(lambda: CompactCatalog.from_mapping(movies))
+    index, index_s, index_bytes = measure(lambda: SearchIndex(CompactCatalog.from_mapping(movies)))
+    index_bytes -= catalog_bytes
+    index_s -= catalog_s
+    default_limit = index.candidate_limit
+
+    report = {
+        "size": size,
+        "queries": len(labeled),
+        "build_s": {"json_dict": round(parse_s, 3), "compact_catalog": round(catalog_s, 3), "search_index": round(index_s, 3)},
+        "memory_mb": {
+            "json_dict": round(dict_bytes / 2**20, 1),
+            "compact_catalog": round(catalog_bytes / 2**20, 1),
+            "search_index": round(index_bytes / 2**20, 1),
+        },
+        "engines": [],
+    }
+
+    baseline_results = None
+    subset = labeled[:args.baseline_queries]
+    for name in engine_names(args):
+        search = make_search(name, movies, index)
+        if search is None:
+            continue
+        index.candidate_limit = default_limit
+        run_queries = queries[:len(subset)] if name == "baseline" else queries
+        results, elapsed, latencies = run_engine(search, run_queries, 1 if name == "baseline" else args.batch_size)
+        if name == "baseline":
+            baseline_results = results
+        scored = labeled[:len(results)]
+        engine = {
+            "engine": name,
+            "queries": len(results),
+            "queries_per_s": round(len(results) / elapsed, 1) if elapsed > 0 else None,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 2),
+                "p95": round(percentile(latencies, 0.95) * 1000, 2),
+                "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            },
+            f"recall_at_{RESULT_LIMIT}": round(recall(results, scored), 3),
+            "recall_by_kind": recall_by_kind(results, scored),
+        }
+        if baseline_results is not None and subset:
+            engine["subset_recall"] = round(recall(results[:len(subset)], subset), 3)
+            engine["baseline_overlap"] = round(overlap(results[:len(subset)], baseline_results), 3)
+            engine["baseline_score_match"] = round(score_match(results[:len(subset)], baseline_results), 3)
+        report["engines"].append(engine)
+    return report
+
+
+def find_regressions(reports, max_drop):
+    regressions = []
+    for report in reports:
+        baseline = next((engine for engine in report["engines"] if engine["engine"] == "baseline"), None)
+        if baseline is None or "subset_recall" not in baseline:
+            continue
+        for engine in report["engines"]:
+            if engine.get("subset_recall", 1) < baseline["subset_recall"] - max_drop:
+                regressions.append(
+                    f"{engine['engine']} at {report['size']} titles: recall {engine['subset_recall']} "
+                    f"vs baseline {baseline['subset_recall']}"
+                )
+    return regressions
+
+
+def print_report(report):
+    memory, build = report["memory_mb"], report["build_s"]
+    print(f"\n{report['size']} titles, {report['queries']} queries")
+    print(f"memory (MB)     json dict {memory['json_dict']}  compact catalog {memory['compact_catalog']}  "
+          f"search index {memory['search_index']}")
+    print(f"build (s)       json dict {build['json_dict']}  compact catalog {build['compact_catalog']}  "
+          f"search index {build['search_index']}")
+    print(f"{'engine':<18}{'queries':>8}{'q/s':>10}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'recall@' + str(RESULT_LIMIT):>10}{'subset':>8}{'overlap':>9}{'scores':>8}")
+    for engine in report["engines"]:
+        latency = engine["latency_ms"]
+        print(f"{engine['engine']:<18}{engine['queries']:>8}{engine['queries_per_s']:>10}"
+              f"{latency['p50']:>9}{latency['p95']:>9}{engine[f'recall_at_{RESULT_LIMIT}']:>10}"
+              f"{engine.get('subset_recall', '-'):>8}{engine.get('baseline_overlap', '-'):>9}"
+              f"{engine.get('baseline_score_match', '-'):>8}")
+    for engine in report["engines"]:
+        kinds = "  ".join(f"{kind} {value}" for kind, value in engine["recall_by_kind"].items())
+        print(f"  {engine['engine']:<16}{kinds}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="10000", help="comma separated catalog sizes, e.g. 10000,50000,200000")
+    parser.add_argument("--queries", type=int, default=600, help="labeled queries per catalog size")
+    parser.add_argument("--baseline-queries", type=int, default=30,
+                        help="how many of them the baseline runs (0 skips the baseline)")
+    parser.add_argument("--engines", default="baseline,fuzzywuzzy,rapidfuzz")
+    parser.add_argument("--candidate-limits", default="300", help="comma separated limits for the fuzzywuzzy engine")
+    parser.add_argument("--batch-size", type=int, default=1, help="queries per call, as the bot's search batcher groups them")
+    parser.add_argument("--max-recall-drop", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    if not args.baseline_queries:
+        args.engines = ",".join(name for name in args.engines.split(",") if name != "baseline")
+
+    reports = []
+    for size in args.sizes.split(","):
+        report = bench_size(int(size), args)
+        print_report(report)
+        reports.append(report)
+
+    regressions = find_regressions(reports, args.max_recall_drop)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"seed": args.seed, "limit": RESULT_LIMIT, "sizes": reports, "regressions": regressions}, f, indent=2)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
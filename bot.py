@@ -1,21 +1,35 @@
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, Bot
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, CallbackContext
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, Bot, InlineQueryResultArticle, InputTextMessageContent, InlineQueryResultsButton
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ChatMemberHandler, InlineQueryHandler, filters, CallbackContext
 from telegram.constants import ChatMemberStatus
 from telegram.error import Forbidden, BadRequest, TimedOut, NetworkError, Conflict
 import logging
-import requests
 import os
 import asyncio
 import random
 import signal
 import sys
-from fuzzywuzzy import process
-from pymongo import MongoClient
 import threading
 import time
 from aiohttp import web
 import json
 import aiohttp
+from catalog import catalog_store, CATALOG_REFRESH_INTERVAL, CATALOG_RETRY_DELAY, CATALOG_SYNC_INTERVAL
+from http_client import get_session, close_session
+from search_index import SearchBatcher, SearchIndex
+from search_pool import SearchPool, SEARCH_WORKERS
+from cache import result_cache, subscription_cache, normalize_query, SharedResultCache
+from user_registry import UserRegistry
+from broadcast import BroadcastEngine
+from deletions import DeletionScheduler
+from shared_state import create_backend, LeaderElection, MULTI_INSTANCE, SHARED_STATE_URL, SHARED_LOCAL_TTL, INSTANCE_ID
+import metrics
+from metrics import stage_timer, instrument_handler
+from ingest import UpdateDispatcher, WEBHOOK_WORKERS
+from singleflight import SingleFlight
+from admission import AdmissionControl, Busy, ADMITTED, RATE_LIMITED
+from inline_search import InlineDebouncer, INLINE_CACHE_TIME, INLINE_MIN_QUERY_LENGTH
+from diagnostics import loop_watchdog, profile_event_loop, parse_duration, DIAGNOSTICS_ENABLED, PROFILE_MAX_SECONDS
+import database
 
 # Set up logging
 logging.basicConfig(
@@ -31,19 +45,106 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_USER_ID = int(os.getenv('ADMIN_USER_ID'))
-JSON_URL = os.getenv('JSON_URL')
 CHANNEL_USERNAME = os.getenv('CHANNEL_USERNAME')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Bot API endpoint; point it at a local server (e.g. the load test's fake API) to run without Telegram
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot')
 
-# MongoDB setup with connection pooling
-MONGO_URL = os.getenv('MONGO_URI')
-client = MongoClient(MONGO_URL, maxPoolSize=10, minPoolSize=1, maxIdleTimeMS=30000)
-db = client['movie_bot']
-user_collection = db['users']
+# MongoDB access goes through the shared async pool in database.py
+user_collection = database.users_collection
+user_registry = UserRegistry(user_collection, database.user_stats_collection)
+# Background /broadcast sender (created in run_bot once the bot exists)
+broadcast_engine = None
+# Removes result messages after RESULT_MESSAGE_TTL, persisted across restarts (created in run_bot)
+deletion_scheduler = None
+
+# Fuzzy matching runs in worker processes when SEARCH_WORKERS > 0 (created in run_bot)
+search_pool = None
+# Groups bursts of searches into one scoring call when the scorer supports it
+search_batcher = SearchBatcher()
+
+# Inline mode: only the newest query of each user is searched and answered
+inline_debouncer = InlineDebouncer()
+
+# Searches in progress, keyed by normalized query and catalog version
+search_flight = SingleFlight()
+
+# Flood control in front of the search handlers
+admission = AdmissionControl()
+
+# Prebuilt replies for searches that are turned away, so rejecting one costs no work
+RATE_LIMIT_TEXT = "⏳ Whoa, slow down! You're searching too fast. Please wait a few seconds and try again."
+BUSY_TEXT = "🚦 The bot is very busy right now. Please try again in a moment."
+
+# Search answers that carry no results
+UNAVAILABLE_TEXT = "Sorry, movie database is currently unavailable. Please try again later."
+NO_MATCH_TEXT = "Oops, couldn't find any matching movies! 😿 \n🔍 Double-check the spelling or try using a more specific movie name.\n💡 Still no luck? Request your movie here @anonyms_middle_man_bot! 🎥✨"
+SEARCH_ERROR_TEXT = "An error😿 occurred while searching for the movie."
+SUBSCRIBE_TEXT = "🎬Bro subscribe below channels first to unlock🔓 access to 3000+ movies & series📺 — then just send the movie name! 🫣"
+
+# Sponsored link shown among the results of every chat and inline search
+AD_URL = "https://www.effectivegatecpm.com/k5h6crxw?key=765df64f5636ed1c62734405ab53072a"
+
+# Searches answered within this budget skip the loading message and its edit
+FAST_REPLY_BUDGET = int(os.getenv('FAST_REPLY_BUDGET_MS', 300)) / 1000
+
+# Number of matches shown per search
+RESULT_LIMIT = 6
+# Seconds before a search result message is deleted
+RESULT_MESSAGE_TTL = 60
+# Catalog updates adding more titles than this clear the result cache instead of re-checking it
+RESCORE_ADDED_LIMIT = 50
+# Days of daily user counters shown by /userlist
+USER_STATS_DAYS = 7
+
+# Startup timing: how long after process start the first search was answered
+process_started_at = time.monotonic()
+first_answer_after = None
+
+# Multi-instance mode (created in run_bot): state shared by all replicas and the election
+# that picks the one replica doing singleton work
+shared_backend = None
+shared_results = None
+leader_election = None
 
 # Global variables to track application state
 application = None
 is_shutting_down = False
 keep_alive_task = None
+loop_lag_task = None
+update_dispatcher = None
+
+# Singleton work (keep-alive, catalog downloads, deletion sweeps, resuming broadcasts) runs on one replica
+def is_leader():
+    return leader_election is None or leader_election.is_leader
+
+# Ping the service once, health endpoint first and the root as a fallback
+async def ping_service(service_url):
+    try:
+        # Use the shared aiohttp session for async HTTP requests
+        session = get_session()
+        timeout = aiohttp.ClientTimeout(total=30)
+
+        # Try health endpoint first
+        async with session.get(f"{service_url}/health", timeout=timeout) as response:
+            if response.status == 200:
+                logger.info(f"✅ Keep-alive ping successful (HTTP {response.status})")
+            else:
+                logger.warning(f"⚠️ Keep-alive ping returned status {response.status}")
+                
+                # Try root endpoint as fallback
+                async with session.get(service_url, timeout=timeout) as root_response:
+                    if root_response.status == 200:
+                        logger.info(f"✅ Keep-alive root ping successful (HTTP {root_response.status})")
+                    else:
+                        logger.warning(f"⚠️ Keep-alive root ping failed (HTTP {root_response.status})")
+                        
+    except aiohttp.ClientError as e:
+        logger.error(f"❌ Keep-alive ping failed with client error: {e}")
+    except asyncio.TimeoutError:
+        logger.error("❌ Keep-alive ping timed out")
+    except Exception as e:
+        logger.error(f"❌ Keep-alive ping failed with unexpected error: {e}")
 
 # Keep-alive mechanism to prevent Render from sleeping
 async def keep_alive_ping():
@@ -65,32 +166,9 @@ async def keep_alive_ping():
     logger.info(f"Keep-alive service will ping: {service_url}")
     
     while not is_shutting_down:
-        try:
-            # Use aiohttp for async HTTP requests
-            timeout = aiohttp.ClientTimeout(total=30)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                try:
-                    # Try health endpoint first
-                    async with session.get(f"{service_url}/health") as response:
-                        if response.status == 200:
-                            logger.info(f"✅ Keep-alive ping successful (HTTP {response.status})")
-                        else:
-                            logger.warning(f"⚠️ Keep-alive ping returned status {response.status}")
-                            
-                            # Try root endpoint as fallback
-                            async with session.get(service_url) as root_response:
-                                if root_response.status == 200:
-                                    logger.info(f"✅ Keep-alive root ping successful (HTTP {root_response.status})")
-                                else:
-                                    logger.warning(f"⚠️ Keep-alive root ping failed (HTTP {root_response.status})")
-                                    
-                except aiohttp.ClientError as e:
-                    logger.error(f"❌ Keep-alive ping failed with client error: {e}")
-                except asyncio.TimeoutError:
-                    logger.error("❌ Keep-alive ping timed out")
-                    
-        except Exception as e:
-            logger.error(f"❌ Keep-alive ping failed with unexpected error: {e}")
+        # With several replicas only the leader pings; it keeps the whole service awake
+        if is_leader():
+            await ping_service(service_url)
         
         # Wait 10 minutes before next ping (600 seconds)
         for _ in range(600):  # Check every second for shutdown signal
@@ -103,6 +181,7 @@ async def keep_alive_ping():
 async def error_handler(update: Update, context: CallbackContext) -> None:
     """Log the error and send a telegram message to notify the developer."""
     logger.error(msg="Exception while handling an update:", exc_info=context.error)
+    metrics.BOT_ERRORS.inc(type(context.error).__name__)
     
     # Handle specific errors
     if isinstance(context.error, Forbidden):
@@ -135,102 +214,260 @@ async def error_handler(update: Update, context: CallbackContext) -> None:
     except Exception as e:
         logger.error(f"Failed to send error message to user: {e}")
 
+SUBSCRIBED_STATUSES = [ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+
 # Function to check if a user is subscribed to the channel
 async def is_user_subscribed(user_id: int, context: CallbackContext) -> bool:
-    try:
+    async def check():
         member_status = await context.bot.get_chat_member(CHANNEL_USERNAME, user_id)
-        return member_status.status in [ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+        return member_status.status in SUBSCRIBED_STATUSES
+
+    try:
+        # Cached per user; concurrent checks for the same user share one API call
+        with stage_timer("subscription_check"):
+            return await subscription_cache.get_or_check(user_id, check)
     except Exception as e:
         logger.error(f"Error checking subscription status: {e}")
         return False
 
-# Function to fetch movie data from JSON URL with retry logic
-def fetch_movie_data():
-    urls = [JSON_URL, "https://brown-briana-33.tiiny.site/data-1.json"]
-    
-    for url in urls:
-        if not url:
-            continue
-            
-        for attempt in range(3):  # Retry 3 times
-            try:
-                response = requests.get(url, timeout=10)
-                response.raise_for_status()
-                return response.json()
-            except requests.RequestException as e:
-                logger.warning(f"Attempt {attempt + 1} failed for URL {url}: {e}")
-                if attempt < 2:  # Don't sleep on the last attempt
-                    time.sleep(2)  # Use time.sleep instead of asyncio.sleep
+# Is this chat our subscription channel? CHANNEL_USERNAME may be "@name" or a numeric id
+def is_subscription_channel(chat) -> bool:
+    if not CHANNEL_USERNAME:
+        return False
+    if chat.username and chat.username.lower() == CHANNEL_USERNAME.lstrip('@').lower():
+        return True
+    return str(chat.id) == CHANNEL_USERNAME
+
+# Refresh cached membership early from chat_member updates (needs the bot to be a channel admin)
+async def track_channel_membership(update: Update, context: CallbackContext) -> None:
+    member_update = update.chat_member
+    if not member_update or not is_subscription_channel(member_update.chat):
+        return
     
-    logger.error("Failed to fetch movie data from all URLs")
-    return {}
+    member = member_update.new_chat_member
+    subscribed = member.status in SUBSCRIBED_STATUSES
+    await subscription_cache.update(member.user.id, subscribed)
+    logger.info(f"Membership update for user {member.user.id}: {'subscribed' if subscribed else 'not subscribed'}")
+
+# Refresh the in-memory catalog in the background. With several replicas the leader
+# downloads it and publishes it; the others copy the published one
+async def refresh_catalog(context: CallbackContext = None):
+    try:
+        with stage_timer("catalog_fetch"):
+            if shared_backend is None:
+                await catalog_store.refresh()
+            elif is_leader():
+                if await catalog_store.refresh():
+                    await catalog_store.publish(shared_backend)
+            elif not await catalog_store.sync(shared_backend):
+                # Nothing published yet (the whole fleet is starting), fetch it ourselves
+                await catalog_store.refresh()
+    except Exception as e:
+        logger.error(f"Error refreshing movie catalog: {e}")
+
+# While there is no catalog at all every search fails, so retry with a short, doubling
+# delay (the job's data) instead of waiting for the regular refresh interval
+async def retry_catalog_refresh(context: CallbackContext):
+    if not catalog_store.snapshot:
+        await refresh_catalog()
+    if catalog_store.snapshot:
+        logger.info(f"📚 Catalog loaded on retry ({len(catalog_store.snapshot)} titles)")
+        return
+    delay = min(context.job.data * 2, CATALOG_REFRESH_INTERVAL)
+    logger.warning(f"Catalog still unavailable, retrying in {delay:.0f}s")
+    context.job_queue.run_once(retry_catalog_refresh, delay, data=delay, name="catalog_retry")
+
+# Followers check for a newly published catalog more often than the leader downloads one
+async def sync_catalog(context: CallbackContext = None):
+    if is_leader():
+        return
+    try:
+        await catalog_store.sync(shared_backend)
+    except Exception as e:
+        logger.error(f"Error syncing movie catalog: {e}")
+
+# Find the closest catalog matches as ranked (title, url) tuples, using the result cache
+async def find_movie_matches(movie_name: str):
+    snapshot = catalog_store.snapshot
+    if not snapshot:
+        return None
+
+    cache_key = normalize_query(movie_name)
+    cached = result_cache.get(cache_key, version=snapshot.version)
+    if cached is not None:
+        return cached[0]
+
+    # Identical searches arriving together (a new release) share one computation
+    return await search_flight.do(
+        (cache_key, snapshot.version),
+        lambda: compute_movie_matches(snapshot, cache_key, movie_name)
+    )
+
+# Cache miss: ask the other replicas, or run the fuzzy search and cache the result
+async def compute_movie_matches(snapshot, cache_key: str, movie_name: str):
+    # Another replica may have answered this query for the same catalog
+    if shared_results is not None:
+        shared = await shared_results.get(snapshot.fingerprint, cache_key)
+        if shared is not None:
+            matches, floor = tuple((title, url) for title, url in shared[0]), shared[1]
+            result_cache.set(cache_key, (matches, floor), version=snapshot.version)
+            return matches
+
+    # Use the snapshot's fuzzy search index to find the closest matches
+    with stage_timer("fuzzy_match"):
+        closest_matches = await search_batcher.search(snapshot, movie_name, limit=RESULT_LIMIT)
+    matches = tuple((title, snapshot.movies[title]) for title, _ in closest_matches)
+    # Remember the lowest score too, so a catalog update can tell whether a new title would rank
+    floor = closest_matches[-1][1] if len(closest_matches) == RESULT_LIMIT else -1
+    result_cache.set(cache_key, (matches, floor), version=snapshot.version)
+    if shared_results is not None:
+        await shared_results.set(snapshot.fingerprint, cache_key, [matches, floor])
+    return matches
+
+# Before a catalog swap: decide which cached search results survive it. Re-scoring
+# every cached query against the added titles is slow, so it runs in a worker thread.
+async def prepare_catalog_swap(old_snapshot, delta):
+    if delta is None or len(delta.added) > RESCORE_ADDED_LIMIT:
+        return None
+    return await asyncio.to_thread(rescore_cached_results, result_cache.items(), delta)
+
+# Work out the new value (or None to drop) of each cached (query, result) for a catalog delta
+def rescore_cached_results(entries, delta):
+    added_index = SearchIndex(list(delta.added)) if delta.added else None
+
+    def rescore(query, cached):
+        matches, floor = cached
+        if any(title in delta.removed for title, _ in matches):
+            return None
+        if added_index is not None:
+            best_added = added_index.search(query, limit=1)
+            if best_added and best_added[0][1] >= floor:
+                return None  # a new title would make it into this result
+        if delta.changed:
+            matches = tuple((title, delta.changed.get(title, url)) for title, url in matches)
+        return matches, floor
+
+    # Keep the checked value next to its verdict, so entries replaced meanwhile can be told apart
+    return {query: (cached, rescore(query, cached)) for query, cached in entries}
+
+# Carry cached search results over to a new catalog snapshot when only a few titles changed
+def on_catalog_swap(old_snapshot, new_snapshot, delta, verdicts):
+    if verdicts is None:
+        result_cache.set_version(new_snapshot.version)
+        return
+
+    def patch(query, cached):
+        checked, verdict = verdicts.get(query, (None, None))
+        # Entries cached while the verdicts were computed were not checked; drop them
+        return verdict if checked is cached else None
+
+    result_cache.rebase(new_snapshot.version, patch)
+
+# Leader job: resume broadcasts left running by a stopped process or a replica that went away
+async def resume_broadcasts(context: CallbackContext = None):
+    if not is_leader():
+        return
+    try:
+        await broadcast_engine.resume_interrupted()
+    except Exception as e:
+        logger.error(f"Error resuming broadcasts: {e}")
+
+# Log and export the startup-to-first-answer time, once per process
+def record_first_answer():
+    global first_answer_after
+    if first_answer_after is None:
+        first_answer_after = time.monotonic() - process_started_at
+        logger.info(f"⏱️ First search answered {first_answer_after:.2f}s after startup (catalog v{catalog_store.snapshot.version} from {catalog_store.snapshot.source})")
+
+# Function to add the sponsored button, labelled with the search, at a random position among the results
+def insert_ad_button(buttons, movie_name):
+    buttons.insert(random.randint(0, len(buttons)), InlineKeyboardButton(text=f"{movie_name}", url=AD_URL))
+    return buttons
 
 # Function to search for the movie in the JSON data
 async def search_movie_in_json(movie_name: str):
     try:
-        # Fetch movie data from the JSON URL
-        movie_data = fetch_movie_data()
+        # Searches only read the in-memory catalog snapshot, never the network
+        matches = await find_movie_matches(movie_name)
         
-        if not movie_data:
-            return "Sorry, movie database is currently unavailable. Please try again later."
+        if matches is None:
+            return UNAVAILABLE_TEXT
 
         # Initialize a list to hold button objects
         buttons = []
 
-         #  # Add the default button
-        default_button = InlineKeyboardButton(
-            text=f"{movie_name}",
-            url="https://www.effectivegatecpm.com/k5h6crxw?key=765df64f5636ed1c62734405ab53072a"
-        )
-        # buttons.append(default_button)
-
-        # Use fuzzywuzzy to find the closest matches
-        movie_names = list(movie_data.keys())
-        closest_matches = process.extract(movie_name, movie_names, limit=6)
+        if matches:
+            record_first_answer()
 
-        if closest_matches:
             # Create buttons for the closest matches
-            for match in closest_matches:
-                movie_title = match[0]
-                movie_url = movie_data[movie_title]
+            for movie_title, movie_url in matches:
                 buttons.append(InlineKeyboardButton(text=movie_title, url=movie_url))
-             # Insert default button at a random position
-            insert_pos = random.randint(0, len(buttons))  # can be at start or end too
-            buttons.insert(insert_pos, default_button)
+            insert_ad_button(buttons, movie_name)
             # Create the inline keyboard markup
             keyboard = InlineKeyboardMarkup(inline_keyboard=[[button] for button in buttons])
             return keyboard
         else:
-            return "Oops, couldn't find any matching movies! 😿 \n🔍 Double-check the spelling or try using a more specific movie name.\n💡 Still no luck? Request your movie here @anonyms_middle_man_bot! 🎥✨"
+            return NO_MATCH_TEXT
     except Exception as e:
         logger.error(f"Error searching movie data: {e}")
-        return "An error😿 occurred while searching for the movie."
+        return SEARCH_ERROR_TEXT
 
-# Function to delete the message after a delay
-async def delete_message(context: CallbackContext):
-    global is_shutting_down
-    if is_shutting_down:
+# One inline result per match; picking it posts the title with a download button
+def build_inline_result(position, movie_name, movie_title, movie_url):
+    buttons = insert_ad_button([InlineKeyboardButton(text="⬇️ Download", url=movie_url)], movie_name)
+    return InlineQueryResultArticle(
+        id=str(position),
+        title=movie_title,
+        description="Tap to share this movie",
+        input_message_content=InputTextMessageContent(
+            f"🎬 {movie_title}\n⬇️How to download:- https://t.me/cctuitorial/7"
+        ),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[button] for button in buttons])
+    )
+
+# Answer one inline query (runs after the debounce delay, unless a newer query replaced it)
+async def answer_inline_query(inline_query, movie_name: str, context: CallbackContext):
+    user_id = inline_query.from_user.id
+    if not await is_user_subscribed(user_id, context):
+        await inline_query.answer(
+            [],
+            cache_time=0,
+            is_personal=True,
+            button=InlineQueryResultsButton(text="🔓 Join our channel to search movies", start_parameter="subscribe")
+        )
         return
-        
-    job_data = context.job.data
-    message_id = job_data['message_id']
-    chat_id = job_data['chat_id']
-    try:
-        logger.info(f"Deleting message {message_id} from chat {chat_id}")
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-        logger.info(f"Message {message_id} deleted successfully.")
-    except Exception as e:
-        logger.error(f"Failed to delete message {message_id}: {e}")
 
-# Store user ID in MongoDB
+    matches = await find_movie_matches(movie_name)
+    if matches is None:
+        return  # no catalog yet; let the query time out rather than cache an empty answer
+
+    results = [build_inline_result(position, movie_name, title, url) for position, (title, url) in enumerate(matches)]
+    if results:
+        record_first_answer()
+    with stage_timer("inline_answer"):
+        # is_personal because the answer depends on the user's subscription
+        await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+# Handle "@bot movie name" from any chat
+async def inline_search(update: Update, context: CallbackContext) -> None:
+    inline_query = update.inline_query
+    user = inline_query.from_user
+    movie_name = inline_query.query.strip()
+
+    await store_user_id(user.id, user.username, user.first_name)
+
+    if len(movie_name) < INLINE_MIN_QUERY_LENGTH:
+        # Still typing; drop whatever was pending for the previous text
+        inline_debouncer.cancel(user.id)
+        return
+
+    # Don't wait here: the next keystroke must be able to cancel this one
+    inline_debouncer.submit(user.id, lambda: answer_inline_query(inline_query, movie_name, context))
+
+# Store user ID in MongoDB (queued and written in batches by the user registry)
 async def store_user_id(user_id, username=None, first_name=None):
     try:
-        if not user_collection.find_one({"_id": user_id}):
-            user_collection.insert_one({
-                "_id": user_id,
-                "username": username,
-                "first_name": first_name
-            })
+        user_registry.register(user_id, username, first_name)
     except Exception as e:
         logger.error(f"Error storing user ID {user_id}: {e}")
 
@@ -248,6 +485,88 @@ async def safe_send_message(update: Update, context: CallbackContext, text: str,
         logger.error(f"Error sending message: {e}")
         return None
 
+# Caption above the result keyboard
+RESULTS_TEXT = "Search🔍 results for '{movie_name}' 🍿 :💀Note: Due to copyright issue search result will be deleted after 1 minute.⏳\n ⬇️How to download:- https://t.me/cctuitorial/7 \n🎬 *Request a Movie*: [Here](https://t.me/anonyms_middle_man_bot)"
+
+# Send or edit in the search result (a keyboard or a plain text answer)
+async def deliver_search_result(update: Update, context: CallbackContext, movie_name: str, result, loading_message=None):
+    if isinstance(result, InlineKeyboardMarkup):
+        text = RESULTS_TEXT.format(movie_name=movie_name)
+        kwargs = {'reply_markup': result, 'parse_mode': 'Markdown'}
+    else:
+        text = result
+        kwargs = {}
+
+    if loading_message is None:
+        with stage_timer("telegram_send"):
+            response_message = await safe_send_message(update, context, text, **kwargs)
+    else:
+        try:
+            with stage_timer("telegram_edit"):
+                response_message = await loading_message.edit_text(text, **kwargs)
+        except Exception as e:
+            logger.error(f"Error editing message: {e}")
+            return False
+    if not response_message:
+        return False
+
+    deletion_scheduler.schedule(update.message.chat_id, response_message.message_id, RESULT_MESSAGE_TTL)
+    return True
+
+# Search and reply. Answers ready within FAST_REPLY_BUDGET are sent as a single message;
+# slower ones get a loading message first, which is edited once the answer is ready
+async def reply_with_search(update: Update, context: CallbackContext, movie_name: str, loading_text: str):
+    answered = False
+    try:
+        # At most MAX_INFLIGHT_SEARCHES run at once; the rest wait briefly, then get turned away
+        async with admission.slot():
+            search = asyncio.ensure_future(search_movie_in_json(movie_name))
+            try:
+                done, _ = await asyncio.wait({search}, timeout=FAST_REPLY_BUDGET)
+                if done:
+                    metrics.SEARCH_REPLIES.inc("fast")
+                    result = search.result()
+                    answered = await deliver_search_result(update, context, movie_name, result)
+                else:
+                    metrics.SEARCH_REPLIES.inc("slow")
+                    loading_message = await safe_send_message(update, context, loading_text)
+                    if not loading_message:
+                        return
+                    result = await search
+                    answered = await deliver_search_result(update, context, movie_name, result, loading_message)
+                # "Unavailable" and error texts are not answers worth protecting from a retry
+                answered = answered and isinstance(result, InlineKeyboardMarkup)
+            finally:
+                if not search.done():
+                    search.cancel()
+    except Busy:
+        metrics.ADMISSION_REJECTIONS.inc("busy")
+        await safe_send_message(update, context, BUSY_TEXT)
+    finally:
+        if not answered:
+            # Let the user retry the same query without it being dropped as a repeat
+            admission.forget(update.message.from_user.id, normalize_query(movie_name))
+
+# Per-user flood control; returns False (after at most one notice per user) if the search should not run
+async def admit_search(update: Update, context: CallbackContext, movie_name: str) -> bool:
+    user_id = update.message.from_user.id
+    verdict = admission.check(user_id, normalize_query(movie_name))
+    if verdict == ADMITTED:
+        return True
+    metrics.ADMISSION_REJECTIONS.inc(verdict)
+    # Repeats are dropped silently: the earlier answer is still on screen
+    if verdict == RATE_LIMITED and admission.should_notify(user_id):
+        await safe_send_message(update, context, RATE_LIMIT_TEXT)
+    return False
+
+# Prompt a user who hasn't joined the channel yet
+async def send_subscribe_prompt(update: Update, context: CallbackContext) -> None:
+    # Define the buttons
+    keyboard = [
+        [InlineKeyboardButton("Join Now", url="https://t.me/addlist/ijkMdb6cwtRkYjA1")]
+    ]
+    await safe_send_message(update, context, SUBSCRIBE_TEXT, reply_markup=InlineKeyboardMarkup(keyboard), disable_web_page_preview=True)
+
 # Modified function to handle movie search requests
 async def search_movie(update: Update, context: CallbackContext) -> None:
     user = update.message.from_user
@@ -256,105 +575,41 @@ async def search_movie(update: Update, context: CallbackContext) -> None:
     # Store user ID if not already in the database
     await store_user_id(user_id, user.username, user.first_name)
 
+    movie_name = update.message.text.strip()
+    if not await admit_search(update, context, movie_name):
+        return
+
     # Check if user is subscribed to the channel
     if await is_user_subscribed(user_id, context):
-        movie_name = update.message.text.strip()
-        
         try:
-            await context.bot.send_chat_action(chat_id=update.message.chat_id, action='typing')
-            
-            # Send a creative message with simulated loading
-            loading_message = await safe_send_message(update, context, "🔍 Searching the movie vaults... 🍿 Hang tight while we find your movie! 🎬")
-            
-            if not loading_message:
-                return
-            
-            # Search for the movie in the JSON data
-            result = await search_movie_in_json(movie_name)
-
-            if isinstance(result, InlineKeyboardMarkup):
-                try:
-                    response_message = await loading_message.edit_text(
-                        f"Search🔍 results for '{movie_name}' 🍿 :💀Note: Due to copyright issue search result will be deleted after 1 minute.⏳\n ⬇️How to download:- https://t.me/cctuitorial/7 \n🎬 *Request a Movie*: [Here](https://t.me/anonyms_middle_man_bot)", 
-                        reply_markup=result,
-                        parse_mode='Markdown'
-                    )
-                    logger.info(f"Scheduling deletion for message {response_message.message_id} in chat {update.message.chat_id} after 60 seconds.")
-                    context.job_queue.run_once(delete_message, 60, data={'message_id': response_message.message_id, 'chat_id': update.message.chat_id})
-                except Exception as e:
-                    logger.error(f"Error editing message: {e}")
-            else:
-                try:
-                    response_message = await loading_message.edit_text(result)
-                    logger.info(f"Scheduling deletion for message {response_message.message_id} in chat {update.message.chat_id} after 60 seconds.")
-                    context.job_queue.run_once(delete_message, 60, data={'message_id': response_message.message_id, 'chat_id': update.message.chat_id})
-                except Exception as e:
-                    logger.error(f"Error editing message: {e}")
+            await reply_with_search(update, context, movie_name, "🔍 Searching the movie vaults... 🍿 Hang tight while we find your movie! 🎬")
         except Exception as e:
             logger.error(f"Error in search_movie: {e}")
     else:
-        # Prompt user to subscribe to the channel
-        message_text = (
-            "🎬Bro subscribe below channels first to unlock🔓 access to 3000+ movies & series📺 — then just send the movie name! 🫣"
-        )
-        
-        # Define the buttons
-        keyboard = [
-            [InlineKeyboardButton("Join Now", url="https://t.me/addlist/ijkMdb6cwtRkYjA1")]
-        ]
-        await safe_send_message(update, context, message_text, reply_markup=InlineKeyboardMarkup(keyboard), disable_web_page_preview=True)
+        admission.forget(user_id, normalize_query(movie_name))
+        await send_subscribe_prompt(update, context)
 
 # Similarly, modify the /search command handler to include the subscription check
 async def search_command(update: Update, context: CallbackContext) -> None:
     user_id = update.message.from_user.id
 
+    if context.args and not await admit_search(update, context, " ".join(context.args).strip()):
+        return
+
     # Check if user is subscribed to the channel
     if await is_user_subscribed(user_id, context):
         if context.args:
             movie_name = " ".join(context.args).strip()
-            
             try:
-                await context.bot.send_chat_action(chat_id=update.message.chat_id, action='typing')
-                loading_message = await safe_send_message(update, context, "🔍 Crunching through the movie vault... 🍿 Please hold on while we grab your movie magic! 🎥")
-                
-                if not loading_message:
-                    return
-                
-                movie_result = await search_movie_in_json(movie_name)
-
-                if isinstance(movie_result, InlineKeyboardMarkup):
-                    try:
-                        response_message = await loading_message.edit_text(
-                            f"Search🔍 results for '{movie_name}' 🍿 :💀Note: Due to copyright issue search result will be deleted after 1 minute.⏳\n⬇️How to download:- https://t.me/cctuitorial/7 \n🎬 *Request a Movie*: [Here](https://t.me/anonyms_middle_man_bot)", 
-                            reply_markup=movie_result,
-                            parse_mode='Markdown'
-                        )
-                        logger.info(f"Scheduling deletion for message {response_message.message_id} in chat {update.message.chat_id} after 60 seconds.")
-                        context.job_queue.run_once(delete_message, 60, data={'message_id': response_message.message_id, 'chat_id': update.message.chat_id})
-                    except Exception as e:
-                        logger.error(f"Error editing message: {e}")
-                else:
-                    try:
-                        response_message = await loading_message.edit_text(movie_result)
-                        logger.info(f"Scheduling deletion for message {response_message.message_id} in chat {update.message.chat_id} after 60 seconds.")
-                        context.job_queue.run_once(delete_message, 60, data={'message_id': response_message.message_id, 'chat_id': update.message.chat_id})
-                    except Exception as e:
-                        logger.error(f"Error editing message: {e}")
+                await reply_with_search(update, context, movie_name, "🔍 Crunching through the movie vault... 🍿 Please hold on while we grab your movie magic! 🎥")
             except Exception as e:
                 logger.error(f"Error in search_command: {e}")
         else:
             await safe_send_message(update, context, "Please provide a movie name. Usage: /search <movie_name>")
     else:
-        # Prompt user to subscribe to the channel
-        message_text = (
-            "🎬Bro subscribe below channels first to unlock🔓 access to 3000+ movies & series📺 — then just send the movie name! 🫣"
-        )
-        
-        # Define the buttons
-        keyboard = [
-            [InlineKeyboardButton("Join Now", url="https://t.me/addlist/ijkMdb6cwtRkYjA1")]
-        ]
-        await safe_send_message(update, context, message_text, reply_markup=InlineKeyboardMarkup(keyboard), disable_web_page_preview=True)
+        if context.args:
+            admission.forget(user_id, normalize_query(" ".join(context.args).strip()))
+        await send_subscribe_prompt(update, context)
 
 # Update the start command to save user IDs
 async def start_command(update: Update, context: CallbackContext) -> None:
@@ -425,25 +680,43 @@ async def broadcast_message(update: Update, context: CallbackContext):
     
     if context.args:
         broadcast_text = " ".join(context.args)
-        users = user_collection.find({}, {"_id": 1})
-        
-        sent_count = 0
-        for user_doc in users:
-            try:
-                await context.bot.send_message(chat_id=user_doc['_id'], text=broadcast_text)
-                sent_count += 1
-            except Forbidden:
-                logger.warning(f"Bot was blocked by user {user_doc['_id']}")
-                continue
-            except Exception as e:
-                logger.error(f"Error sending message to user {user_doc['_id']}: {e}")
-                continue
-        
-        await safe_send_message(update, context, f"Broadcast sent to {sent_count} users.")
+        try:
+            # Runs in the background; the admin gets a summary when it finishes
+            broadcast_id = await broadcast_engine.start(broadcast_text, notify_chat_id=update.message.chat_id)
+            await safe_send_message(update, context, f"Broadcast {broadcast_id} started. Check progress with /broadcaststatus {broadcast_id}")
+        except Exception as e:
+            logger.error(f"Error starting broadcast: {e}")
+            await safe_send_message(update, context, "Error starting broadcast.")
     else:
         await safe_send_message(update, context, "Usage: /broadcast <message>")
 
-# /userlist command to show the total number of users
+# /broadcaststatus command to show the progress of a broadcast (admin only)
+async def broadcast_status_command(update: Update, context: CallbackContext):
+    user = update.message.from_user
+    if user.id != ADMIN_USER_ID:
+        await safe_send_message(update, context, "You are not authorized to use this command.")
+        return
+    
+    if not context.args:
+        await safe_send_message(update, context, "Usage: /broadcaststatus <broadcast_id>")
+        return
+    
+    try:
+        doc = await broadcast_engine.status(context.args[0])
+    except Exception as e:
+        logger.error(f"Error getting broadcast status: {e}")
+        doc = None
+    if not doc:
+        await safe_send_message(update, context, "Broadcast not found.")
+        return
+    await safe_send_message(
+        update, context,
+        f"Broadcast {doc['_id']}: {doc['status']}\n"
+        f"Sent: {doc['sent']}, blocked: {doc['blocked']}, failed: {doc['failed']}\n"
+        f"Last user: {doc['last_user_id']}"
+    )
+
+# /userlist command to show the total number of users and the daily counters
 async def user_list_command(update: Update, context: CallbackContext):
     user = update.message.from_user
     if user.id != ADMIN_USER_ID:
@@ -451,11 +724,112 @@ async def user_list_command(update: Update, context: CallbackContext):
         return
     
     try:
-        user_count = user_collection.count_documents({})
-        await safe_send_message(update, context, f"Total registered users: {user_count}")
+        user_count = await database.count_users()
+        days = await database.daily_user_stats(USER_STATS_DAYS)
     except Exception as e:
         logger.error(f"Error getting user count: {e}")
         await safe_send_message(update, context, "Error retrieving user count.")
+        return
+    
+    daily = "\n".join(
+        f"{day['_id']}: {day.get('active_users', 0)} active, {day.get('new_users', 0)} new"
+        for day in days
+    )
+    await safe_send_message(
+        update, context,
+        f"Total registered users: ~{user_count}\n\n"
+        f"Daily users (UTC):\n{daily or 'No activity recorded yet.'}\n\n"
+        "Use /exportusers for the full list."
+    )
+
+# /exportusers command to send every user as a gzipped CSV file (admin only)
+async def export_users_command(update: Update, context: CallbackContext):
+    user = update.message.from_user
+    if user.id != ADMIN_USER_ID:
+        await safe_send_message(update, context, "You are not authorized to use this command.")
+        return
+    
+    await safe_send_message(update, context, "📦 Exporting users...")
+    path = database.new_export_path()
+    try:
+        count = await database.export_users(path)
+        with open(path, 'rb') as f:
+            await context.bot.send_document(
+                chat_id=update.message.chat_id,
+                document=f,
+                filename=f"users-{time.strftime('%Y%m%d')}.csv.gz",
+                caption=f"{count} users"
+            )
+        logger.info(f"📦 Exported {count} users")
+    except Exception as e:
+        logger.error(f"Error exporting users: {e}")
+        await safe_send_message(update, context, "Error exporting users.")
+    finally:
+        os.remove(path)
+
+# /cachestats command to show cache counters (admin only)
+async def cache_stats_command(update: Update, context: CallbackContext):
+    user = update.message.from_user
+    if user.id != ADMIN_USER_ID:
+        await safe_send_message(update, context, "You are not authorized to use this command.")
+        return
+    
+    result_stats = "\n".join(f"{name}: {value}" for name, value in result_cache.stats().items())
+    subscription_stats = "\n".join(f"{name}: {value}" for name, value in subscription_cache.stats().items())
+    await safe_send_message(
+        update, context,
+        f"Search result cache (catalog v{result_cache.version}):\n{result_stats}\n\n"
+        f"Subscription cache:\n{subscription_stats}"
+    )
+
+# /profile command to sample the event loop and send a collapsed-stack file (admin only)
+async def profile_command(update: Update, context: CallbackContext):
+    user = update.message.from_user
+    if user.id != ADMIN_USER_ID:
+        await safe_send_message(update, context, "You are not authorized to use this command.")
+        return
+    
+    try:
+        duration = parse_duration(context.args[0]) if context.args else 10
+    except ValueError:
+        await safe_send_message(update, context, "Usage: /profile <duration>, e.g. /profile 30s")
+        return
+    duration = min(max(duration, 1), PROFILE_MAX_SECONDS)
+    
+    await safe_send_message(update, context, f"🔬 Profiling the event loop for {duration:.0f}s...")
+    sampler = await profile_event_loop(duration)
+    if not sampler.samples:
+        await safe_send_message(update, context, "No samples collected.")
+        return
+    
+    try:
+        await context.bot.send_document(
+            chat_id=update.message.chat_id,
+            document=sampler.collapsed().encode('utf-8'),
+            filename=f"profile-{int(time.time())}.folded",
+            caption=f"{sampler.samples} samples over {duration:.0f}s. Open with speedscope or flamegraph.pl."
+        )
+    except Exception as e:
+        logger.error(f"Error sending profile: {e}")
+        await safe_send_message(update, context, "Error sending profile.")
+
+# /diagnostics on|off command to toggle the event loop stall watchdog (admin only)
+async def diagnostics_command(update: Update, context: CallbackContext):
+    user = update.message.from_user
+    if user.id != ADMIN_USER_ID:
+        await safe_send_message(update, context, "You are not authorized to use this command.")
+        return
+    
+    if context.args and context.args[0].lower() == "on":
+        loop_watchdog.start()
+    elif context.args and context.args[0].lower() == "off":
+        loop_watchdog.stop()
+    state = "on" if loop_watchdog.running else "off"
+    await safe_send_message(
+        update, context,
+        f"Loop watchdog is {state} (threshold {loop_watchdog.threshold}s, {loop_watchdog.stalls} stalls logged).\n"
+        "Usage: /diagnostics on|off"
+    )
 
 # Health check endpoint
 async def health_check(update: Update, context: CallbackContext):
@@ -470,7 +844,7 @@ def signal_handler(signum, frame):
 async def clear_existing_instances():
     """Clear any existing bot instances before starting"""
     try:
-        bot = Bot(token=BOT_TOKEN)
+        bot = Bot(token=BOT_TOKEN, base_url=TELEGRAM_API_BASE_URL)
         # Delete webhook with drop_pending_updates=True to clear any conflicts
         await bot.delete_webhook(drop_pending_updates=True)
         logger.info("Cleared existing webhook and pending updates")
@@ -490,15 +864,32 @@ async def webhook_handler(request):
         # Check if we're shutting down
         if is_shutting_down:
             return web.Response(text="Shutting down", status=503)
+
+        # Reject requests that don't carry our webhook secret
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(text="Forbidden", status=403)
             
         # Get the JSON data from the request
-        data = await request.json()
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(text="Invalid JSON", status=400)
+        if not isinstance(data, dict) or "update_id" not in data:
+            return web.Response(text="Not an update", status=400)
         
         # Create an Update object from the JSON data
         update = Update.de_json(data, application.bot)
+
+        if update_dispatcher is None:
+            # Process the update before answering
+            await application.process_update(update)
+            return web.Response(text="OK")
         
-        # Process the update
-        await application.process_update(update)
+        # Acknowledge right away and let the dispatcher workers process it;
+        # when the queue is full, ask Telegram to redeliver later
+        if not update_dispatcher.submit(update):
+            logger.warning(f"Webhook queue full, rejecting update {update.update_id}")
+            return web.Response(text="Busy", status=429, headers={"Retry-After": "1"})
         
         return web.Response(text="OK")
     except Exception as e:
@@ -509,6 +900,38 @@ async def health_handler(request):
     """Health check endpoint"""
     return web.Response(text="Bot is healthy!", status=200)
 
+async def metrics_handler(request):
+    """Prometheus metrics endpoint"""
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+# Gauges read at scrape time, so they cost nothing on the hot path
+metrics.Gauge("bot_result_cache_entries", "Entries in the search result cache", callback=lambda: len(result_cache))
+metrics.Gauge("bot_result_cache_events", "Search result cache hits, misses, evictions and expirations", ["event"],
+              callback=lambda: {event: result_cache.stats()[event] for event in ("hits", "misses", "evictions", "expirations")})
+metrics.Gauge("bot_subscription_cache_entries", "Entries in the subscription cache", callback=lambda: len(subscription_cache))
+metrics.Gauge("bot_user_registry_pending", "User registrations waiting to be written", callback=lambda: user_registry.pending_count)
+metrics.Gauge("bot_catalog_titles", "Titles in the current catalog snapshot", callback=lambda: len(catalog_store.snapshot))
+metrics.Gauge("bot_catalog_version", "Version of the current catalog snapshot", callback=lambda: catalog_store.snapshot.version)
+metrics.Gauge("bot_pending_deletions", "Result messages scheduled for deletion",
+              callback=lambda: deletion_scheduler.pending if deletion_scheduler else 0)
+metrics.Gauge("bot_deleted_messages", "Result messages deleted, or given up on because Telegram refused", ["outcome"],
+              callback=lambda: {"deleted": deletion_scheduler.deleted, "failed": deletion_scheduler.failed} if deletion_scheduler else {})
+metrics.Gauge("bot_webhook_queue_depth", "Webhook updates waiting for a worker",
+              callback=lambda: update_dispatcher.depth if update_dispatcher else 0)
+metrics.Gauge("bot_webhook_rejected", "Webhook updates rejected because the queue was full",
+              callback=lambda: update_dispatcher.rejected if update_dispatcher else 0)
+metrics.Gauge("bot_startup_to_first_answer_seconds", "Time from process start to the first answered search",
+              callback=lambda: first_answer_after if first_answer_after is not None else float('nan'))
+metrics.Gauge("bot_inline_pending", "Inline queries waiting out the debounce delay or being searched",
+              callback=lambda: inline_debouncer.pending)
+metrics.Gauge("bot_inline_superseded", "Inline queries cancelled because the user kept typing",
+              callback=lambda: inline_debouncer.superseded)
+metrics.Gauge("bot_search_coalesced", "Searches that waited for an identical search already in progress",
+              callback=lambda: search_flight.coalesced)
+metrics.Gauge("bot_inflight_searches", "Searches holding an admission slot", callback=lambda: admission.inflight)
+metrics.Gauge("bot_is_leader", "1 if this replica runs the singleton jobs", callback=lambda: int(is_leader()))
+metrics.Gauge("bot_loop_stalls", "Event loop stalls logged by the diagnostics watchdog", callback=lambda: loop_watchdog.stalls)
+
 async def create_webhook_app():
     """Create aiohttp web application for webhook"""
     app = web.Application()
@@ -519,36 +942,53 @@ async def create_webhook_app():
     # Add health check endpoint
     app.router.add_get("/health", health_handler)
     app.router.add_get("/", health_handler)  # Root endpoint
+
+    # Add metrics endpoint
+    app.router.add_get("/metrics", metrics_handler)
     
     return app
 
 async def run_bot():
     """Run the bot with proper async handling"""
-    global application, is_shutting_down, keep_alive_task
+    global application, is_shutting_down, keep_alive_task, loop_lag_task, search_pool, broadcast_engine, deletion_scheduler, update_dispatcher
+    global shared_backend, shared_results, leader_election
     
     logger.info("Starting Movie Search Bot...")
     
-    # Clear any existing instances first
-    await clear_existing_instances()
+    # Clear any existing instances first (replicas share the webhook, so they must leave it alone)
+    if not MULTI_INSTANCE:
+        await clear_existing_instances()
     
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).base_url(TELEGRAM_API_BASE_URL).build()
     
     # Add error handler
     application.add_error_handler(error_handler)
 
     # Add command handlers
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("search", search_command))
-    application.add_handler(CommandHandler("broadcast", broadcast_message))
-    application.add_handler(CommandHandler("userlist", user_list_command))
-    application.add_handler(CommandHandler("health", health_check))
+    application.add_handler(CommandHandler("start", instrument_handler("start", start_command)))
+    application.add_handler(CommandHandler("search", instrument_handler("search", search_command)))
+    application.add_handler(CommandHandler("broadcast", instrument_handler("broadcast", broadcast_message)))
+    application.add_handler(CommandHandler("broadcaststatus", instrument_handler("broadcaststatus", broadcast_status_command)))
+    application.add_handler(CommandHandler("userlist", instrument_handler("userlist", user_list_command)))
+    # Long-running admin commands run as their own tasks instead of holding up the chat's update worker
+    application.add_handler(CommandHandler("exportusers", instrument_handler("exportusers", export_users_command), block=False))
+    application.add_handler(CommandHandler("profile", instrument_handler("profile", profile_command), block=False))
+    application.add_handler(CommandHandler("health", instrument_handler("health", health_check)))
+    application.add_handler(CommandHandler("cachestats", instrument_handler("cachestats", cache_stats_command)))
+    application.add_handler(CommandHandler("diagnostics", instrument_handler("diagnostics", diagnostics_command)))
     
     # Add message handler for text messages
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, search_movie))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrument_handler("search_movie", search_movie)))
+    
+    # Add inline query handler for "@bot movie name" searches (inline mode must be enabled in @BotFather)
+    application.add_handler(InlineQueryHandler(instrument_handler("inline_search", inline_search)))
     
     # Add callback query handler for button presses
-    application.add_handler(CallbackQueryHandler(button_callback))
+    application.add_handler(CallbackQueryHandler(instrument_handler("button_callback", button_callback)))
+
+    # Keep the subscription cache in sync with channel joins and leaves
+    application.add_handler(ChatMemberHandler(instrument_handler("chat_member", track_channel_membership), ChatMemberHandler.CHAT_MEMBER))
 
     # Environment variables
     webhook_url = os.environ.get("WEBHOOK_URL")
@@ -558,6 +998,74 @@ async def run_bot():
         # Initialize the application
         await application.initialize()
         await application.start()
+
+        # Several replicas behind one webhook URL: share caches and elect a leader for singleton work
+        if MULTI_INSTANCE:
+            if not webhook_url:
+                raise RuntimeError("MULTI_INSTANCE needs WEBHOOK_URL; replicas cannot share getUpdates polling")
+            if SHARED_STATE_URL.startswith('memory://'):
+                logger.warning("MULTI_INSTANCE with memory:// shared state: nothing is shared with other processes")
+            shared_backend = create_backend(SHARED_STATE_URL)
+            leader_election = LeaderElection(shared_backend)
+            leader_election.start()
+            subscription_cache.shared = shared_backend
+            subscription_cache.local_ttl = SHARED_LOCAL_TTL
+            shared_results = SharedResultCache(shared_backend)
+            logger.info(f"Multi-instance mode as {INSTANCE_ID}")
+
+        # Bring old user documents into the current schema (no-op once applied)
+        try:
+            await database.migrate_user_documents()
+        except Exception as e:
+            logger.error(f"User document migration failed: {e}")
+
+        # Start the background writer for new user registrations
+        user_registry.start()
+
+        # Resume any broadcast that was interrupted by the last shutdown
+        broadcast_engine = BroadcastEngine(application.bot, shared=shared_backend)
+        await resume_broadcasts()
+
+        # Delete result messages on schedule, including ones left over from the last run
+        deletion_scheduler = DeletionScheduler(
+            application.bot,
+            database.scheduled_deletions_collection,
+            is_leader=is_leader if MULTI_INSTANCE else None
+        )
+        await deletion_scheduler.start()
+
+        # Move fuzzy matching off the event loop if worker processes are configured
+        if SEARCH_WORKERS > 0:
+            search_pool = SearchPool(SEARCH_WORKERS)
+            search_batcher.runner = search_pool.search_many
+            logger.info(f"Fuzzy matching runs in {SEARCH_WORKERS} worker processes")
+
+        # Patch cached results when the catalog changes
+        catalog_store.add_listener(on_catalog_swap, prepare=prepare_catalog_swap)
+
+        # Serve the catalog saved by the last run right away and refresh it in the background;
+        # without a saved copy we have to wait for the download
+        if await catalog_store.load_from_disk():
+            application.job_queue.run_once(refresh_catalog, 0, name="catalog_refresh_startup")
+        else:
+            await refresh_catalog()
+        if catalog_store.snapshot:
+            logger.info(f"Catalog ready {time.monotonic() - process_started_at:.2f}s after startup ({len(catalog_store.snapshot)} titles)")
+        else:
+            logger.warning(f"No catalog available at startup, retrying in {CATALOG_RETRY_DELAY:.0f}s")
+            application.job_queue.run_once(retry_catalog_refresh, CATALOG_RETRY_DELAY, data=CATALOG_RETRY_DELAY, name="catalog_retry")
+
+        # Keep the catalog fresh in the background
+        application.job_queue.run_repeating(
+            refresh_catalog,
+            interval=CATALOG_REFRESH_INTERVAL,
+            first=CATALOG_REFRESH_INTERVAL,
+            name="catalog_refresh"
+        )
+        if MULTI_INSTANCE:
+            application.job_queue.run_repeating(sync_catalog, interval=CATALOG_SYNC_INTERVAL, name="catalog_sync")
+            # Broadcasts started on a replica that went away are picked up once its lease expires
+            application.job_queue.run_repeating(resume_broadcasts, interval=60, first=60, name="broadcast_resume")
         
         # Always create and start the web server
         app = await create_webhook_app()
@@ -571,13 +1079,29 @@ async def run_bot():
         # Start keep-alive task
         logger.info("🚀 Starting keep-alive service...")
         keep_alive_task = asyncio.create_task(keep_alive_ping())
+
+        # Start measuring event loop lag for /metrics
+        loop_lag_task = asyncio.create_task(metrics.monitor_loop_lag())
+
+        # Log the stack of anything that blocks the loop (can also be toggled with /diagnostics)
+        if DIAGNOSTICS_ENABLED:
+            loop_watchdog.start()
         
         if webhook_url:
             logger.info(f"Starting webhook mode with URL: {webhook_url}")
+
+            # Acknowledge webhook deliveries immediately and process them in the background
+            if WEBHOOK_WORKERS > 0:
+                update_dispatcher = UpdateDispatcher(application.process_update)
+                update_dispatcher.start()
             
             # Set the webhook URL
             webhook_full_url = f"{webhook_url}/{BOT_TOKEN}"
-            await application.bot.set_webhook(url=webhook_full_url)
+            await application.bot.set_webhook(
+                url=webhook_full_url,
+                allowed_updates=Update.ALL_TYPES,
+                secret_token=WEBHOOK_SECRET
+            )
             logger.info(f"Webhook set to: {webhook_full_url}")
             
             # Keep the server running
@@ -619,9 +1143,35 @@ async def run_bot():
                     await keep_alive_task
                 except asyncio.CancelledError:
                     logger.info("Keep-alive task cancelled successfully")
+
+            if loop_lag_task and not loop_lag_task.done():
+                loop_lag_task.cancel()
+            loop_watchdog.stop()
                 
-            # Clean shutdown
-            if webhook_url:
+            # Finish processing updates that were already acknowledged
+            if update_dispatcher:
+                await update_dispatcher.stop()
+
+            # Drop inline queries that were still waiting; nobody is left to answer them
+            await inline_debouncer.stop()
+
+            # Stop broadcasts at their last checkpoint; they resume on the next start
+            if broadcast_engine:
+                await broadcast_engine.stop()
+
+            # Save deletions that are not due yet; the next start carries them out
+            if deletion_scheduler:
+                await deletion_scheduler.stop()
+
+            # Write out any user registrations still queued
+            await user_registry.stop()
+                
+            # Hand singleton work over to another replica right away
+            if leader_election:
+                await leader_election.stop()
+
+            # Clean shutdown (other replicas keep serving the shared webhook)
+            if webhook_url and not MULTI_INSTANCE:
                 await application.bot.delete_webhook()
                 
             if application.updater and application.updater.running:
@@ -631,6 +1181,18 @@ async def run_bot():
                 await application.stop()
                 
             await application.shutdown()
+
+            # Close pooled outgoing HTTP connections
+            await close_session()
+            if shared_backend:
+                await shared_backend.close()
+
+            # Stop the fuzzy matching workers
+            if search_pool:
+                search_pool.close()
+
+            # Release the MongoDB connection pool
+            await database.close()
             logger.info("Bot shutdown completed successfully")
         except Exception as e:
             logger.error(f"Error during shutdown: {e}")
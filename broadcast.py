@@ -0,0 +1,267 @@
+# broadcast.py
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut, NetworkError
+
+import database
+from ratelimit import TokenBucket, retry_after_seconds
+from shared_state import Lease
+
+logger = logging.getLogger(__name__)
+
+# Broadcast settings: Telegram allows roughly 30 messages per second overall
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 25))  # messages per second
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 20))
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', 500))
+BROADCAST_MAX_ATTEMPTS = 3
+BROADCAST_LEASE_TTL = 120  # seconds; renewed every third of it while a broadcast runs, when replicas share state
+
+
+class BroadcastEngine:
+    """Sends admin broadcasts in the background without blocking any handler.
+
+    User IDs are streamed from MongoDB in ``_id`` order, one cursor batch at
+    a time, and sent by a pool of concurrent senders that share one token
+    bucket. RetryAfter pauses the whole bucket. Each batch's outcomes are
+    written to ``broadcast_deliveries`` and its last user ID is checkpointed
+    on the broadcast document, so an interrupted broadcast resumes where it
+    stopped; a batch cut short by shutdown still records who it reached.
+    Users who blocked the bot are flagged and skipped next time.
+
+    With a ``shared`` backend each running broadcast holds a lease, so of
+    several replicas only one sends it, and another can resume it once the
+    lease of a replica that died has expired. The lease is renewed on a
+    timer, so it also survives long flood-control pauses; if a renewal
+    fails the senders stop before their next message.
+    """
+
+    def __init__(self, bot, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY, batch_size=BROADCAST_BATCH_SIZE, shared=None):
+        self.bot = bot
+        self.shared = shared
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.tasks = {}  # broadcast id -> task
+
+    async def start(self, text, notify_chat_id=None):
+        """Create a broadcast and run it in the background; returns its id."""
+        doc = {
+            "text": text,
+            "status": "running",
+            "notify_chat_id": notify_chat_id,
+            "last_user_id": None,
+            "sent": 0,
+            "failed": 0,
+            "blocked": 0,
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc),
+        }
+        result = await database.broadcasts_collection.insert_one(doc)
+        doc["_id"] = result.inserted_id
+        self._spawn(doc)
+        return str(result.inserted_id)
+
+    async def resume_interrupted(self):
+        """Pick up broadcasts that were still running when the process stopped."""
+        resumed = 0
+        async for doc in database.broadcasts_collection.find({"status": "running"}):
+            if str(doc["_id"]) in self.tasks:
+                continue
+            if self.shared is not None and await self.shared.get(self._lease_key(doc["_id"])) is not None:
+                continue  # running on another replica
+            logger.info(f"📣 Resuming broadcast {doc['_id']} after user {doc.get('last_user_id')}")
+            self._spawn(doc)
+            resumed += 1
+        return resumed
+
+    async def status(self, broadcast_id):
+        return await database.broadcasts_collection.find_one({"_id": ObjectId(broadcast_id)})
+
+    @staticmethod
+    def _lease_key(broadcast_id):
+        return f"lease:broadcast:{broadcast_id}"
+
+    def _spawn(self, doc):
+        broadcast_id = str(doc["_id"])
+        task = asyncio.create_task(self._run(doc))
+        self.tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(broadcast_id, None))
+
+    async def stop(self):
+        """Cancel running broadcasts; their checkpoints let them resume on the next start."""
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    # Stream the next batch of deliverable user ids after the checkpoint
+    async def _next_batch(self, broadcast_id, last_user_id):
+        query = {"blocked": {"$ne": True}}
+        if last_user_id is not None:
+            query["_id"] = {"$gt": last_user_id}
+        cursor = database.users_collection.find(query, {"_id": 1}).sort("_id", 1).limit(self.batch_size)
+        user_ids = [doc["_id"] async for doc in cursor]
+        if not user_ids:
+            return [], None
+
+        # Users already handled before an interruption are not sent twice
+        done = database.broadcast_deliveries_collection.find(
+            {"_id": {"$in": [f"{broadcast_id}:{user_id}" for user_id in user_ids]}}, {"user_id": 1}
+        )
+        already_sent = {doc["user_id"] async for doc in done}
+        return [user_id for user_id in user_ids if user_id not in already_sent], user_ids[-1]
+
+    # Renew the broadcast's lease until cancelled; set ``lost`` and stop if a renewal fails
+    async def _keep_lease(self, lease, broadcast_id, lost):
+        while True:
+            await asyncio.sleep(lease.ttl / 3)
+            try:
+                renewed = await lease.renew()
+            except Exception as e:
+                logger.error(f"Could not renew lease of broadcast {broadcast_id}: {e}")
+                renewed = False
+            if not renewed:
+                lost.set()
+                return
+
+    # Outcome of sending to one user, or None when the lease was lost before sending
+    async def _send(self, user_id, text, lost):
+        for attempt in range(BROADCAST_MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            # A flood-control pause can outlast the lease; check it right before sending
+            if lost.is_set():
+                return None
+            try:
+                await self.bot.send_message(chat_id=user_id, text=text)
+                return "sent", None
+            except RetryAfter as e:
+                retry_after = retry_after_seconds(e)
+                logger.warning(f"Broadcast hit flood control, pausing {retry_after}s")
+                self.bucket.pause(retry_after)
+            except Forbidden as e:
+                return "blocked", str(e)
+            except BadRequest as e:
+                return "failed", str(e)
+            except (TimedOut, NetworkError) as e:
+                if attempt == BROADCAST_MAX_ATTEMPTS - 1:
+                    return "failed", str(e)
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                return "failed", str(e)
+        return "failed", "flood control retries exhausted"
+
+    # Send to a batch of users, filling ``outcomes`` as messages go out so a cancelled batch keeps them
+    async def _send_batch(self, user_ids, text, lost, outcomes):
+        queue = asyncio.Queue()
+        for user_id in user_ids:
+            queue.put_nowait(user_id)
+
+        async def sender():
+            while True:
+                try:
+                    user_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                outcome = await self._send(user_id, text, lost)
+                if outcome is None:
+                    return
+                outcomes[user_id] = outcome
+
+        await asyncio.gather(*(sender() for _ in range(min(self.concurrency, len(user_ids)))))
+
+    async def _record_batch(self, broadcast_id, outcomes, last_user_id):
+        now = datetime.now(timezone.utc)
+        if outcomes:
+            await database.broadcast_deliveries_collection.bulk_write([
+                UpdateOne(
+                    {"_id": f"{broadcast_id}:{user_id}"},
+                    {"$set": {"broadcast_id": broadcast_id, "user_id": user_id, "status": status, "error": error, "at": now}},
+                    upsert=True
+                )
+                for user_id, (status, error) in outcomes.items()
+            ], ordered=False)
+
+        blocked = [user_id for user_id, (status, _) in outcomes.items() if status == "blocked"]
+        if blocked:
+            await database.users_collection.update_many({"_id": {"$in": blocked}}, {"$set": {"blocked": True}})
+
+        counts = {"sent": 0, "failed": 0, "blocked": 0}
+        for status, _ in outcomes.values():
+            counts[status] += 1
+        # Without a last user id (an unfinished batch) the checkpoint stays where it was
+        update = {"updated_at": now}
+        if last_user_id is not None:
+            update["last_user_id"] = last_user_id
+        await database.broadcasts_collection.update_one(
+            {"_id": ObjectId(broadcast_id)},
+            {"$set": update, "$inc": counts}
+        )
+        return counts
+
+    async def _run(self, doc):
+        broadcast_id = str(doc["_id"])
+        last_user_id = doc.get("last_user_id")
+        started = time.monotonic()
+        totals = {"sent": doc.get("sent", 0), "failed": doc.get("failed", 0), "blocked": doc.get("blocked", 0)}
+        lease = keeper = None
+        lost = asyncio.Event()
+        outcomes = {}  # sent but not yet recorded
+        if self.shared is not None:
+            lease = Lease(self.shared, self._lease_key(broadcast_id), ttl=BROADCAST_LEASE_TTL)
+            if not await lease.acquire():
+                logger.info(f"Broadcast {broadcast_id} is already running on another replica")
+                return
+            keeper = asyncio.create_task(self._keep_lease(lease, broadcast_id, lost))
+        try:
+            while True:
+                user_ids, batch_last_id = await self._next_batch(broadcast_id, last_user_id)
+                if batch_last_id is None:
+                    break
+                await self._send_batch(user_ids, doc["text"], lost, outcomes)
+                if lost.is_set():
+                    # Record what was sent so the replica that took over skips those users
+                    await self._record_batch(broadcast_id, outcomes, None)
+                    logger.warning(f"Broadcast {broadcast_id} lost its lease after user {last_user_id}, leaving it to another replica")
+                    return
+                counts = await self._record_batch(broadcast_id, outcomes, batch_last_id)
+                outcomes = {}
+                for key, value in counts.items():
+                    totals[key] += value
+                last_user_id = batch_last_id
+
+            await database.broadcasts_collection.update_one(
+                {"_id": doc["_id"]},
+                {"$set": {"status": "done", "updated_at": datetime.now(timezone.utc)}}
+            )
+            summary = (f"Broadcast {broadcast_id} finished in {time.monotonic() - started:.0f}s: "
+                       f"{totals['sent']} sent, {totals['blocked']} blocked, {totals['failed']} failed.")
+            logger.info(f"📣 {summary}")
+            if doc.get("notify_chat_id"):
+                try:
+                    await self.bot.send_message(chat_id=doc["notify_chat_id"], text=summary)
+                except Exception as e:
+                    logger.error(f"Failed to send broadcast summary: {e}")
+        except asyncio.CancelledError:
+            # Record what the unfinished batch already sent, so resuming doesn't send it twice
+            if outcomes:
+                try:
+                    await asyncio.shield(self._record_batch(broadcast_id, outcomes, None))
+                except Exception as e:
+                    logger.error(f"Could not record interrupted batch of broadcast {broadcast_id}: {e}")
+            logger.info(f"Broadcast {broadcast_id} interrupted after user {last_user_id}, will resume on restart")
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast {broadcast_id} stopped after user {last_user_id}: {e}")
+        finally:
+            if keeper is not None:
+                keeper.cancel()
+            if lease is not None and not lost.is_set():
+                try:
+                    await lease.release()
+                except Exception as e:
+                    logger.error(f"Error releasing lease of broadcast {broadcast_id}: {e}")
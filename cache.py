@@ -0,0 +1,233 @@
+# cache.py
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Search result cache settings
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 1024))
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 600))  # seconds
+
+# Channel membership cache settings
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv('SUBSCRIPTION_CACHE_SIZE', 50000))
+SUBSCRIPTION_POSITIVE_TTL = int(os.getenv('SUBSCRIPTION_POSITIVE_TTL', 1800))  # seconds
+SUBSCRIPTION_NEGATIVE_TTL = int(os.getenv('SUBSCRIPTION_NEGATIVE_TTL', 30))  # seconds
+
+
+# Normalize a search query into a cache key: case, punctuation and spacing don't matter
+def normalize_query(query):
+    return " ".join("".join(ch if ch.isalnum() else " " for ch in query.lower()).split())
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after ``ttl`` seconds.
+
+    Entries can carry a ``version``; looking up with a different version is
+    a miss, and ``set_version`` drops everything stored for older versions.
+    """
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.version = None
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def set_version(self, version):
+        if version != self.version:
+            self.version = version
+            self._data.clear()
+
+    def items(self):
+        """Copy of the stored (key, value) pairs, least recently used first."""
+        return [(key, value) for key, (_, value) in self._data.items()]
+
+    def rebase(self, version, update):
+        """Carry entries over to a new version instead of dropping them.
+
+        ``update(key, value)`` returns the value to keep under ``version``,
+        or None to drop the entry.
+        """
+        if self.version is not None and version <= self.version:
+            return
+        for key, (expires_at, value) in list(self._data.items()):
+            new_value = update(key, value)
+            if new_value is None:
+                del self._data[key]
+            else:
+                self._data[key] = (expires_at, new_value)
+        self.version = version
+
+    def get(self, key, version=None):
+        if version is not None and version != self.version:
+            self.misses += 1
+            return None
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= self.clock():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, version=None, ttl=None):
+        if version is not None:
+            if self.version is not None and version < self.version:
+                return  # Result computed against an older snapshot
+            self.set_version(version)
+        self._data[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+class SubscriptionCache:
+    """Per-user channel membership with separate TTLs for members and non-members.
+
+    Non-members are kept only briefly so a user who just joined is let in
+    quickly. Concurrent lookups for the same user share one in-flight check,
+    and ``update`` lets membership updates from Telegram refresh an entry early.
+
+    With a ``shared`` backend (see shared_state.py) statuses are also stored
+    there for the other replicas, and local copies live at most
+    ``local_ttl`` seconds so a change seen by one replica reaches the rest.
+    """
+
+    def __init__(self, maxsize, positive_ttl, negative_ttl, shared=None, local_ttl=60):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.shared = shared
+        self.local_ttl = local_ttl
+        self._cache = TTLCache(maxsize, positive_ttl)
+        self._inflight = SingleFlight()  # one membership check per user at a time
+        self.shared_hits = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, user_id):
+        return self._cache.get(user_id)
+
+    def _ttl(self, is_member):
+        return self.positive_ttl if is_member else self.negative_ttl
+
+    def set(self, user_id, is_member):
+        ttl = self._ttl(is_member)
+        if self.shared is not None:
+            ttl = min(ttl, self.local_ttl)
+        self._cache.set(user_id, is_member, ttl=ttl)
+
+    async def update(self, user_id, is_member):
+        """Store a status locally and, with a shared backend, for the other replicas."""
+        self.set(user_id, is_member)
+        if self.shared is not None:
+            try:
+                await self.shared.set(f"sub:{user_id}", "1" if is_member else "0", ttl=self._ttl(is_member))
+            except Exception as e:
+                logger.warning(f"Could not share subscription status of user {user_id}: {e}")
+
+    async def _check_and_store(self, user_id, check):
+        if self.shared is not None:
+            try:
+                value = await self.shared.get(f"sub:{user_id}")
+            except Exception as e:
+                logger.warning(f"Shared subscription cache unavailable: {e}")
+                value = None
+            if value is not None:
+                self.shared_hits += 1
+                is_member = value in (b"1", "1")
+                self.set(user_id, is_member)
+                return is_member
+        is_member = await check()
+        await self.update(user_id, is_member)
+        return is_member
+
+    async def get_or_check(self, user_id, check):
+        """Return the cached status, or await ``check()`` (shared with concurrent callers)."""
+        is_member = self._cache.get(user_id)
+        if is_member is not None:
+            return is_member
+
+        return await self._inflight.do(user_id, lambda: self._check_and_store(user_id, check))
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats['coalesced'] = self._inflight.coalesced
+        stats['inflight'] = len(self._inflight)
+        if self.shared is not None:
+            stats['shared_hits'] = self.shared_hits
+        return stats
+
+
+class SharedResultCache:
+    """Search results shared by all replicas, behind each replica's ``result_cache``.
+
+    Keys use the catalog fingerprint rather than the local snapshot
+    version, because every replica numbers its snapshots on its own.
+    Backend errors count as misses: the replica just computes the result.
+    """
+
+    def __init__(self, backend, ttl=RESULT_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+
+    async def get(self, fingerprint, key):
+        try:
+            value = await self.backend.get(f"results:{fingerprint}:{key}")
+        except Exception as e:
+            logger.warning(f"Shared result cache unavailable: {e}")
+            return None
+        if value is None:
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    async def set(self, fingerprint, key, value):
+        try:
+            await self.backend.set(f"results:{fingerprint}:{key}", json.dumps(value), ttl=self.ttl)
+        except Exception as e:
+            logger.warning(f"Could not share search result: {e}")
+
+
+# Ranked (title, url) tuples per normalized query, tied to the catalog snapshot version
+result_cache = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+# Channel membership per user id
+subscription_cache = SubscriptionCache(SUBSCRIPTION_CACHE_SIZE, SUBSCRIPTION_POSITIVE_TTL, SUBSCRIPTION_NEGATIVE_TTL)
@@ -0,0 +1,474 @@
+# catalog.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+
+import aiohttp
+
+from http_client import get_session
+from compact_catalog import CompactCatalog
+from search_index import SearchIndex
+from singleflight import SingleFlight
+from snapshot_file import CATALOG_SNAPSHOT_PATH, load_snapshot, save_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Catalog sources and refresh settings
+JSON_URL = os.getenv('JSON_URL')
+FALLBACK_JSON_URL = "https://brown-briana-33.tiiny.site/data-1.json"
+CATALOG_REFRESH_INTERVAL = int(os.getenv('CATALOG_REFRESH_INTERVAL', 600))  # seconds
+CATALOG_RETRY_DELAY = float(os.getenv('CATALOG_RETRY_DELAY', 5))  # first retry after a failed startup load; doubles up to the refresh interval
+CATALOG_SYNC_INTERVAL = int(os.getenv('CATALOG_SYNC_INTERVAL', 60))  # seconds between follower replicas' checks for a published catalog
+CATALOG_FETCH_TIMEOUT = float(os.getenv('CATALOG_FETCH_TIMEOUT', 10))  # seconds per attempt
+CATALOG_HEDGE_DELAY = float(os.getenv('CATALOG_HEDGE_DELAY', 1.5))  # seconds before asking the next mirror
+CATALOG_CHUNK_SIZE = 64 * 1024  # bytes read from the response at a time
+
+# Shared-state keys for handing the catalog from the leader to the other replicas
+SHARED_CATALOG_KEY = "catalog:current"  # fingerprint of the newest published catalog
+SHARED_CATALOG_TTL = 24 * 3600  # seconds a published catalog body is kept
+
+
+class JSONObjectStream:
+    """Incremental parser for one top-level JSON object, fed in chunks.
+
+    ``feed`` returns the (key, value) pairs completed by each chunk, so a
+    large catalog is parsed while it downloads and never held as a single
+    string. Values are decoded with the standard ``json`` decoder.
+    """
+
+    _whitespace = " \t\n\r"
+    _number_chars = frozenset("0123456789.eE+-")
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._bytes = b""
+        self._buffer = ""
+        self._position = 0
+        self._state = 'start'  # start -> key -> colon -> value -> separator -> ... -> done
+        self._key = None
+
+    def _skip_whitespace(self):
+        buffer, position = self._buffer, self._position
+        while position < len(buffer) and buffer[position] in self._whitespace:
+            position += 1
+        self._position = position
+        return position < len(buffer)
+
+    def feed(self, chunk, final=False):
+        # Keep incomplete UTF-8 sequences until the next chunk arrives
+        data = self._bytes + chunk
+        try:
+            text = data.decode('utf-8')
+            self._bytes = b""
+        except UnicodeDecodeError as e:
+            if final or e.start < len(data) - 3:
+                raise ValueError(f"invalid UTF-8 in catalog: {e}")
+            text, self._bytes = data[:e.start].decode('utf-8'), data[e.start:]
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+
+        pairs = []
+        key = self._key
+        while self._state != 'done' and self._skip_whitespace():
+            buffer, position = self._buffer, self._position
+            if self._state == 'start':
+                if buffer[position] != '{':
+                    raise ValueError("catalog is not a JSON object")
+                self._position += 1
+                self._state = 'first_key'
+            elif self._state in ('first_key', 'key'):
+                if self._state == 'first_key' and buffer[position] == '}':
+                    self._position += 1
+                    self._state = 'done'
+                    continue
+                if buffer[position] != '"':
+                    raise ValueError(f"expected a string key at offset {position}")
+                try:
+                    key, self._position = self._decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    break  # key not complete yet
+                self._state = 'colon'
+            elif self._state == 'colon':
+                if buffer[position] != ':':
+                    raise ValueError(f"expected ':' at offset {position}")
+                self._position += 1
+                self._state = 'value'
+            elif self._state == 'value':
+                try:
+                    value, end = self._decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    break  # value not complete yet
+                if (not final and isinstance(value, (int, float))
+                        and all(char in self._number_chars for char in buffer[end:])):
+                    break  # a number might continue in the next chunk ("1500." + "0}")
+                self._position = end
+                pairs.append((key, value))
+                self._state = 'separator'
+            elif self._state == 'separator':
+                if buffer[position] == ',':
+                    self._state = 'key'
+                elif buffer[position] == '}':
+                    self._state = 'done'
+                else:
+                    raise ValueError(f"expected ',' or '}}' at offset {position}")
+                self._position += 1
+        self._key = key
+
+        if final and self._state != 'done':
+            raise ValueError("catalog JSON ended unexpectedly")
+        return pairs
+
+
+class CatalogDelta:
+    """Difference between the current catalog and a freshly downloaded one."""
+
+    def __init__(self, added, removed, changed):
+        self.added = added  # title -> url
+        self.removed = removed  # set of titles
+        self.changed = changed  # title -> new url
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def __str__(self):
+        return f"+{len(self.added)} -{len(self.removed)} ~{len(self.changed)}"
+
+    @classmethod
+    def compute(cls, old_movies, new_movies):
+        added, changed = {}, {}
+        for title, url in new_movies.items():
+            old_url = old_movies.get(title)
+            if old_url is None:
+                added[title] = url
+            elif old_url != str(url):
+                changed[title] = url
+        removed = {title for title in old_movies if title not in new_movies}
+        return cls(added, removed, changed)
+
+
+# Hash of a compact catalog's content; hashes the whole catalog, so keep it off the event loop
+def catalog_fingerprint(movies):
+    return hashlib.blake2b(movies.to_bytes(), digest_size=16).hexdigest()
+
+
+class CatalogSnapshot:
+    """Read-only view of the movie catalog as it was at one refresh."""
+
+    def __init__(self, movies, version=0, source=None, loaded_at=None, index=None, fingerprint=None):
+        self.movies = movies  # title -> url mapping, normally a CompactCatalog
+        self.index = index if index is not None else SearchIndex(movies.keys())
+        self.version = version
+        self.source = source
+        self.loaded_at = loaded_at
+        self._fingerprint = fingerprint
+
+    def compact(self):
+        if isinstance(self.movies, CompactCatalog):
+            return self.movies
+        return CompactCatalog.from_mapping(self.movies)
+
+    @property
+    def fingerprint(self):
+        """Hash of the catalog content; unlike ``version`` it is the same on every replica.
+
+        ``CatalogStore`` computes it off the event loop before serving a
+        snapshot, so searches never pay for it.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = catalog_fingerprint(self.compact())
+        return self._fingerprint
+
+    def __len__(self):
+        return len(self.movies)
+
+    def __bool__(self):
+        return bool(self.movies)
+
+
+class CatalogStore:
+    """Process-wide owner of the movie catalog.
+
+    The catalog is downloaded once at startup and then refreshed in the
+    background. Readers only ever see a complete snapshot: a refresh builds
+    a new ``CatalogSnapshot`` and swaps the reference in one assignment, and
+    a failed refresh leaves the last good snapshot in place. Every new
+    snapshot is also saved to ``snapshot_path`` together with its search
+    index, so a restart can serve it immediately via ``load_from_disk``.
+    """
+
+    def __init__(self, urls, snapshot_path=CATALOG_SNAPSHOT_PATH):
+        self.urls = [url for url in urls if url]
+        self.snapshot_path = snapshot_path  # None disables the on-disk copy
+        self._snapshot = CatalogSnapshot({})
+        self._validators = {}  # url -> {'etag': ..., 'last_modified': ...}
+        self._refresh_lock = asyncio.Lock()  # one refresh or sync changes the snapshot at a time
+        self._flight = SingleFlight()
+        self.last_refresh_at = None
+        self.last_refresh_ok = False
+        self._listeners = []
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def add_listener(self, callback, prepare=None):
+        """Call ``callback(old_snapshot, new_snapshot, delta, prepared)`` right after every swap.
+
+        ``delta`` is None when the new snapshot was built from scratch.
+        Callbacks run synchronously, before any reader can see a mix of the
+        two versions, so they can patch caches keyed on the version. They
+        must be quick: slow work belongs in ``prepare(old_snapshot, delta)``,
+        a coroutine awaited before the swap whose result is passed on as
+        ``prepared`` (None without a ``prepare``, or if it failed).
+        """
+        self._listeners.append((callback, prepare))
+
+    async def load_from_disk(self):
+        """Serve the snapshot saved by a previous run, if there is one.
+
+        The file is memory-mapped and its index reused as is; only the
+        fingerprint is computed, in a worker thread. Returns True when a
+        snapshot was loaded.
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            movies, index, metadata = load_snapshot(self.snapshot_path)
+            fingerprint = await asyncio.to_thread(catalog_fingerprint, movies)
+        except Exception as e:
+            logger.error(f"Ignoring unreadable catalog snapshot {self.snapshot_path}: {e}")
+            return False
+
+        self._validators = metadata.get('validators') or {}
+        self._snapshot = CatalogSnapshot(
+            movies,
+            version=metadata['version'],
+            source=metadata.get('source'),
+            loaded_at=metadata.get('loaded_at'),
+            index=index,
+            fingerprint=fingerprint,
+        )
+        logger.info(f"💾 Catalog snapshot v{self._snapshot.version} loaded from {self.snapshot_path} ({len(movies)} titles)")
+        return bool(self._snapshot)
+
+    async def _persist(self, snapshot):
+        if not self.snapshot_path:
+            return
+        try:
+            await asyncio.to_thread(save_snapshot, self.snapshot_path, snapshot, self._validators)
+        except Exception as e:
+            logger.error(f"Error saving catalog snapshot to {self.snapshot_path}: {e}")
+
+    # Build the conditional request headers for a URL we have fetched before
+    def _conditional_headers(self, url):
+        headers = {}
+        validators = self._validators.get(url, {})
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    # Fetch one URL; returns (status, url, data) where status is 'ok', 'not_modified' or 'failed'
+    async def _fetch(self, url):
+        session = get_session()
+        timeout = aiohttp.ClientTimeout(total=CATALOG_FETCH_TIMEOUT)
+        for attempt in range(3):  # Retry 3 times
+            try:
+                async with session.get(url, headers=self._conditional_headers(url), timeout=timeout) as response:
+                    if response.status == 304:
+                        return 'not_modified', url, None
+                    response.raise_for_status()
+                    # Parse the body while it streams in; mirrors do not always send application/json
+                    data = {}
+                    parser = JSONObjectStream()
+                    async for chunk in response.content.iter_chunked(CATALOG_CHUNK_SIZE):
+                        data.update(parser.feed(chunk))
+                    data.update(parser.feed(b"", final=True))
+                    self._validators[url] = {
+                        'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified'),
+                    }
+                    return 'ok', url, data
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning(f"Attempt {attempt + 1} failed for URL {url}: {e}")
+                if attempt < 2:  # Don't sleep on the last attempt
+                    # Exponential backoff with jitter: ~1s, ~2s
+                    await asyncio.sleep(2 ** attempt + random.uniform(0, 0.5))
+        return 'failed', url, None
+
+    # Is this fetch result something we can serve?
+    def _is_good(self, status, url, data):
+        if status == 'ok':
+            return bool(data)
+        return status == 'not_modified' and bool(self._snapshot) and self._snapshot.source == url
+
+    # Race the mirrors: start with the primary, and bring in the next mirror
+    # whenever the running ones fail or have not answered within the hedge delay.
+    # The first good response wins and the other requests are cancelled.
+    async def _fetch_hedged(self):
+        pending = set()
+        remaining = list(self.urls)
+        try:
+            while remaining or pending:
+                if remaining:
+                    pending.add(asyncio.create_task(self._fetch(remaining.pop(0))))
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=CATALOG_HEDGE_DELAY if remaining else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    result = task.result()
+                    if self._is_good(*result):
+                        return result
+            return 'failed', None, None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # Pack the parsed JSON into the compact representation and index it,
+    # reusing the current index for everything the delta does not touch
+    @staticmethod
+    def _build(data, old_snapshot, delta):
+        movies = CompactCatalog.from_mapping(data)
+        if delta is not None:
+            return movies, old_snapshot.index.updated(movies, data, delta)
+        return movies, SearchIndex(movies)
+
+    async def _swap(self, data, source, fingerprint=None):
+        old_snapshot = self._snapshot
+        # Validators only make sense for the source the snapshot came from
+        validators = {source: self._validators.get(source, {})}
+
+        delta = None
+        if old_snapshot:
+            delta = await asyncio.to_thread(CatalogDelta.compute, old_snapshot.movies, data)
+            if not delta:
+                logger.info(f"Catalog from {source} has no changes, keeping snapshot v{old_snapshot.version}")
+                self._validators = validators
+                return
+            if len(delta) > len(old_snapshot) // 2:
+                delta = None  # Mostly new content, a full rebuild is cheaper
+
+        # Build off the event loop; readers keep using the old snapshot until the swap
+        movies, index = await asyncio.to_thread(self._build, data, old_snapshot, delta)
+        if fingerprint is None:
+            # Hash now rather than on the first search that needs it
+            fingerprint = await asyncio.to_thread(catalog_fingerprint, movies)
+        prepared = []
+        for _, prepare in self._listeners:
+            result = None
+            if prepare is not None:
+                try:
+                    result = await prepare(old_snapshot, delta)
+                except Exception as e:
+                    logger.error(f"Catalog listener preparation failed: {e}")
+            prepared.append(result)
+        self._validators = validators
+        self._snapshot = CatalogSnapshot(
+            movies,
+            version=old_snapshot.version + 1,
+            source=source,
+            loaded_at=time.time(),
+            index=index,
+            fingerprint=fingerprint,
+        )
+        for (callback, _), result in zip(self._listeners, prepared):
+            try:
+                callback(old_snapshot, self._snapshot, delta, result)
+            except Exception as e:
+                logger.error(f"Catalog listener failed: {e}")
+        if delta is not None:
+            logger.info(f"📚 Catalog snapshot v{self._snapshot.version} updated from {source} ({delta}, {len(movies)} titles)")
+        else:
+            logger.info(f"📚 Catalog snapshot v{self._snapshot.version} loaded from {source} ({len(movies)} titles)")
+        await self._persist(self._snapshot)
+
+    async def refresh(self):
+        """Refresh the catalog from whichever mirror answers first.
+
+        Returns True when the store holds a usable snapshot afterwards.
+        Overlapping calls (startup, the periodic job, a manual trigger) join
+        the refresh already running and get its result, so the catalog is
+        never downloaded twice in parallel.
+        """
+        return await self._flight.do("refresh", self._refresh)
+
+    async def _refresh(self):
+        async with self._refresh_lock:
+            self.last_refresh_at = time.time()
+            status, url, data = await self._fetch_hedged()
+            if status == 'not_modified':
+                logger.info(f"Catalog at {url} not modified, keeping snapshot v{self._snapshot.version}")
+                self.last_refresh_ok = True
+                return True
+            if status == 'ok':
+                await self._swap(data, url)
+                self.last_refresh_ok = True
+                return True
+
+            self.last_refresh_ok = False
+            if self._snapshot:
+                logger.error(f"Failed to refresh movie data from all URLs, serving snapshot v{self._snapshot.version}")
+            else:
+                logger.error("Failed to fetch movie data from all URLs")
+            return bool(self._snapshot)
+
+    async def publish(self, backend):
+        """Hand the current snapshot to the other replicas through the shared backend.
+
+        Only the body of a catalog the backend doesn't have yet is uploaded.
+        Returns True when something new was published.
+        """
+        snapshot = self._snapshot
+        if not snapshot:
+            return False
+        fingerprint = snapshot.fingerprint
+        current = await backend.get(SHARED_CATALOG_KEY)
+        if isinstance(current, bytes):
+            current = current.decode()
+        if current == fingerprint:
+            return False
+        body = await asyncio.to_thread(lambda: snapshot.compact().to_bytes())
+        # Body first, so a replica that sees the new fingerprint can always read it
+        await backend.set(f"{SHARED_CATALOG_KEY}:{fingerprint}", body, ttl=SHARED_CATALOG_TTL)
+        await backend.set(SHARED_CATALOG_KEY, fingerprint)
+        logger.info(f"📤 Published catalog v{snapshot.version} ({fingerprint[:8]}, {len(body)} bytes) to the other replicas")
+        return True
+
+    async def sync(self, backend):
+        """Adopt the catalog the leader published, if it differs from ours.
+
+        Returns True when a published catalog exists (now or already served),
+        False when nothing has been published yet.
+        """
+        return await self._flight.do("sync", lambda: self._sync(backend))
+
+    async def _sync(self, backend):
+        async with self._refresh_lock:
+            fingerprint = await backend.get(SHARED_CATALOG_KEY)
+            if fingerprint is None:
+                return False
+            if isinstance(fingerprint, bytes):
+                fingerprint = fingerprint.decode()
+            snapshot = self._snapshot
+            if snapshot and snapshot.fingerprint == fingerprint:
+                return True
+            body = await backend.get(f"{SHARED_CATALOG_KEY}:{fingerprint}")
+            if body is None:
+                return False
+            movies = CompactCatalog.from_buffer(bytes(body))
+            self.last_refresh_at = time.time()
+            await self._swap(movies, "shared", fingerprint=fingerprint)
+            self.last_refresh_ok = True
+            return True
+
+catalog_store = CatalogStore([JSON_URL, FALLBACK_JSON_URL])
@@ -0,0 +1,184 @@
+# compact_catalog.py
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+
+# File layout: header, then four sections in this order:
+#   title offsets (u32 * (count + 1)), title bytes, url offsets (u32 * (count + 1)), url bytes
+# followed by the title lookup order (u32 * count, titles sorted by their UTF-8 bytes).
+MAGIC = b"MCAT"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sII QQ")  # magic, format version, count, title bytes length, url bytes length
+
+
+# Pack strings into one UTF-8 buffer plus a u32 offsets array (count + 1 entries)
+def pack_strings(strings):
+    offsets = array('I', [0])
+    chunks = []
+    position = 0
+    for text in strings:
+        encoded = text.encode('utf-8')
+        chunks.append(encoded)
+        position += len(encoded)
+        offsets.append(position)
+    return offsets, b"".join(chunks)
+
+
+class CompactCatalog(Mapping):
+    """Read-only title -> url mapping stored in a handful of flat buffers.
+
+    Titles and urls live in two contiguous UTF-8 buffers indexed by offset
+    arrays, instead of one Python ``str`` object (and dict slot) per entry.
+    Iteration keeps the upstream catalog order; lookups by title binary
+    search a precomputed sorted order. The buffers can come from
+    ``to_bytes()`` or from an mmap'd file (``open``), so several processes
+    can share one read-only copy.
+    """
+
+    def __init__(self, title_offsets, titles, url_offsets, urls, order, backing=None):
+        self._title_offsets = title_offsets
+        self._titles = titles
+        self._url_offsets = url_offsets
+        self._urls = urls
+        self._order = order
+        self._backing = backing  # keeps an mmap alive while views into it exist
+        self._normalized = None
+
+    @classmethod
+    def from_mapping(cls, movies):
+        items = list(movies.items())
+        title_offsets, titles = pack_strings(title for title, _ in items)
+        url_offsets, urls = pack_strings(str(url) for _, url in items)
+        encoded = [title.encode('utf-8') for title, _ in items]
+        order = array('I', sorted(range(len(items)), key=encoded.__getitem__))
+        return cls(title_offsets, titles, url_offsets, urls, order)
+
+    @classmethod
+    def from_buffer(cls, buffer, backing=None):
+        view = memoryview(buffer)
+        magic, version, count, titles_length, urls_length = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("not a compact catalog buffer")
+        position = HEADER.size
+
+        def take_u32(length):
+            nonlocal position
+            section = view[position:position + 4 * length].cast('I')
+            position += 4 * length
+            return section
+
+        def take_bytes(length):
+            nonlocal position
+            section = view[position:position + length]
+            position += length
+            return section
+
+        title_offsets = take_u32(count + 1)
+        titles = take_bytes(titles_length)
+        url_offsets = take_u32(count + 1)
+        urls = take_bytes(urls_length)
+        order = take_u32(count)
+        return cls(title_offsets, titles, url_offsets, urls, order, backing=backing)
+
+    @classmethod
+    def open(cls, path):
+        """Map a file written by ``write`` read-only into memory."""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls.from_buffer(mapped, backing=mapped)
+
+    def to_bytes(self):
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, len(self), len(self._titles), len(self._urls))
+        return b"".join([
+            header,
+            bytes(memoryview(self._title_offsets).cast('B')),
+            bytes(self._titles),
+            bytes(memoryview(self._url_offsets).cast('B')),
+            bytes(self._urls),
+            bytes(memoryview(self._order).cast('B')),
+        ])
+
+    def write(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    def __len__(self):
+        return len(self._title_offsets) - 1
+
+    def title(self, index):
+        return bytes(self._titles[self._title_offsets[index]:self._title_offsets[index + 1]]).decode('utf-8')
+
+    def url(self, index):
+        return bytes(self._urls[self._url_offsets[index]:self._url_offsets[index + 1]]).decode('utf-8')
+
+    def _title_bytes(self, index):
+        return self._titles[self._title_offsets[index]:self._title_offsets[index + 1]]
+
+    # Position of a title in catalog order, or -1
+    def index_of(self, title):
+        target = title.encode('utf-8')
+        low, high = 0, len(self._order)
+        while low < high:
+            middle = (low + high) // 2
+            candidate = bytes(self._title_bytes(self._order[middle]))
+            if candidate < target:
+                low = middle + 1
+            elif candidate > target:
+                high = middle
+            else:
+                return self._order[middle]
+        return -1
+
+    def __getitem__(self, title):
+        index = self.index_of(title)
+        if index < 0:
+            raise KeyError(title)
+        return self.url(index)
+
+    def __contains__(self, title):
+        return isinstance(title, str) and self.index_of(title) >= 0
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.title(index)
+
+    def normalized_titles(self, normalize):
+        """Normalized title column, computed once and interned.
+
+        Interning means identical normalized titles share one string object,
+        within a snapshot and across snapshots.
+        """
+        if self._normalized is None:
+            self._normalized = [sys.intern(normalize(title)) for title in self]
+        return self._normalized
+
+    @property
+    def nbytes(self):
+        return sum(
+            memoryview(section).nbytes
+            for section in (self._title_offsets, self._titles, self._url_offsets, self._urls, self._order)
+        )
+
+
+class TitleColumn:
+    """Sequence view of a compact catalog's titles, decoded on access."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.catalog.title(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.catalog.title(index)
+
+    def __iter__(self):
+        return iter(self.catalog)
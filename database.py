@@ -1,28 +1,139 @@
 # database.py
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
 import logging
+import asyncio
+import csv
+import gzip
+import io
+import tempfile
+from datetime import datetime, timezone
 
-# Set up MongoDB connection
+logger = logging.getLogger(__name__)
+
+# Set up one async MongoDB connection pool for the whole process
 MONGO_URI = os.getenv('MONGO_URI')  # MongoDB URI from environment variable
-client = MongoClient(MONGO_URI)
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 20))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 1))
+USER_EXPORT_BATCH_SIZE = int(os.getenv('USER_EXPORT_BATCH_SIZE', 1000))  # users per cursor batch and file write
+
+client = AsyncMongoClient(
+    MONGO_URI,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=30000,
+    serverSelectionTimeoutMS=10000,
+    retryWrites=True
+)
 db = client['movie_bot']  # Database name
-users_collection = db['users']  # Collection for storing user data
+users_collection = db['users']  # Users are stored as {"_id": <telegram user id>, "username", "first_name", "blocked"?}
+migrations_collection = db['migrations']  # One document per applied migration
+broadcasts_collection = db['broadcasts']  # One document per /broadcast with its progress checkpoint
+broadcast_deliveries_collection = db['broadcast_deliveries']  # Per-user outcome, _id = "<broadcast id>:<user id>"
+scheduled_deletions_collection = db['scheduled_deletions']  # Messages to delete, _id = "<chat id>:<message id>", with due_at
+user_stats_collection = db['user_stats']  # Daily counters, _id = "YYYY-MM-DD" (UTC), with new_users and active_users
+
+# User fields written by export_users, in column order
+USER_EXPORT_FIELDS = ["_id", "username", "first_name", "blocked", "last_active"]
+
+USER_SHAPE_MIGRATION = "merge_user_id_documents"
+
+
+# One-time migration: older code stored users as {"user_id": <id>} with a generated _id.
+# Fold those into the {"_id": <id>} shape used everywhere now.
+async def migrate_user_documents(batch_size=1000):
+    if await migrations_collection.find_one({"_id": USER_SHAPE_MIGRATION}):
+        return 0
+
+    logger.info("Migrating legacy user documents to the _id schema...")
+    merged = 0
+    operations = []
+    legacy_ids = []
+    cursor = users_collection.find({"user_id": {"$exists": True}}, {"user_id": 1})
+    async for doc in cursor:
+        if doc["_id"] == doc["user_id"]:
+            continue
+        operations.append(UpdateOne({"_id": doc["user_id"]}, {"$setOnInsert": {"username": None, "first_name": None}}, upsert=True))
+        legacy_ids.append(doc["_id"])
+        if len(operations) >= batch_size:
+            merged += await _merge_legacy_batch(operations, legacy_ids)
+            operations, legacy_ids = [], []
+    if operations:
+        merged += await _merge_legacy_batch(operations, legacy_ids)
+
+    await migrations_collection.insert_one({"_id": USER_SHAPE_MIGRATION, "applied_at": datetime.now(timezone.utc), "merged": merged})
+    logger.info(f"User migration complete: {merged} legacy documents merged")
+    return merged
+
+
+async def _merge_legacy_batch(operations, legacy_ids):
+    try:
+        await users_collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        logger.error(f"Error merging legacy user documents: {e.details}")
+        raise
+    # Only drop the legacy documents once their users exist in the new shape
+    await users_collection.delete_many({"_id": {"$in": legacy_ids}})
+    return len(legacy_ids)
 
-logger = logging.getLogger(__name__)
 
 # Function to save user ID to MongoDB
-def save_user_id(user_id):
-    if users_collection.count_documents({"user_id": user_id}) == 0:
-        users_collection.insert_one({"user_id": user_id})
+async def save_user_id(user_id, username=None, first_name=None):
+    result = await users_collection.update_one(
+        {"_id": user_id},
+        {"$setOnInsert": {"username": username, "first_name": first_name}},
+        upsert=True
+    )
+    if result.upserted_id is not None:
         logger.info(f"New user added to MongoDB: {user_id}")
     else:
         logger.info(f"User {user_id} already exists in MongoDB.")
 
-# Function to load all user IDs from MongoDB
-def load_user_ids():
-    user_ids = [user['user_id'] for user in users_collection.find()]
-    return set(user_ids)
+
+# Function to stream user IDs from MongoDB batch by batch, without holding them all in memory
+async def iter_user_ids(batch_size=USER_EXPORT_BATCH_SIZE):
+    async for user in users_collection.find({}, {"_id": 1}).batch_size(batch_size):
+        yield user['_id']
+
+
+# Function to count registered users from collection metadata (no collection scan)
+async def count_users():
+    return await users_collection.estimated_document_count()
+
+
+# Function to stream every user into a gzipped CSV file at ``path``; returns the number of users written.
+# Rows are compressed and written one cursor batch at a time, off the event loop.
+async def export_users(path, batch_size=USER_EXPORT_BATCH_SIZE):
+    projection = {field: 1 for field in USER_EXPORT_FIELDS}
+    rows = io.StringIO()
+    writer = csv.writer(rows)
+    writer.writerow(["user_id"] + USER_EXPORT_FIELDS[1:])
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        async for user in users_collection.find({}, projection).batch_size(batch_size):
+            writer.writerow([user.get(field, "") for field in USER_EXPORT_FIELDS])
+            count += 1
+            if count % batch_size == 0:
+                await asyncio.to_thread(f.write, rows.getvalue())
+                rows.seek(0)
+                rows.truncate()
+        await asyncio.to_thread(f.write, rows.getvalue())
+    return count
+
+
+# Function to reserve a temporary file for a user export; the caller removes it
+def new_export_path():
+    fd, path = tempfile.mkstemp(prefix="users-", suffix=".csv.gz")
+    os.close(fd)
+    return path
+
+
+# Function to read the precomputed daily user counters, newest day first
+async def daily_user_stats(days=7):
+    cursor = user_stats_collection.find({}).sort("_id", -1).limit(days)
+    return [doc async for doc in cursor]
+
 
 # Function to check if a user is subscribed to the channel
 async def is_user_subscribed(user_id: int, context):
@@ -36,7 +147,7 @@ async def is_user_subscribed(user_id: int, context):
 # Function to add user ID to MongoDB
 async def add_user_id(update):
     user_id = update.message.chat_id
-    save_user_id(user_id)
+    await save_user_id(user_id)
     logger.info(f"New user added: {user_id}")
 
 # Function to handle broadcasting message to all users in MongoDB
@@ -44,8 +155,7 @@ async def broadcast_message(update, context):
     if update.message.chat_id == int(os.getenv('ADMIN_USER_ID')):
         message = " ".join(context.args)
         if message:
-            user_ids = load_user_ids()  # Load user IDs from MongoDB
-            for user_id in user_ids:
+            async for user_id in iter_user_ids():  # Stream user IDs from MongoDB
                 try:
                     await context.bot.send_message(chat_id=user_id, text=message)
                 except Exception as e:
@@ -56,11 +166,19 @@ async def broadcast_message(update, context):
     else:
         await update.message.reply_text("Unauthorized! Only the admin can use this command.")
 
-# Function to list all users in MongoDB
+# Function to send the list of all users in MongoDB as a gzipped CSV document
 async def user_list_command(update, context):
     if update.message.chat_id == int(os.getenv('ADMIN_USER_ID')):
-        user_ids = load_user_ids()  # Load user IDs from MongoDB
-        user_list = "\n".join(map(str, user_ids))
-        await update.message.reply_text(f"List of connected users:\n{user_list or 'No users connected.'}\nTotal count: {len(user_ids)}")
+        path = new_export_path()
+        try:
+            count = await export_users(path)
+            with open(path, "rb") as f:
+                await update.message.reply_document(document=f, filename="users.csv.gz", caption=f"Total count: {count}")
+        finally:
+            os.remove(path)
     else:
         await update.message.reply_text("Unauthorized! Only the admin can use this command.")
+
+
+async def close():
+    await client.close()
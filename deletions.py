@@ -0,0 +1,215 @@
+# deletions.py
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut, NetworkError
+
+from ratelimit import TokenBucket, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# Deletion scheduler settings
+DELETION_TICK = float(os.getenv('DELETION_TICK', 1))  # seconds per wheel slot
+DELETION_RATE = float(os.getenv('DELETION_RATE', 20))  # deleteMessages calls per second
+DELETION_RETRY_DELAY = 30  # seconds before retrying a batch that failed on a network error
+DELETION_MAX_ATTEMPTS = 3
+DELETION_PULL_LIMIT = 5000  # most due entries the leader takes from MongoDB per tick
+DELETE_MESSAGES_LIMIT = 100  # most message ids the Bot API accepts in one deleteMessages call
+
+
+class DeletionScheduler:
+    """Deletes messages at their due time, in batches, and across restarts.
+
+    ``schedule`` puts a message into a timing wheel: one slot per ``tick``
+    seconds of due time, holding message ids grouped by chat. Every tick
+    the due slots are drained and each chat's messages are removed with one
+    ``delete_messages`` call per 100 ids, paced by a token bucket that
+    RetryAfter pauses. Every entry is also written to MongoDB (batched, once
+    per tick) and removed from it after the delete, so ``start`` restores
+    whatever an earlier process left pending; overdue messages go on the
+    first tick.
+
+    With several replicas pass ``is_leader``: ``schedule`` then only writes
+    to MongoDB, and each tick the leader alone pulls the due entries from
+    there and deletes them, whichever replica scheduled them.
+    """
+
+    def __init__(self, bot, collection, tick=DELETION_TICK, rate=DELETION_RATE, is_leader=None):
+        self.bot = bot
+        self.collection = collection
+        self.tick = tick
+        self.is_leader = is_leader
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self._wheel = defaultdict(lambda: defaultdict(set))  # slot -> chat id -> message ids
+        self._unsaved = {}  # store key -> write not yet flushed to MongoDB
+        self._task = None
+        self.deleted = 0
+        self.failed = 0
+
+    @property
+    def pending(self):
+        return sum(len(message_ids) for chats in self._wheel.values() for message_ids in chats.values())
+
+    def _add(self, chat_id, message_id, due):
+        self._wheel[int(due // self.tick)][chat_id].add(message_id)
+
+    def schedule(self, chat_id, message_id, delay):
+        """Delete ``message_id`` from ``chat_id`` in ``delay`` seconds."""
+        # Wall-clock due times, so they still mean something after a restart
+        due = time.time() + delay
+        if self.is_leader is None:
+            self._add(chat_id, message_id, due)
+        self._unsaved[f"{chat_id}:{message_id}"] = UpdateOne(
+            {"_id": f"{chat_id}:{message_id}"},
+            {"$set": {"chat_id": chat_id, "message_id": message_id, "due_at": datetime.fromtimestamp(due, timezone.utc)}},
+            upsert=True
+        )
+
+    async def load(self):
+        """Put every deletion recorded in MongoDB back on the wheel."""
+        loaded = overdue = 0
+        now = time.time()
+        async for doc in self.collection.find({}, {"chat_id": 1, "message_id": 1, "due_at": 1}):
+            # Stored datetimes come back naive, in UTC
+            due = doc["due_at"].replace(tzinfo=timezone.utc).timestamp()
+            self._add(doc["chat_id"], doc["message_id"], due)
+            loaded += 1
+            overdue += due <= now
+        if loaded:
+            logger.info(f"🗑️ Restored {loaded} scheduled deletions ({overdue} overdue)")
+        return loaded
+
+    # Shared mode: put the entries that are due by now on the wheel
+    async def _pull_due(self, now):
+        cursor = self.collection.find(
+            {"due_at": {"$lte": datetime.fromtimestamp(now, timezone.utc)}},
+            {"chat_id": 1, "message_id": 1}
+        ).limit(DELETION_PULL_LIMIT)
+        async for doc in cursor:
+            self._add(doc["chat_id"], doc["message_id"], now)
+
+    async def _save(self):
+        if not self._unsaved:
+            return
+        batch, self._unsaved = self._unsaved, {}
+        saved = False
+        try:
+            await self.collection.bulk_write(list(batch.values()), ordered=False)
+            saved = True
+        except Exception as e:
+            logger.error(f"Error saving {len(batch)} scheduled deletions, will retry: {e}")
+        finally:
+            # Also when cancelled mid-write, so stop() still saves them
+            if not saved:
+                for key, operation in batch.items():
+                    self._unsaved.setdefault(key, operation)
+
+    # Returns True when the messages are gone or can never be deleted, False to retry later
+    async def _delete(self, chat_id, message_ids):
+        for attempt in range(DELETION_MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await self.bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+                self.deleted += len(message_ids)
+                return True
+            except RetryAfter as e:
+                retry_after = retry_after_seconds(e)
+                logger.warning(f"Deletions hit flood control, pausing {retry_after}s")
+                self.bucket.pause(retry_after)
+            except (BadRequest, Forbidden) as e:
+                # Too old to delete, already gone, or the user blocked the bot
+                logger.warning(f"Could not delete {len(message_ids)} messages in chat {chat_id}: {e}")
+                self.failed += len(message_ids)
+                return True
+            except (TimedOut, NetworkError) as e:
+                if attempt == DELETION_MAX_ATTEMPTS - 1:
+                    logger.error(f"Error deleting messages in chat {chat_id}, will retry: {e}")
+                    return False
+                await asyncio.sleep(2 ** attempt)
+        return False
+
+    async def sweep(self, now=None):
+        """Delete everything that is due; returns the number of messages handled."""
+        await self._save()
+
+        now = now or time.time()
+        if self.is_leader is not None:
+            if not self.is_leader():
+                return 0
+            await self._pull_due(now)
+
+        now_slot = int(now // self.tick)
+        due = defaultdict(set)
+        for slot in [slot for slot in self._wheel if slot <= now_slot]:
+            for chat_id, message_ids in self._wheel.pop(slot).items():
+                due[chat_id] |= message_ids
+        if not due:
+            return 0
+
+        batches = []
+        for chat_id, message_ids in due.items():
+            message_ids = sorted(message_ids)
+            for start in range(0, len(message_ids), DELETE_MESSAGES_LIMIT):
+                batches.append((chat_id, message_ids[start:start + DELETE_MESSAGES_LIMIT]))
+        outcomes = await asyncio.gather(*(self._delete(chat_id, message_ids) for chat_id, message_ids in batches))
+
+        finished = []
+        retry = []
+        retry_at = time.time() + DELETION_RETRY_DELAY
+        for (chat_id, message_ids), done in zip(batches, outcomes):
+            if done:
+                finished.extend(f"{chat_id}:{message_id}" for message_id in message_ids)
+            elif self.is_leader is None:
+                for message_id in message_ids:
+                    self._add(chat_id, message_id, retry_at)
+            else:
+                retry.extend(f"{chat_id}:{message_id}" for message_id in message_ids)
+        if retry:
+            # Shared mode keeps the wheel in MongoDB, so postpone them there
+            try:
+                await self.collection.update_many(
+                    {"_id": {"$in": retry}},
+                    {"$set": {"due_at": datetime.fromtimestamp(retry_at, timezone.utc)}}
+                )
+            except Exception as e:
+                logger.error(f"Error postponing {len(retry)} deletions: {e}")
+        if finished:
+            try:
+                await self.collection.delete_many({"_id": {"$in": finished}})
+            except Exception as e:
+                # Harmless: they are deleted again (and skipped by Telegram) after a restart
+                logger.error(f"Error clearing {len(finished)} finished deletions: {e}")
+        return sum(len(message_ids) for _, message_ids in batches)
+
+    async def _run(self):
+        while True:
+            # Wake up at the start of the next slot
+            await asyncio.sleep(self.tick - time.time() % self.tick)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Error in deletion sweep: {e}")
+
+    async def start(self):
+        if self._task is None:
+            try:
+                if self.is_leader is None:
+                    await self.load()
+                else:
+                    await self.collection.create_index("due_at")
+            except Exception as e:
+                logger.error(f"Error loading scheduled deletions: {e}")
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop sweeping and save what is still pending; the next start picks it up."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._save()
@@ -0,0 +1,154 @@
+# diagnostics.py
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Diagnostics settings
+DIAGNOSTICS_ENABLED = os.getenv('DIAGNOSTICS', '0') == '1'  # start the stall watchdog at startup
+SLOW_CALLBACK_THRESHOLD = float(os.getenv('SLOW_CALLBACK_THRESHOLD', 0.25))  # seconds
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))  # seconds
+PROFILE_MAX_SECONDS = 120
+
+
+# Label one frame for a collapsed stack line; ';' separates frames so it must not appear
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+# Root-first list of frame labels for a thread's current stack
+def _stack_labels(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class LoopWatchdog:
+    """Logs the stack of whatever is blocking the event loop.
+
+    A task on the loop stamps a heartbeat every few milliseconds and a
+    daemon thread watches it. When the heartbeat is older than
+    ``threshold`` the loop thread is stuck in one callback, so the thread
+    grabs that thread's current stack and logs it, once per stall.
+    """
+
+    def __init__(self, threshold=SLOW_CALLBACK_THRESHOLD):
+        self.threshold = threshold
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def _heartbeat(self):
+        interval = min(0.05, self.threshold / 4)
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(interval)
+
+    def _watch(self):
+        stalled_beat = None  # heartbeat at which the current stall was reported
+        while not self._stop.wait(self.threshold / 4):
+            beat = self._beat
+            stalled_for = time.monotonic() - beat
+            if stalled_for < self.threshold:
+                if stalled_beat is not None:
+                    logger.warning(f"🐢 Event loop unblocked after about {beat - stalled_beat:.3f}s")
+                stalled_beat = None
+                continue
+            if stalled_beat is not None:
+                continue
+            stalled_beat = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+            logger.warning(f"🐢 Event loop blocked for {stalled_for:.3f}s (threshold {self.threshold}s) in:\n{stack}")
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Loop watchdog started (threshold {self.threshold}s)")
+
+    def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        self._stop.set()
+        self._thread = None
+        logger.info("Loop watchdog stopped")
+
+
+class StackSampler:
+    """Statistical profiler for one thread, normally the event loop thread.
+
+    Samples the thread's stack every ``interval`` seconds from a separate
+    thread and aggregates identical stacks. ``collapsed`` returns the result
+    in the collapsed-stack format understood by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+
+    def run(self, duration):
+        """Sample for ``duration`` seconds; blocking, run it in a thread."""
+        deadline = time.monotonic() + duration
+        this_thread = threading.get_ident()
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None and self.thread_id != this_thread:
+                self.stacks[";".join(_stack_labels(frame))] += 1
+                self.samples += 1
+            del frame
+            time.sleep(self.interval)
+        return self
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+# Profile the event loop thread for `duration` seconds without blocking it
+async def profile_event_loop(duration, interval=PROFILE_SAMPLE_INTERVAL):
+    sampler = StackSampler(threading.get_ident(), interval)
+    await asyncio.to_thread(sampler.run, duration)
+    return sampler
+
+
+# Parse "30s", "2m" or "45" into seconds
+def parse_duration(text):
+    text = text.strip().lower()
+    multiplier = 1
+    if text.endswith("ms"):
+        text, multiplier = text[:-2], 0.001
+    elif text.endswith("s"):
+        text = text[:-1]
+    elif text.endswith("m"):
+        text, multiplier = text[:-1], 60
+    return float(text) * multiplier
+
+
+loop_watchdog = LoopWatchdog()
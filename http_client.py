@@ -0,0 +1,32 @@
+# http_client.py
+import logging
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# One pooled session for all outgoing HTTP calls (catalog mirrors, keep-alive pings)
+_session = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the process-wide aiohttp session, creating it on first use.
+
+    Must be called from inside the running event loop.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=20, limit_per_host=4, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=30, connect=10)
+        )
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("Shared HTTP session closed")
+    _session = None
@@ -0,0 +1,77 @@
+# ingest.py
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Webhook ingestion settings
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 8))  # 0 processes updates inside the webhook request
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))  # total queued updates across workers
+
+
+# Updates from the same chat must be handled in order; fall back to the user, then the update itself
+def ordering_key(update):
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return update.update_id
+
+
+class UpdateDispatcher:
+    """Bounded in-process queue between the webhook endpoint and the handlers.
+
+    Updates are sharded over ``workers`` queues by chat, so one chat's
+    updates are processed in arrival order while different chats run in
+    parallel. ``submit`` never waits: when a shard is full it returns False
+    and the webhook answers with an error so Telegram redelivers later.
+    """
+
+    def __init__(self, process_update, workers=WEBHOOK_WORKERS, maxsize=WEBHOOK_QUEUE_SIZE):
+        self.process_update = process_update
+        self.workers = workers
+        self.queues = [asyncio.Queue(maxsize=max(1, maxsize // workers)) for _ in range(workers)]
+        self._tasks = []
+        self.rejected = 0
+
+    @property
+    def depth(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+    def submit(self, update):
+        queue = self.queues[hash(ordering_key(update)) % self.workers]
+        try:
+            queue.put_nowait(update)
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+    async def _worker(self, queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.process_update(update)
+            except Exception as e:
+                logger.error(f"Error processing update {update.update_id}: {e}")
+            finally:
+                queue.task_done()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self.queues]
+            logger.info(f"Webhook dispatcher started with {self.workers} workers")
+
+    async def stop(self, timeout=10):
+        """Let the workers finish what is queued (up to ``timeout`` seconds), then stop them."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self.depth} queued updates at shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
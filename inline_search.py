@@ -0,0 +1,67 @@
+# inline_search.py
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Inline mode settings
+INLINE_DEBOUNCE = int(os.getenv('INLINE_DEBOUNCE_MS', 350)) / 1000  # wait for the user to stop typing
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 300))  # seconds Telegram may reuse an answer
+INLINE_MIN_QUERY_LENGTH = int(os.getenv('INLINE_MIN_QUERY_LENGTH', 2))
+
+
+class InlineDebouncer:
+    """Runs only the latest inline query of each user.
+
+    Telegram sends a new inline query for nearly every keystroke. ``submit``
+    cancels whatever is still pending for that user (sleeping out the
+    debounce delay, or already searching) and schedules the new one after
+    ``delay`` seconds, so a burst of keystrokes costs one search and one
+    answer. Work runs in its own task, so the update handler returns at once
+    and the next keystroke is not queued behind it.
+    """
+
+    def __init__(self, delay=INLINE_DEBOUNCE):
+        self.delay = delay
+        self._tasks = {}  # user id -> task for the newest query
+        self.superseded = 0
+
+    @property
+    def pending(self):
+        return len(self._tasks)
+
+    def submit(self, user_id, work):
+        """Schedule ``work()`` (a coroutine function) as ``user_id``'s newest query."""
+        self.cancel(user_id)
+        task = asyncio.create_task(self._run(work))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda done: self._forget(user_id, done))
+        return task
+
+    def cancel(self, user_id):
+        previous = self._tasks.pop(user_id, None)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            self.superseded += 1
+
+    def _forget(self, user_id, task):
+        if self._tasks.get(user_id) is task:
+            del self._tasks[user_id]
+
+    async def _run(self, work):
+        if self.delay > 0:
+            await asyncio.sleep(self.delay)
+        try:
+            await work()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error answering inline query: {e}")
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
@@ -0,0 +1,190 @@
+# metrics.py
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# How often the event loop lag probe runs
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 0.5))  # seconds
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Every metric registers itself here in creation order; /metrics renders them all
+REGISTRY = []
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter; one value per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        for labelvalues, value in self.values.items():
+            yield self.name, _format_labels(self.labelnames, labelvalues), value
+
+
+class Gauge:
+    """Value that goes up and down. With ``callback`` it is read at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self.values = {}
+        REGISTRY.append(self)
+
+    def set(self, value, *labelvalues):
+        self.values[labelvalues] = value
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {e}")
+                return
+            if isinstance(value, dict):
+                for labelvalues, item in value.items():
+                    if not isinstance(labelvalues, tuple):
+                        labelvalues = (labelvalues,)
+                    yield self.name, _format_labels(self.labelnames, labelvalues), item
+            else:
+                yield self.name, "", value
+            return
+        for labelvalues, value in self.values.items():
+            yield self.name, _format_labels(self.labelnames, labelvalues), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # labelvalues -> [bucket counts..., +Inf count, sum]
+        REGISTRY.append(self)
+
+    def observe(self, value, *labelvalues):
+        series = self.values.get(labelvalues)
+        if series is None:
+            series = self.values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def samples(self):
+        for labelvalues, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, labelvalues, ("le", _format_value(bound))), cumulative
+            yield f"{self.name}_count", _format_labels(self.labelnames, labelvalues), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labelvalues), series[-1]
+
+
+def render():
+    """Render every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Search pipeline and handler metrics
+SEARCH_STAGE_SECONDS = Histogram(
+    "bot_search_stage_seconds",
+    "Time spent in each stage of a search",
+    ["stage"]
+)
+HANDLER_UPDATES = Counter("bot_handler_updates_total", "Updates handled, by handler", ["handler"])
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Handler run time", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Exceptions raised by handlers", ["handler", "error"])
+SEARCH_REPLIES = Counter("bot_search_replies_total", "Search replies, by path (fast: one message, slow: loading message then edit)", ["path"])
+ADMISSION_REJECTIONS = Counter("bot_admission_rejections_total", "Searches turned away by flood control", ["reason"])
+BOT_ERRORS = Counter("bot_errors_total", "Errors seen by the global error handler", ["error"])
+LOOP_LAG_SECONDS = Histogram(
+    "bot_event_loop_lag_seconds",
+    "How late the event loop ran a timer that should have fired immediately",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+LOOP_LAG_LAST = Gauge("bot_event_loop_lag_last_seconds", "Most recent event loop lag sample")
+
+
+# Time one stage of the search pipeline: `with stage_timer("fuzzy_match"): ...`
+def stage_timer(stage):
+    return SEARCH_STAGE_SECONDS.time(stage)
+
+
+# Wrap a telegram handler callback so it is counted, timed and its errors classified
+def instrument_handler(name, callback):
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        HANDLER_UPDATES.inc(name)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+# Continuously measure event loop lag: sleep for a fixed interval and see how late we wake up
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        LOOP_LAG_SECONDS.observe(lag)
+        LOOP_LAG_LAST.set(lag)
@@ -0,0 +1,61 @@
+# ratelimit.py
+import asyncio
+import time
+
+
+# Seconds a Telegram RetryAfter asks us to wait; PTB gives either a number or a timedelta
+def retry_after_seconds(error):
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else retry_after
+
+
+class TokenBucket:
+    """Async token bucket: ``rate`` tokens per second, bursts up to ``capacity``.
+
+    ``pause`` empties the bucket for a while, e.g. when Telegram answers
+    with RetryAfter, so every caller sharing the bucket backs off together.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated_at = clock()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+        return now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens without waiting; returns False if there are not enough."""
+        now = self._refill()
+        if now < self.paused_until or self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    async def acquire(self, tokens=1):
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                now = self._refill()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        now = self._refill()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        # Start refilling only once the pause is over
+        self.updated_at = self.paused_until
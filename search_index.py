@@ -0,0 +1,313 @@
+# search_index.py
+import asyncio
+import heapq
+import logging
+import os
+import sys
+from array import array
+from collections import Counter
+
+from fuzzywuzzy import process, utils
+
+from compact_catalog import CompactCatalog, TitleColumn
+
+try:
+    import numpy as np
+    from rapidfuzz import fuzz as rf_fuzz, process as rf_process
+except ImportError:  # rapidfuzz is optional
+    np = None
+    rf_process = None
+
+logger = logging.getLogger(__name__)
+
+# How many trigram candidates get full fuzzy scoring per query
+SEARCH_CANDIDATE_LIMIT = int(os.getenv('SEARCH_CANDIDATE_LIMIT', 300))
+# Which scoring backend to use: 'fuzzywuzzy' (default) or 'rapidfuzz'
+SEARCH_SCORER = os.getenv('SEARCH_SCORER', 'fuzzywuzzy')
+# How long a batched scorer waits for more queries before scoring a burst
+SEARCH_BATCH_WINDOW = float(os.getenv('SEARCH_BATCH_WINDOW_MS', 5)) / 1000
+
+
+# Normalize a title or query the same way fuzzywuzzy's default processor does
+def normalize(text):
+    return utils.full_process(text, force_ascii=True)
+
+
+# Character trigrams of a normalized string, padded so word boundaries count
+def trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Fuzzy search index over the titles of one catalog snapshot.
+
+    Built once per snapshot. A trigram inverted index picks the titles that
+    share the most character trigrams with the query, and only those get the
+    full ``process.extract`` scoring. Candidates are scored in catalog order,
+    so scores and tie-breaking match a full scan whenever the right titles
+    make it into the candidate set. The actual scoring is delegated to a
+    scorer backend (see ``get_scorer``).
+    """
+
+    def __init__(self, titles, candidate_limit=SEARCH_CANDIDATE_LIMIT):
+        if isinstance(titles, CompactCatalog):
+            # Decode titles on demand and share the catalog's interned normalized column
+            self.titles = TitleColumn(titles)
+            self.normalized = titles.normalized_titles(normalize)
+        else:
+            self.titles = list(titles)
+            self.normalized = [normalize(title) for title in self.titles]
+        self.candidate_limit = candidate_limit
+
+        postings = {}
+        gram_counts = array('H')
+        for title_id, text in enumerate(self.normalized):
+            grams = trigrams(text)
+            gram_counts.append(min(len(grams), 0xFFFF))
+            for gram in grams:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('I')
+                posting.append(title_id)
+        self.postings = postings
+        self.gram_counts = gram_counts
+
+    @classmethod
+    def from_parts(cls, catalog, normalized, postings, gram_counts, candidate_limit=SEARCH_CANDIDATE_LIMIT):
+        """Reassemble an index saved with a catalog snapshot, without re-indexing."""
+        index = cls.__new__(cls)
+        index.titles = TitleColumn(catalog)
+        index.normalized = normalized
+        index.candidate_limit = candidate_limit
+        index.postings = postings
+        index.gram_counts = gram_counts
+        return index
+
+    def updated(self, catalog, movies, delta):
+        """Index for ``catalog`` built by applying ``delta`` to this index.
+
+        ``movies`` is the new title -> url mapping in catalog order. Titles
+        that survive keep their normalized text and trigrams; only their ids
+        are remapped. Added titles are indexed from scratch. URL changes do
+        not affect the index at all.
+        """
+        new_ids = {title: new_id for new_id, title in enumerate(movies)}
+        id_map = array('i', [-1]) * len(self.titles)
+        normalized = [None] * len(new_ids)
+        gram_counts = array('H', [0]) * len(new_ids)
+        for old_id, title in enumerate(self.titles):
+            new_id = new_ids.get(title, -1)
+            if new_id >= 0:
+                id_map[old_id] = new_id
+                normalized[new_id] = self.normalized[old_id]
+                gram_counts[new_id] = self.gram_counts[old_id]
+
+        postings = {}
+        for gram, posting in self.postings.items():
+            remapped = array('I', [new_id for new_id in map(id_map.__getitem__, posting) if new_id >= 0])
+            if remapped:
+                postings[gram] = remapped
+
+        for title in delta.added:
+            new_id = new_ids[title]
+            text = sys.intern(normalize(title))
+            normalized[new_id] = text
+            grams = trigrams(text)
+            gram_counts[new_id] = min(len(grams), 0xFFFF)
+            for gram in grams:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('I')
+                posting.append(new_id)
+
+        return SearchIndex.from_parts(catalog, normalized, postings, gram_counts, self.candidate_limit)
+
+    def __len__(self):
+        return len(self.titles)
+
+    # Ids of the most promising titles for a normalized query, in catalog order.
+    # WRatio rewards a title that contains the query as much as a query that
+    # contains the title, so rank by the better of the two containment ratios
+    # and break ties on the raw number of shared trigrams.
+    def candidates(self, query):
+        query_grams = trigrams(query)
+        counts = Counter()
+        for gram in query_grams:
+            counts.update(self.postings.get(gram, ()))
+
+        query_count = len(query_grams)
+        gram_counts = self.gram_counts
+
+        def rank(item):
+            title_id, shared = item
+            return (shared / min(query_count, gram_counts[title_id]), shared)
+
+        best = heapq.nlargest(self.candidate_limit, counts.items(), key=rank)
+        return sorted(title_id for title_id, _ in best)
+
+    def search(self, query, limit=6, scorer=None):
+        """Return up to ``limit`` (title, score) pairs, best first."""
+        return (scorer or get_scorer()).extract(self, query, limit)
+
+    def search_many(self, queries, limit=6, scorer=None):
+        """Run several queries at once; one result list per query."""
+        return (scorer or get_scorer()).extract_many(self, queries, limit)
+
+
+class FuzzywuzzyScorer:
+    """Scores trigram candidates one title at a time with fuzzywuzzy's WRatio."""
+
+    name = 'fuzzywuzzy'
+    batched = False
+
+    def extract(self, index, query, limit):
+        if not index.titles:
+            return []
+
+        processed = normalize(query)
+        if len(index.titles) <= index.candidate_limit or len(processed) < 3:
+            # Small catalog or a query too short for trigrams: score everything
+            choices = index.titles
+        else:
+            candidate_ids = index.candidates(processed)
+            if len(candidate_ids) < limit:
+                choices = index.titles
+            else:
+                choices = [index.titles[title_id] for title_id in candidate_ids]
+
+        return process.extract(query, choices, limit=limit)
+
+    def extract_many(self, index, queries, limit):
+        return [self.extract(index, query, limit) for query in queries]
+
+
+class RapidfuzzScorer:
+    """Scores queries against every title in one native ``cdist`` call.
+
+    No candidate pruning: the whole normalized title column is scored in C,
+    and a burst of queries shares a single call. Ties keep catalog order.
+    """
+
+    name = 'rapidfuzz'
+    batched = True
+
+    def __init__(self, workers=1):
+        if rf_process is None:
+            raise RuntimeError("SEARCH_SCORER=rapidfuzz needs the rapidfuzz and numpy packages")
+        self.workers = workers
+
+    def extract(self, index, query, limit):
+        return self.extract_many(index, [query], limit)[0]
+
+    def extract_many(self, index, queries, limit):
+        if not index.titles:
+            return [[] for _ in queries]
+
+        scores = rf_process.cdist(
+            [normalize(query) for query in queries],
+            index.normalized,
+            scorer=rf_fuzz.WRatio,
+            processor=None,
+            dtype=np.uint8,
+            workers=self.workers,
+        )
+        results = []
+        for row in scores:
+            # Stable sort on the negated scores keeps catalog order among ties
+            top = np.argsort(-row.astype(np.int16), kind='stable')[:limit]
+            results.append([(index.titles[title_id], int(row[title_id])) for title_id in top])
+        return results
+
+
+SCORERS = {
+    'fuzzywuzzy': FuzzywuzzyScorer,
+    'rapidfuzz': RapidfuzzScorer,
+}
+_scorers = {}
+
+
+# Get a scorer instance by name; defaults to the configured SEARCH_SCORER
+def get_scorer(name=None):
+    name = name or SEARCH_SCORER
+    if name not in _scorers:
+        if name not in SCORERS:
+            raise ValueError(f"Unknown search scorer {name!r}, expected one of {sorted(SCORERS)}")
+        _scorers[name] = SCORERS[name]()
+    return _scorers[name]
+
+
+class SearchBatcher:
+    """Collects searches that arrive together and scores them in one call.
+
+    Only worth it with a batched scorer: the first query of a burst waits
+    up to ``window`` seconds for company, then the whole group is scored
+    against the snapshot it was submitted with. ``runner`` does the actual
+    scoring; by default it runs on the event loop, a ``SearchPool`` moves it
+    to worker processes.
+    """
+
+    def __init__(self, scorer=None, window=SEARCH_BATCH_WINDOW, max_batch=32, runner=None):
+        self.scorer = scorer or get_scorer()
+        self.window = window
+        self.max_batch = max_batch
+        self.runner = runner or self._run_inline
+        self._pending = {}  # snapshot version -> (snapshot, [(query, limit, future)])
+        self._flush_handles = {}
+        self._tasks = set()  # running batches, referenced so they aren't garbage-collected
+
+    async def _run_inline(self, snapshot, queries, limit):
+        return self.scorer.extract_many(snapshot.index, queries, limit)
+
+    async def search(self, snapshot, query, limit=6):
+        if not self.scorer.batched:
+            return (await self.runner(snapshot, [query], limit))[0]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = snapshot.version
+        _, batch = self._pending.setdefault(key, (snapshot, []))
+        batch.append((query, limit, future))
+
+        if len(batch) >= self.max_batch:
+            self._flush(key)
+        elif key not in self._flush_handles:
+            self._flush_handles[key] = loop.call_later(self.window, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        handle = self._flush_handles.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+        snapshot, batch = self._pending.pop(key, (None, []))
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(snapshot, batch))
+            self._tasks.add(task)
+            task.add_done_callback(lambda done: self._batch_done(done, batch))
+
+    # Forget a finished batch; if it died, log why and fail the searches still waiting on it
+    def _batch_done(self, task, batch):
+        self._tasks.discard(task)
+        waiting = [future for _, _, future in batch if not future.done()]
+        if task.cancelled():
+            for future in waiting:
+                future.cancel()
+            return
+        error = task.exception()
+        if error is not None:
+            logger.error(f"Search batch of {len(batch)} queries failed: {error}")
+            for future in waiting:
+                future.set_exception(error)
+
+    async def _run_batch(self, snapshot, batch):
+        limit = max(item[1] for item in batch)
+        try:
+            results = await self.runner(snapshot, [item[0] for item in batch], limit)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, item_limit, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result[:item_limit])
@@ -0,0 +1,93 @@
+# search_pool.py
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from compact_catalog import CompactCatalog
+from search_index import SearchIndex, get_scorer
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes for fuzzy matching; 0 keeps matching on the event loop
+SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', 0))
+
+# Per-worker state: each process keeps its own index for the newest snapshot it has seen
+_worker_version = None
+_worker_index = None
+
+
+# Runs inside a worker process
+def _worker_search(version, catalog_path, queries, limit, scorer_name):
+    global _worker_version, _worker_index
+    if _worker_version != version:
+        # Map the shared catalog file read-only; the OS page cache holds one copy for all workers
+        _worker_index = SearchIndex(CompactCatalog.open(catalog_path))
+        _worker_version = version
+    return _worker_index.search_many(queries, limit, scorer=get_scorer(scorer_name))
+
+
+class SearchPool:
+    """Runs fuzzy matching in a pool of worker processes.
+
+    The event loop only awaits results. Every snapshot's compact catalog is
+    written once to a file in a private temp directory; workers mmap it and
+    build their own index the first time they see a new snapshot version.
+    """
+
+    def __init__(self, workers=SEARCH_WORKERS, scorer_name=None):
+        self.workers = workers
+        self.scorer_name = scorer_name or get_scorer().name
+        # Spawn instead of fork: the parent has a running event loop and threads
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        self._dir = tempfile.mkdtemp(prefix='movie-search-')
+        self._published = {}  # version -> catalog file path
+        self._publish_lock = asyncio.Lock()
+
+    def _write_catalog(self, snapshot):
+        path = os.path.join(self._dir, f"catalog-v{snapshot.version}.bin")
+        tmp_path = f"{path}.tmp"
+        movies = snapshot.movies
+        if not isinstance(movies, CompactCatalog):
+            movies = CompactCatalog.from_mapping(movies)
+        movies.write(tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
+    # Make a snapshot available to the workers, keeping the previous one for in-flight jobs
+    async def _publish(self, snapshot):
+        path = self._published.get(snapshot.version)
+        if path:
+            return path
+        async with self._publish_lock:
+            path = self._published.get(snapshot.version)
+            if path:
+                return path
+            path = await asyncio.to_thread(self._write_catalog, snapshot)
+            self._published[snapshot.version] = path
+            for version in sorted(self._published)[:-2]:
+                old_path = self._published.pop(version)
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+            logger.info(f"Published catalog v{snapshot.version} to {self.workers} search workers")
+            return path
+
+    async def search_many(self, snapshot, queries, limit=6):
+        path = await self._publish(snapshot)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, _worker_search,
+            snapshot.version, path, list(queries), limit, self.scorer_name
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self._dir, ignore_errors=True)
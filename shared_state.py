@@ -0,0 +1,214 @@
+# shared_state.py
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+# Multi-instance settings
+MULTI_INSTANCE = os.getenv('MULTI_INSTANCE', '0') == '1'  # several replicas behind one webhook URL
+SHARED_STATE_URL = os.getenv('SHARED_STATE_URL', 'memory://')  # redis://host:6379/0 for real replicas
+INSTANCE_ID = os.getenv('INSTANCE_ID') or f"{socket.gethostname()}-{os.getpid()}"
+LEADER_LEASE_TTL = float(os.getenv('LEADER_LEASE_TTL', 30))  # seconds a leader may go silent before another takes over
+SHARED_LOCAL_TTL = int(os.getenv('SHARED_LOCAL_TTL', 60))  # seconds a replica trusts its local copy of shared entries
+
+
+class MemoryBackend:
+    """In-process stand-in for Redis with the same small API.
+
+    Only shared between objects of one process, so it is what single
+    instance runs and tests use; several "replicas" in one test simply
+    share one ``MemoryBackend``.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._data = {}  # key -> (value, expires_at or None)
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= self.clock():
+            del self._data[key]
+            return None
+        return value
+
+    def _expiry(self, ttl):
+        return self.clock() + ttl if ttl else None
+
+    async def get(self, key):
+        return self._live(key)
+
+    async def set(self, key, value, ttl=None):
+        self._data[key] = (value, self._expiry(ttl))
+
+    async def delete(self, key):
+        self._data.pop(key, None)
+
+    async def set_if_absent(self, key, value, ttl=None):
+        if self._live(key) is not None:
+            return False
+        self._data[key] = (value, self._expiry(ttl))
+        return True
+
+    async def renew(self, key, value, ttl):
+        if self._live(key) != value:
+            return False
+        self._data[key] = (value, self._expiry(ttl))
+        return True
+
+    async def release(self, key, value):
+        if self._live(key) != value:
+            return False
+        del self._data[key]
+        return True
+
+    async def close(self):
+        pass
+
+
+# Compare-and-set scripts so only the current owner can extend or drop a lease
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisBackend:
+    """Shared state in Redis (``pip install redis``), for real multi-replica runs."""
+
+    def __init__(self, url):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("SHARED_STATE_URL points at Redis but the redis package is not installed")
+        self._redis = redis.from_url(url)
+        self._renew = self._redis.register_script(_RENEW_SCRIPT)
+        self._release = self._redis.register_script(_RELEASE_SCRIPT)
+
+    @staticmethod
+    def _ms(ttl):
+        return int(ttl * 1000) if ttl else None
+
+    async def get(self, key):
+        return await self._redis.get(key)
+
+    async def set(self, key, value, ttl=None):
+        await self._redis.set(key, value, px=self._ms(ttl))
+
+    async def delete(self, key):
+        await self._redis.delete(key)
+
+    async def set_if_absent(self, key, value, ttl=None):
+        return bool(await self._redis.set(key, value, px=self._ms(ttl), nx=True))
+
+    async def renew(self, key, value, ttl):
+        return bool(await self._renew(keys=[key], args=[value, self._ms(ttl)]))
+
+    async def release(self, key, value):
+        return bool(await self._release(keys=[key], args=[value]))
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+# Pick the backend for a SHARED_STATE_URL
+def create_backend(url=SHARED_STATE_URL):
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+
+# JSON helpers for values shared between replicas
+async def get_json(backend, key):
+    value = await backend.get(key)
+    return json.loads(value) if value is not None else None
+
+
+async def set_json(backend, key, value, ttl=None):
+    await backend.set(key, json.dumps(value), ttl)
+
+
+class Lease:
+    """Exclusive, expiring claim on a key: whoever sets it first owns it until it expires."""
+
+    def __init__(self, backend, key, owner=INSTANCE_ID, ttl=LEADER_LEASE_TTL):
+        self.backend = backend
+        self.key = key
+        self.owner = owner
+        self.ttl = ttl
+
+    async def acquire(self):
+        return await self.backend.set_if_absent(self.key, self.owner, self.ttl)
+
+    async def renew(self):
+        return await self.backend.renew(self.key, self.owner, self.ttl)
+
+    async def release(self):
+        return await self.backend.release(self.key, self.owner)
+
+
+class LeaderElection:
+    """Lease-based leader election between replicas.
+
+    Every replica tries to take the ``leader`` lease; the one that gets it
+    renews it every third of its TTL and is the leader until it stops
+    renewing. Singleton work checks ``is_leader`` before running. A replica
+    that can't reach the backend steps down, so at worst a job is skipped
+    for one lease period, never run twice in parallel for longer than that.
+    """
+
+    def __init__(self, backend, owner=INSTANCE_ID, ttl=LEADER_LEASE_TTL, name="leader"):
+        self.lease = Lease(backend, f"lease:{name}", owner, ttl)
+        self.is_leader = False
+        self._task = None
+
+    async def _campaign(self):
+        while True:
+            try:
+                if self.is_leader:
+                    still_leader = await self.lease.renew()
+                    if not still_leader:
+                        logger.warning(f"👑 Lost leadership ({self.lease.owner})")
+                else:
+                    still_leader = await self.lease.acquire()
+                    if still_leader:
+                        logger.info(f"👑 {self.lease.owner} is now the leader")
+                self.is_leader = still_leader
+            except Exception as e:
+                if self.is_leader:
+                    logger.error(f"Leader lease unreachable, stepping down: {e}")
+                self.is_leader = False
+            await asyncio.sleep(self.lease.ttl / 3)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._campaign())
+
+    async def stop(self):
+        """Stop campaigning and hand the lease over right away."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await self.lease.release()
+            except Exception as e:
+                logger.error(f"Error releasing leader lease: {e}")
@@ -0,0 +1,33 @@
+# singleflight.py
+import asyncio
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers share its result.
+
+    The first caller for a key starts ``func()`` as a task, later callers
+    with the same key await that task instead of starting their own. The
+    task is shielded, so a caller that gives up (or is cancelled) does not
+    cancel the work for the others. Once it finishes the key is free again.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> task
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    async def do(self, key, func):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
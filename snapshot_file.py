@@ -0,0 +1,122 @@
+# snapshot_file.py
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from compact_catalog import CompactCatalog, pack_strings
+from search_index import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# Where the last good catalog snapshot is kept between restarts
+CATALOG_SNAPSHOT_PATH = os.getenv('CATALOG_SNAPSHOT_PATH', 'catalog_snapshot.bin')
+
+# File layout: header, JSON metadata, then named sections, each 8-byte aligned.
+#   header:   magic, format version, metadata length, section count
+#   sections: table of (name, offset, length) followed by the section bytes
+MAGIC = b"MSNP"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sIII")
+SECTION_ENTRY = struct.Struct("<16sQQ")
+
+
+def _align(position):
+    return (position + 7) & ~7
+
+
+def _index_sections(index):
+    normalized_offsets, normalized = pack_strings(index.normalized)
+    grams = list(index.postings)
+    gram_offsets, gram_bytes = pack_strings(grams)
+    posting_offsets = array('I', [0])
+    posting_ids = array('I')
+    for gram in grams:
+        posting_ids.extend(index.postings[gram])
+        posting_offsets.append(len(posting_ids))
+    return {
+        'norm_offsets': normalized_offsets,
+        'norm': normalized,
+        'gram_counts': array('H', index.gram_counts),
+        'gram_offsets': gram_offsets,
+        'grams': gram_bytes,
+        'posting_offsets': posting_offsets,
+        'posting_ids': posting_ids,
+    }
+
+
+def save_snapshot(path, snapshot, validators=None):
+    """Write a catalog snapshot and its search index to ``path`` atomically."""
+    movies = snapshot.movies
+    if not isinstance(movies, CompactCatalog):
+        movies = CompactCatalog.from_mapping(movies)
+    sections = {'catalog': movies.to_bytes()}
+    sections.update(_index_sections(snapshot.index))
+
+    metadata = json.dumps({
+        'version': snapshot.version,
+        'source': snapshot.source,
+        'loaded_at': snapshot.loaded_at,
+        'validators': validators or {},
+    }).encode('utf-8')
+
+    table_start = HEADER.size + len(metadata)
+    position = _align(table_start + SECTION_ENTRY.size * len(sections))
+    table = []
+    for name, data in sections.items():
+        length = memoryview(data).nbytes
+        table.append((name, position, length))
+        position = _align(position + length)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(metadata), len(sections)))
+        f.write(metadata)
+        for name, offset, length in table:
+            f.write(SECTION_ENTRY.pack(name.encode('ascii'), offset, length))
+        for (name, offset, length) in table:
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(memoryview(sections[name]).cast('B'))
+    os.replace(tmp_path, path)
+
+
+def _unpack_strings(offsets, blob):
+    return [sys.intern(bytes(blob[offsets[i]:offsets[i + 1]]).decode('utf-8')) for i in range(len(offsets) - 1)]
+
+
+def load_snapshot(path):
+    """Map a snapshot file and rebuild the snapshot around it without re-indexing.
+
+    Returns (movies, index, metadata). The catalog and posting lists stay
+    in the mapped file; only the normalized titles and the trigram keys are
+    decoded into Python strings.
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    magic, version, metadata_length, section_count = HEADER.unpack_from(view, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"{path} is not a catalog snapshot (format {version})")
+    metadata = json.loads(bytes(view[HEADER.size:HEADER.size + metadata_length]))
+
+    sections = {}
+    position = HEADER.size + metadata_length
+    for _ in range(section_count):
+        name, offset, length = SECTION_ENTRY.unpack_from(view, position)
+        sections[name.rstrip(b"\0").decode('ascii')] = view[offset:offset + length]
+        position += SECTION_ENTRY.size
+
+    movies = CompactCatalog.from_buffer(sections['catalog'], backing=mapped)
+    normalized = _unpack_strings(sections['norm_offsets'].cast('I'), sections['norm'])
+    grams = _unpack_strings(sections['gram_offsets'].cast('I'), sections['grams'])
+    posting_offsets = sections['posting_offsets'].cast('I')
+    posting_ids = sections['posting_ids'].cast('I')
+    postings = {
+        gram: posting_ids[posting_offsets[i]:posting_offsets[i + 1]]
+        for i, gram in enumerate(grams)
+    }
+    index = SearchIndex.from_parts(movies, normalized, postings, sections['gram_counts'].cast('H'))
+    return movies, index, metadata
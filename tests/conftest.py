@@ -0,0 +1,22 @@
+# tests/conftest.py
+import os
+import tempfile
+
+import pytest
+
+
+# Import bot.py against mongomock, with just the settings it needs at import time
+@pytest.fixture(scope="session")
+def bot_module():
+    for name, value in {
+        "BOT_TOKEN": "100000001:TEST-TOKEN",
+        "ADMIN_USER_ID": "1",
+        "CHANNEL_USERNAME": "@test_channel",
+        "CATALOG_SNAPSHOT_PATH": os.path.join(tempfile.mkdtemp(prefix="bot-tests-"), "catalog_snapshot.bin"),
+    }.items():
+        os.environ.setdefault(name, value)
+
+    from bench.fakes import install_mongomock
+    install_mongomock()
+    import bot
+    return bot
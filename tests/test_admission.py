@@ -0,0 +1,105 @@
+# tests/test_admission.py
+import asyncio
+from types import SimpleNamespace
+
+from admission import ADMITTED, DUPLICATE, RATE_LIMITED, AdmissionControl, Busy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeMessage:
+    """Just enough of a telegram Message for the search handlers."""
+
+    def __init__(self, user_id, text):
+        self.chat_id = user_id
+        self.message_id = 1
+        self.text = text
+        self.from_user = SimpleNamespace(id=user_id, username=None, first_name="Test")
+        self.replies = []
+
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        self.replies.append(text)
+        return SimpleNamespace(message_id=len(self.replies) + 1, text=text)
+
+
+def test_repeat_is_dropped_within_window():
+    clock = FakeClock()
+    control = AdmissionControl(rate=100, burst=100, repeat_window=10, clock=clock)
+    assert control.check(7, "matrix") == ADMITTED
+    assert control.check(7, "matrix") == DUPLICATE
+    clock.now += 11
+    assert control.check(7, "matrix") == ADMITTED
+
+
+def test_rate_limit_after_burst():
+    clock = FakeClock()
+    control = AdmissionControl(rate=1, burst=2, repeat_window=0, clock=clock)
+    assert [control.check(7, f"q{i}") for i in range(3)] == [ADMITTED, ADMITTED, RATE_LIMITED]
+
+
+def test_forget_lets_the_same_query_through():
+    control = AdmissionControl(rate=100, burst=100, repeat_window=10, clock=FakeClock())
+    assert control.check(7, "matrix") == ADMITTED
+    control.forget(7, "other")  # only the user's last query is forgotten
+    assert control.check(7, "matrix") == DUPLICATE
+    control.forget(7, "matrix")
+    assert control.check(7, "matrix") == ADMITTED
+
+
+def test_slot_raises_busy_when_full():
+    async def run():
+        control = AdmissionControl(max_inflight=1, wait=0.01)
+        async with control.slot():
+            try:
+                async with control.slot():
+                    pass
+            except Busy:
+                return True
+        return False
+
+    assert asyncio.run(run())
+
+
+def test_retry_after_busy_is_not_dropped_as_duplicate(bot_module, monkeypatch):
+    bot = bot_module
+    control = AdmissionControl(rate=100, burst=100, max_inflight=1, wait=0.01, repeat_window=10)
+    monkeypatch.setattr(bot, "admission", control)
+
+    async def subscribed(user_id, context):
+        return True
+    monkeypatch.setattr(bot, "is_user_subscribed", subscribed)
+
+    async def run():
+        message = FakeMessage(42, "the matrix")
+        update = SimpleNamespace(message=message, callback_query=None)
+        async with control.slot():  # every slot is taken: the search is turned away
+            await bot.search_movie(update, SimpleNamespace())
+            await bot.search_movie(update, SimpleNamespace())
+        return message.replies
+
+    assert asyncio.run(run()) == [bot.BUSY_TEXT, bot.BUSY_TEXT]
+
+
+def test_retry_after_subscribe_prompt_is_not_dropped(bot_module, monkeypatch):
+    bot = bot_module
+    control = AdmissionControl(rate=100, burst=100, repeat_window=10)
+    monkeypatch.setattr(bot, "admission", control)
+
+    async def not_subscribed(user_id, context):
+        return False
+    monkeypatch.setattr(bot, "is_user_subscribed", not_subscribed)
+
+    async def run():
+        message = FakeMessage(43, "the matrix")
+        update = SimpleNamespace(message=message, callback_query=None)
+        await bot.search_movie(update, SimpleNamespace())
+        await bot.search_movie(update, SimpleNamespace())
+        return message.replies
+
+    assert len(asyncio.run(run())) == 2
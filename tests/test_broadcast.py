@@ -0,0 +1,117 @@
+# tests/test_broadcast.py
+import asyncio
+
+import mongomock
+from telegram.error import RetryAfter
+
+import broadcast
+import database
+from bench.fakes import AsyncCollection
+from broadcast import BroadcastEngine
+from shared_state import MemoryBackend
+
+LEASE_TTL = 0.3  # shorter than the flood-control pause below
+
+
+class FloodedBot:
+    """Bot whose first message hits flood control for ``retry_after`` seconds."""
+
+    def __init__(self, retry_after, on_flood=None):
+        self.retry_after = retry_after
+        self.on_flood = on_flood
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if self.retry_after:
+            retry_after, self.retry_after = self.retry_after, 0
+            if self.on_flood:
+                await self.on_flood()
+            raise RetryAfter(retry_after)
+        self.sent.append(chat_id)
+
+
+def use_fresh_database(monkeypatch, user_ids):
+    db = mongomock.MongoClient()["movie_bot"]
+    for name in ("users", "broadcasts", "broadcast_deliveries"):
+        monkeypatch.setattr(database, f"{name}_collection", AsyncCollection(db[name]))
+    db["users"].insert_many([{"_id": user_id} for user_id in user_ids])
+    monkeypatch.setattr(broadcast, "BROADCAST_LEASE_TTL", LEASE_TTL)
+    return db
+
+
+def test_lease_outlives_a_flood_control_pause(monkeypatch):
+    db = use_fresh_database(monkeypatch, [1, 2, 3])
+
+    async def run():
+        backend = MemoryBackend()
+        bot = FloodedBot(retry_after=1)
+        engine = BroadcastEngine(bot, rate=100, concurrency=1, shared=backend)
+        broadcast_id = await engine.start("hello")
+        await asyncio.sleep(LEASE_TTL * 2)
+        # Mid-pause the lease is still held, so another replica leaves the broadcast alone
+        other = BroadcastEngine(FloodedBot(retry_after=0), shared=backend)
+        assert await other.resume_interrupted() == 0
+        await asyncio.gather(*engine.tasks.values())
+        return bot, broadcast_id
+
+    bot, broadcast_id = asyncio.run(run())
+    assert sorted(bot.sent) == [1, 2, 3]
+    doc = db["broadcasts"].find_one()
+    assert (doc["status"], doc["sent"], doc["last_user_id"]) == ("done", 3, 3)
+
+
+def test_lost_lease_stops_sending(monkeypatch):
+    db = use_fresh_database(monkeypatch, [1, 2, 3])
+
+    async def run():
+        backend = MemoryBackend()
+        engine = None
+
+        async def take_over():
+            # Another replica grabs the lease while this one waits out flood control
+            await backend.set(engine._lease_key(broadcast_id), "other-replica")
+
+        bot = FloodedBot(retry_after=1, on_flood=take_over)
+        engine = BroadcastEngine(bot, rate=100, concurrency=1, shared=backend)
+        broadcast_id = await engine.start("hello")
+        await asyncio.gather(*engine.tasks.values())
+        return bot, backend, engine._lease_key(broadcast_id)
+
+    bot, backend, lease_key = asyncio.run(run())
+    assert bot.sent == []
+    doc = db["broadcasts"].find_one()
+    assert (doc["status"], doc["last_user_id"]) == ("running", None)
+    # The lease belongs to the new owner and was not released by the old one
+    assert asyncio.run(backend.get(lease_key)) == "other-replica"
+
+
+class SlowBot:
+    def __init__(self, sent):
+        self.sent = sent
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(0.001)
+        self.sent.append(chat_id)
+
+
+def test_resumed_broadcast_skips_users_reached_before_a_stop(monkeypatch):
+    db = use_fresh_database(monkeypatch, range(1, 51))
+
+    async def run():
+        sent = []
+        engine = BroadcastEngine(SlowBot(sent), rate=10000, concurrency=1)
+        await engine.start("hello")
+        while len(sent) < 25:
+            await asyncio.sleep(0.001)
+        # Shutdown in the middle of a batch
+        await engine.stop()
+
+        resumed = BroadcastEngine(SlowBot(sent), rate=10000, concurrency=1)
+        assert await resumed.resume_interrupted() == 1
+        await asyncio.gather(*resumed.tasks.values())
+        return sent
+
+    sent = asyncio.run(run())
+    assert sorted(sent) == list(range(1, 51))
+    doc = db["broadcasts"].find_one()
+    assert (doc["status"], doc["sent"]) == ("done", 50)
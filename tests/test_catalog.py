@@ -0,0 +1,103 @@
+# tests/test_catalog.py
+import asyncio
+import json
+
+import pytest
+
+from catalog import CatalogDelta, CatalogStore, JSONObjectStream
+from compact_catalog import CompactCatalog
+from search_index import SearchIndex
+
+DOCUMENT = (
+    '{"Movie One (2019)": "https://example.com/1", "size": 1500.0, "ratio": -2.5e-3,'
+    ' "count": 42, "big": 1E+10, "flag": true, "none": null, "Über Film": "https://example.com/ü"}'
+)
+
+
+def stream(chunks):
+    parser = JSONObjectStream()
+    pairs = []
+    for chunk in chunks[:-1]:
+        pairs.extend(parser.feed(chunk))
+    pairs.extend(parser.feed(chunks[-1], final=True))
+    return dict(pairs)
+
+
+def test_every_chunk_boundary_parses_the_same():
+    data = DOCUMENT.encode('utf-8')
+    expected = json.loads(DOCUMENT)
+    for split in range(1, len(data)):
+        assert stream([data[:split], data[split:]]) == expected, data[:split]
+
+
+def test_byte_at_a_time():
+    data = DOCUMENT.encode('utf-8')
+    assert stream([data[i:i + 1] for i in range(len(data))]) == json.loads(DOCUMENT)
+
+
+@pytest.mark.parametrize("chunks, value", [
+    ([b'{"a": 1500.', b'0}'], 1500.0),
+    ([b'{"a": 15', b'00}'], 1500),
+    ([b'{"a": 1e', b'-3}'], 1e-3),
+    ([b'{"a": 1e-', b'3}'], 1e-3),
+    ([b'{"a": -', b'7}'], -7),
+])
+def test_number_split_across_chunks(chunks, value):
+    assert stream(chunks) == {"a": value}
+
+
+def test_number_at_the_end_of_the_final_chunk_is_rejected():
+    parser = JSONObjectStream()
+    parser.feed(b'{"a": 15')
+    with pytest.raises(ValueError):
+        parser.feed(b'', final=True)
+
+
+def test_delta_between_catalogs():
+    old = {"Kept": "https://example.com/1", "Moved": "https://example.com/2", "Gone": "https://example.com/3"}
+    new = {"Kept": "https://example.com/1", "Moved": "https://example.com/22", "New": "https://example.com/4"}
+    delta = CatalogDelta.compute(CompactCatalog.from_mapping(old), new)
+    assert delta.added == {"New": "https://example.com/4"}
+    assert delta.removed == {"Gone"}
+    assert delta.changed == {"Moved": "https://example.com/22"}
+    assert len(delta) == 3 and str(delta) == "+1 -1 ~1"
+    assert not CatalogDelta.compute(CompactCatalog.from_mapping(new), new)
+
+
+def test_updated_index_matches_a_rebuilt_one():
+    old = {f"Movie {number} ({1990 + number % 30})": f"https://example.com/{number}" for number in range(200)}
+    new = dict(old)
+    for number in range(0, 200, 7):
+        del new[f"Movie {number} ({1990 + number % 30})"]
+    new.update({f"Sequel {number} Part Two": f"https://example.com/s{number}" for number in range(20)})
+    new["Movie 1 (1991)"] = "https://example.com/changed"
+
+    old_index = SearchIndex(CompactCatalog.from_mapping(old))
+    catalog = CompactCatalog.from_mapping(new)
+    delta = CatalogDelta.compute(CompactCatalog.from_mapping(old), new)
+    updated = old_index.updated(catalog, new, delta)
+    rebuilt = SearchIndex(catalog)
+
+    assert list(updated.titles) == list(rebuilt.titles)
+    assert list(updated.normalized) == list(rebuilt.normalized)
+    assert list(updated.gram_counts) == list(rebuilt.gram_counts)
+    assert {gram: sorted(ids) for gram, ids in updated.postings.items()} == \
+        {gram: sorted(ids) for gram, ids in rebuilt.postings.items()}
+    for query in ["movie 14", "sequel 3 part two", "Movie 1 (1991)", "part tow"]:
+        assert updated.search(query) == rebuilt.search(query)
+
+
+def test_served_snapshots_come_with_their_fingerprint(tmp_path):
+    path = str(tmp_path / "catalog.bin")
+
+    async def run():
+        store = CatalogStore([], snapshot_path=path)
+        await store._swap({"Movie One": "https://example.com/1"}, "test")
+        assert store.snapshot._fingerprint is not None
+
+        restarted = CatalogStore([], snapshot_path=path)
+        assert await restarted.load_from_disk()
+        # Computed while loading, not on the first search that asks for it
+        assert restarted.snapshot._fingerprint == store.snapshot.fingerprint
+
+    asyncio.run(run())
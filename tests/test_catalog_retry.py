@@ -0,0 +1,46 @@
+# tests/test_catalog_retry.py
+import asyncio
+from types import SimpleNamespace
+
+from catalog import CatalogSnapshot
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.scheduled = []
+
+    def run_once(self, callback, when, data=None, name=None):
+        self.scheduled.append((callback, when, data))
+
+
+def run_retry(bot, delay):
+    job_queue = FakeJobQueue()
+    context = SimpleNamespace(job=SimpleNamespace(data=delay), job_queue=job_queue)
+    asyncio.run(bot.retry_catalog_refresh(context))
+    return job_queue.scheduled
+
+
+def test_retry_backs_off_up_to_the_refresh_interval(bot_module, monkeypatch):
+    bot = bot_module
+    refreshes = []
+
+    async def failing_refresh(context=None):
+        refreshes.append(1)
+    monkeypatch.setattr(bot, "refresh_catalog", failing_refresh)
+    monkeypatch.setattr(bot.catalog_store, "_snapshot", CatalogSnapshot({}))
+
+    assert [when for _, when, _ in run_retry(bot, 5)] == [10]
+    assert [when for _, when, _ in run_retry(bot, bot.CATALOG_REFRESH_INTERVAL)] == [bot.CATALOG_REFRESH_INTERVAL]
+    assert len(refreshes) == 2
+
+
+def test_retry_stops_once_the_catalog_loads(bot_module, monkeypatch):
+    bot = bot_module
+    monkeypatch.setattr(bot.catalog_store, "_snapshot", CatalogSnapshot({}))
+
+    async def working_refresh(context=None):
+        bot.catalog_store._snapshot = CatalogSnapshot({"The Matrix (1999)": "https://example.com/m/1"}, version=1)
+    monkeypatch.setattr(bot, "refresh_catalog", working_refresh)
+
+    assert run_retry(bot, 5) == []
+    assert bot.catalog_store.snapshot
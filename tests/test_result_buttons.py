@@ -0,0 +1,23 @@
+# tests/test_result_buttons.py
+import asyncio
+
+
+def button_urls(markup):
+    return [row[0].url for row in markup.inline_keyboard]
+
+
+def test_chat_and_inline_results_carry_the_same_ad_button(bot_module, monkeypatch):
+    bot = bot_module
+    matches = (("Movie One", "https://example.com/1"), ("Movie Two", "https://example.com/2"))
+
+    async def find_movie_matches(movie_name):
+        return matches
+    monkeypatch.setattr(bot, "find_movie_matches", find_movie_matches)
+
+    keyboard = asyncio.run(bot.search_movie_in_json("movie"))
+    inline = bot.build_inline_result(0, "movie", *matches[0])
+
+    for markup, results in ((keyboard, [url for _, url in matches]), (inline.reply_markup, [matches[0][1]])):
+        urls = button_urls(markup)
+        assert urls.count(bot.AD_URL) == 1
+        assert [url for url in urls if url != bot.AD_URL] == results
@@ -0,0 +1,49 @@
+# tests/test_search_batcher.py
+import asyncio
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from search_index import SearchBatcher
+
+SNAPSHOT = SimpleNamespace(version=1)
+
+
+def make_batcher(runner):
+    return SearchBatcher(scorer=SimpleNamespace(batched=True), window=0.01, runner=runner)
+
+
+def test_running_batches_are_referenced_until_done():
+    async def run():
+        done = asyncio.Event()
+
+        async def runner(snapshot, queries, limit):
+            await done.wait()
+            return [[(query, 100)] for query in queries]
+
+        batcher = make_batcher(runner)
+        searches = asyncio.gather(batcher.search(SNAPSHOT, "a"), batcher.search(SNAPSHOT, "b"))
+        await asyncio.sleep(0.05)
+        assert len(batcher._tasks) == 1
+        done.set()
+        results = await searches
+        assert not batcher._tasks
+        return results
+
+    assert asyncio.run(run()) == [[("a", 100)], [("b", 100)]]
+
+
+def test_batch_that_crashes_fails_its_searches_and_is_logged(caplog):
+    async def runner(snapshot, queries, limit):
+        return [None for _ in queries]  # not sliceable, so the batch fails after scoring
+
+    async def run():
+        batcher = make_batcher(runner)
+        with pytest.raises(TypeError):
+            await asyncio.wait_for(batcher.search(SNAPSHOT, "a"), timeout=1)
+        assert not batcher._tasks
+
+    with caplog.at_level(logging.ERROR, logger="search_index"):
+        asyncio.run(run())
+    assert "Search batch of 1 queries failed" in caplog.text
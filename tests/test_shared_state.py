@@ -0,0 +1,149 @@
+# tests/test_shared_state.py
+import asyncio
+
+from cache import SharedResultCache, SubscriptionCache
+from catalog import CatalogStore
+from shared_state import LeaderElection, MemoryBackend
+
+LEASE_TTL = 0.6  # short lease so expiry happens within the test; renewals every 0.2 s
+
+
+def leaders(*elections):
+    return [election.lease.owner for election in elections if election.is_leader]
+
+
+async def start_replicas(backend):
+    first = LeaderElection(backend, owner="replica-1", ttl=LEASE_TTL)
+    second = LeaderElection(backend, owner="replica-2", ttl=LEASE_TTL)
+    first.start()
+    await asyncio.sleep(0.05)
+    second.start()
+    await asyncio.sleep(0.05)
+    return first, second
+
+
+def test_only_one_replica_leads_while_the_lease_is_renewed():
+    async def run():
+        backend = MemoryBackend()
+        first, second = await start_replicas(backend)
+        # Several renewal rounds, well past one TTL
+        for _ in range(5):
+            assert leaders(first, second) == ["replica-1"]
+            await asyncio.sleep(LEASE_TTL / 2)
+        await first.stop()
+        await second.stop()
+    asyncio.run(run())
+
+
+def test_follower_takes_over_when_the_leader_stops_renewing():
+    async def run():
+        backend = MemoryBackend()
+        first, second = await start_replicas(backend)
+        # The leader hangs: it stops renewing but never releases the lease
+        first._task.cancel()
+        await asyncio.sleep(LEASE_TTL / 2)
+        assert leaders(second) == []
+        await asyncio.sleep(LEASE_TTL)
+        assert leaders(second) == ["replica-2"]
+
+        # When the old leader comes back, its renewal fails and it stays a follower
+        first._task = None
+        first.start()
+        await asyncio.sleep(LEASE_TTL / 2)
+        assert leaders(first, second) == ["replica-2"]
+        await first.stop()
+        await second.stop()
+    asyncio.run(run())
+
+
+def test_stop_hands_the_lease_over_before_it_expires():
+    async def run():
+        backend = MemoryBackend()
+        first, second = await start_replicas(backend)
+        await first.stop()
+        assert await backend.get("lease:leader") is None
+        # The follower's next campaign round, not the lease expiry, makes it leader
+        await asyncio.sleep(LEASE_TTL / 3 + 0.05)
+        assert leaders(first, second) == ["replica-2"]
+        await second.stop()
+    asyncio.run(run())
+
+
+def test_replica_steps_down_when_the_backend_is_unreachable():
+    class BrokenBackend(MemoryBackend):
+        broken = False
+
+        async def renew(self, key, value, ttl):
+            if self.broken:
+                raise ConnectionError("backend down")
+            return await super().renew(key, value, ttl)
+
+    async def run():
+        backend = BrokenBackend()
+        election = LeaderElection(backend, owner="replica-1", ttl=LEASE_TTL)
+        election.start()
+        await asyncio.sleep(0.05)
+        assert election.is_leader
+        backend.broken = True
+        await asyncio.sleep(LEASE_TTL / 3 + 0.05)
+        assert not election.is_leader
+        await election.stop()
+    asyncio.run(run())
+
+
+def test_follower_serves_the_catalog_the_leader_published():
+    async def run():
+        backend = MemoryBackend()
+        leader = CatalogStore([], snapshot_path=None)
+        follower = CatalogStore([], snapshot_path=None)
+        assert not await follower.sync(backend)
+
+        await leader._swap({"Movie One": "https://example.com/1", "Movie Two": "https://example.com/2"}, "test")
+        assert await leader.publish(backend)
+        assert not await leader.publish(backend)  # unchanged catalog is not uploaded again
+
+        assert await follower.sync(backend)
+        assert follower.snapshot.fingerprint == leader.snapshot.fingerprint
+        assert follower.snapshot.movies["Movie Two"] == "https://example.com/2"
+        version = follower.snapshot.version
+        assert await follower.sync(backend)
+        assert follower.snapshot.version == version
+
+        await leader._swap({"Movie One": "https://example.com/1", "Movie Three": "https://example.com/3"}, "test")
+        assert await leader.publish(backend)
+        assert await follower.sync(backend)
+        assert "Movie Three" in follower.snapshot.movies
+        assert "Movie Two" not in follower.snapshot.movies
+    asyncio.run(run())
+
+
+def test_subscription_status_is_shared_between_replicas():
+    async def run():
+        backend = MemoryBackend()
+        first = SubscriptionCache(10, 300, 30, shared=backend)
+        second = SubscriptionCache(10, 300, 30, shared=backend)
+        checks = []
+
+        async def check():
+            checks.append(1)
+            return True
+
+        assert await first.get_or_check(42, check)
+        assert await second.get_or_check(42, check)
+        assert len(checks) == 1
+        assert second.shared_hits == 1
+    asyncio.run(run())
+
+
+def test_search_results_are_shared_per_catalog_fingerprint():
+    async def run():
+        backend = MemoryBackend()
+        first = SharedResultCache(backend)
+        second = SharedResultCache(backend)
+        results = [["Movie One", "https://example.com/1"]]
+
+        await first.set("abc", "movie", results)
+        assert await second.get("abc", "movie") == results
+        assert await second.get("def", "movie") is None
+        assert second.hits == 1
+    asyncio.run(run())
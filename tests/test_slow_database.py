@@ -0,0 +1,82 @@
+# tests/test_slow_database.py
+import asyncio
+import gzip
+import time
+
+import mongomock
+from pymongo import AsyncMongoClient, MongoClient
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.synchronous.collection import Collection
+from pymongo.synchronous.database import Database
+
+import database
+from bench.fakes import AsyncCollection
+
+WRITE_LATENCY = 0.1  # each export file write blocks for this long, like a slow disk
+
+
+# Run ``work`` while measuring the longest gap between ticks of a 5 ms timer on the same loop
+async def longest_loop_gap(work):
+    gaps = []
+    last = time.perf_counter()
+
+    async def tick():
+        nonlocal last
+        while True:
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    ticker = asyncio.create_task(tick())
+    try:
+        result = await work
+    finally:
+        ticker.cancel()
+    # A stall at the very end never lets the ticker run again; count it too
+    gaps.append(time.perf_counter() - last)
+    return result, max(gaps)
+
+
+class SlowFile:
+    """Wraps a file so every write blocks the calling thread first."""
+
+    def __init__(self, f):
+        self._f = f
+
+    def write(self, data):
+        time.sleep(WRITE_LATENCY)
+        return self._f.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return self._f.__exit__(*exc)
+
+
+def test_export_writes_the_file_off_the_loop(monkeypatch, tmp_path):
+    db = mongomock.MongoClient()["movie_bot"]
+    db["users"].insert_many({"_id": i, "username": f"user{i}", "first_name": "User"} for i in range(2000))
+    monkeypatch.setattr(database, "users_collection", AsyncCollection(db["users"], latency=0.001))
+    open_gzip = gzip.open
+    monkeypatch.setattr(database.gzip, "open", lambda *args, **kwargs: SlowFile(open_gzip(*args, **kwargs)))
+    path = str(tmp_path / "users.csv.gz")
+
+    exported, gap = asyncio.run(longest_loop_gap(database.export_users(path, batch_size=200)))
+    assert exported == 2000
+    # Eleven blocking writes; on the loop each would stall it for WRITE_LATENCY
+    assert gap < WRITE_LATENCY * 0.8
+    with open_gzip(path, "rt") as f:
+        assert sum(1 for _ in f) == 2001
+
+
+# A blocking PyMongo client would stall every update while it waits on MongoDB;
+# the bot must only reach the database through the async one
+def test_bot_uses_only_the_async_driver(bot_module):
+    assert isinstance(database.client, AsyncMongoClient)
+    assert isinstance(database.db, AsyncDatabase)
+    sync_types = (MongoClient, Database, Collection)
+    for module in (bot_module, database):
+        blocking = [name for name, value in vars(module).items() if isinstance(value, sync_types)]
+        assert blocking == [], f"{module.__name__} holds a blocking PyMongo object: {blocking}"
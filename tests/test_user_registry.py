@@ -0,0 +1,87 @@
+# tests/test_user_registry.py
+import asyncio
+
+import mongomock
+
+import user_registry
+from bench.fakes import AsyncCollection
+from user_registry import UserRegistry
+
+
+class FlakyCollection(AsyncCollection):
+    """Async mongomock collection whose writes fail while ``failing`` is set."""
+
+    def __init__(self, collection):
+        super().__init__(collection)
+        self.failing = False
+
+    def __getattr__(self, name):
+        call = super().__getattr__(name)
+
+        async def maybe_fail(*args, **kwargs):
+            if self.failing:
+                raise ConnectionError("database unavailable")
+            return await call(*args, **kwargs)
+        return maybe_fail
+
+
+def make_registry():
+    db = mongomock.MongoClient()["movie_bot"]
+    stats = FlakyCollection(db["user_stats"])
+    registry = UserRegistry(AsyncCollection(db["users"]), stats)
+    return registry, db, stats
+
+
+def daily(db):
+    return {doc["_id"]: (doc.get("new_users", 0), doc.get("active_users", 0)) for doc in db["user_stats"].find()}
+
+
+def test_counts_each_user_once_per_day(monkeypatch):
+    monkeypatch.setattr(user_registry, "utc_day", lambda: "2026-01-01")
+    registry, db, _ = make_registry()
+
+    async def run():
+        for user_id in [1, 2, 3, 1, 2]:
+            registry.register(user_id)
+        await registry.flush()
+        # A restart (new registry) on the same day sees the same users again
+        again = UserRegistry(registry.collection, registry.stats_collection)
+        for user_id in [1, 4]:
+            again.register(user_id)
+        await again.flush()
+
+    asyncio.run(run())
+    assert daily(db) == {"2026-01-01": (4, 4)}
+
+
+def test_failed_stats_write_keeps_the_counts(monkeypatch):
+    monkeypatch.setattr(user_registry, "utc_day", lambda: "2026-01-01")
+    registry, db, stats = make_registry()
+
+    async def run():
+        for user_id in range(1, 7):
+            registry.register(user_id)
+        stats.failing = True
+        await registry.flush()
+        stats.failing = False
+        await registry.flush()
+
+    asyncio.run(run())
+    assert daily(db) == {"2026-01-01": (6, 6)}
+
+
+def test_activity_across_midnight_counts_for_both_days(monkeypatch):
+    day = ["2026-01-01"]
+    monkeypatch.setattr(user_registry, "utc_day", lambda: day[0])
+    registry, db, _ = make_registry()
+
+    async def run():
+        await registry.collection.insert_one({"_id": 1})
+        registry._seen.add(1)
+        registry.register(1)
+        day[0] = "2026-01-02"
+        registry.register(1)  # before the first day was flushed
+        await registry.flush()
+
+    asyncio.run(run())
+    assert daily(db) == {"2026-01-01": (0, 1), "2026-01-02": (0, 1)}
@@ -0,0 +1,176 @@
+# user_registry.py
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Write-behind settings for user registration
+USER_FLUSH_INTERVAL = float(os.getenv('USER_FLUSH_INTERVAL', 5))  # seconds
+USER_FLUSH_BATCH_SIZE = int(os.getenv('USER_FLUSH_BATCH_SIZE', 500))
+
+
+# The UTC day activity is counted under, as used for daily stats document ids
+def utc_day():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+class UserRegistry:
+    """Write-behind registration of users in an async MongoDB collection.
+
+    ``register`` never touches the database: users already seen by this
+    process are ignored and new ones are queued. A background task upserts
+    the queue with a single ``bulk_write`` every ``flush_interval`` seconds,
+    or sooner once ``batch_size`` users are waiting. ``stop`` drains
+    whatever is still queued.
+
+    With a ``stats_collection`` the same flush keeps daily counters up to
+    date: each user's first activity of a UTC day sets ``last_active`` on
+    their document, and only the documents that update actually changed
+    are added to the day's ``active_users``, so a user is counted once per
+    day across restarts and replicas. New users are added to ``new_users``.
+    """
+
+    def __init__(self, collection, stats_collection=None, flush_interval=USER_FLUSH_INTERVAL, batch_size=USER_FLUSH_BATCH_SIZE):
+        self.collection = collection
+        self.stats_collection = stats_collection
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._seen = set()
+        self._pending = {}  # user_id -> document fields
+        self._day = None
+        self._active = set()  # users already queued as active on self._day
+        self._pending_active = {}  # day -> users active that day, not yet marked in the database
+        self._pending_counts = {}  # day -> {"new_users": n, "active_users": n} not yet added to the stats
+        self._batch_full = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+    def register(self, user_id, username=None, first_name=None):
+        if self.stats_collection is not None:
+            self._mark_active(user_id)
+        if user_id in self._seen:
+            return
+        self._seen.add(user_id)
+        self._pending[user_id] = {"username": username, "first_name": first_name}
+        if len(self._pending) >= self.batch_size:
+            self._batch_full.set()
+
+    def _mark_active(self, user_id):
+        day = utc_day()
+        if day != self._day:
+            self._day = day
+            self._active = set()
+        if user_id not in self._active:
+            self._active.add(user_id)
+            active = self._pending_active.setdefault(day, set())
+            active.add(user_id)
+            if len(active) >= self.batch_size:
+                self._batch_full.set()
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+    async def flush(self):
+        """Upsert everything queued so far and update the daily stats. Failed batches are re-queued."""
+        self._batch_full.clear()
+        written = await self._flush_users()
+        if self._pending_active or self._pending_counts:
+            await self._flush_stats()
+        return written
+
+    async def _flush_users(self):
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+
+        operations = [
+            # A user writing to us again has evidently unblocked the bot
+            UpdateOne({"_id": user_id}, {"$setOnInsert": fields, "$unset": {"blocked": ""}}, upsert=True)
+            for user_id, fields in batch.items()
+        ]
+        try:
+            with stage_timer("db_write"):
+                result = await self.collection.bulk_write(operations, ordered=False)
+            logger.info(f"Registered {result.upserted_count} new users ({len(operations)} upserts)")
+            if self.stats_collection is not None:
+                self._count(utc_day(), "new_users", result.upserted_count)
+            return len(operations)
+        except Exception as e:
+            logger.error(f"Error storing {len(operations)} user IDs, will retry: {e}")
+            # Put the batch back without overwriting anything queued meanwhile
+            for user_id, fields in batch.items():
+                self._pending.setdefault(user_id, fields)
+            return 0
+
+    # Add to a day's counters; they stay queued until the stats write succeeds
+    def _count(self, day, field, amount):
+        if amount:
+            counters = self._pending_counts.setdefault(day, {})
+            counters[field] = counters.get(field, 0) + amount
+
+    async def _flush_stats(self):
+        active, self._pending_active = self._pending_active, {}
+        for day, user_ids in active.items():
+            # Users whose registration is still queued have no document to mark yet
+            waiting = {user_id for user_id in user_ids if user_id in self._pending}
+            if waiting:
+                self._pending_active.setdefault(day, set()).update(waiting)
+            ready = list(user_ids - waiting)
+            if not ready:
+                continue
+            try:
+                result = await self.collection.update_many(
+                    {"_id": {"$in": ready}, "last_active": {"$ne": day}},
+                    {"$set": {"last_active": day}}
+                )
+            except Exception as e:
+                logger.error(f"Error marking {len(ready)} users active, will retry: {e}")
+                self._pending_active.setdefault(day, set()).update(ready)
+                continue
+            # Once last_active is set these users won't match again, so their count must not be lost
+            self._count(day, "active_users", result.modified_count)
+
+        if not self._pending_counts:
+            return
+        counters, self._pending_counts = self._pending_counts, {}
+        try:
+            await self.stats_collection.bulk_write(
+                [UpdateOne({"_id": day}, {"$inc": fields}, upsert=True) for day, fields in counters.items()],
+                ordered=False
+            )
+        except Exception as e:
+            logger.error(f"Error updating daily user stats, will retry: {e}")
+            for day, fields in counters.items():
+                for field, amount in fields.items():
+                    self._count(day, field, amount)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush task and write out everything still queued."""
+        self._stopping = True
+        if self._task:
+            # Wake the flush loop instead of cancelling it, so a write in progress finishes
+            self._batch_full.set()
+            await self._task
+            self._task = None
+        if self._pending or self._pending_active or self._pending_counts:
+            logger.info(f"Draining {len(self._pending)} queued user registrations...")
+            await self.flush()